@@ -0,0 +1,51 @@
+"""
+Money amounts as integer minor units (cents for USD) of an explicit currency.
+
+Amounts are stored, summed and compared as plain ints, so hot paths never
+build Money objects or round floats. Conversions happen only at the edges:
+`to_minor` when an amount arrives from the API, a provider or a statement,
+and `to_decimal` / `to_money` when one leaves for a provider, a response or
+a notification.
+"""
+
+from decimal import Decimal
+from functools import lru_cache
+
+from moneyed import Money, get_currency
+
+DEFAULT_CURRENCY = "USD"
+
+
+@lru_cache
+def minor_unit_places(currency: str) -> int:
+    """
+    Decimal places of a currency's minor unit: 2 for USD, 0 for JPY.
+    """
+    return len(str(get_currency(currency).sub_unit)) - 1
+
+
+def to_minor(amount: Decimal | int | str | Money, currency=DEFAULT_CURRENCY) -> int:
+    """
+    Exact conversion of a major-unit amount to minor units. A Money brings its
+    own currency. Raises ValueError for floats and for amounts finer than the
+    currency's minor unit.
+    """
+    if isinstance(amount, Money):
+        amount, currency = amount.amount, amount.currency.code
+    if isinstance(amount, float):
+        raise ValueError(f"Amount {amount!r} must be a Decimal, not a float")
+    minor = Decimal(amount).scaleb(minor_unit_places(currency))
+    if minor != minor.to_integral_value():
+        raise ValueError(f"Amount {amount} is finer than a {currency} minor unit")
+    return int(minor)
+
+
+def to_decimal(amount_minor: int, currency=DEFAULT_CURRENCY) -> Decimal:
+    """
+    The major-unit amount, with the currency's places: 12345 -> 123.45.
+    """
+    return Decimal(amount_minor).scaleb(-minor_unit_places(currency))
+
+
+def to_money(amount_minor: int, currency=DEFAULT_CURRENCY) -> Money:
+    return Money(to_decimal(amount_minor, currency), currency)
@@ -0,0 +1,203 @@
+import asyncio
+from typing import Dict, List, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from money_movement.amounts import to_decimal
+from money_movement.cache import status_cache
+from money_movement.db import AsyncSession
+from money_movement.idempotency import (
+    idempotency_cache,
+    idempotency_stats,
+    replay,
+    request_hash,
+    stored_key_query,
+)
+from money_movement.listing import encode_cursor, transfers_page_query
+from money_movement.models import (
+    FundAccount,
+    InvestorAccount,
+    FundingTransaction,
+    IdempotencyKey,
+    TransactionState,
+)
+from money_movement.ratelimit import provider_limits_query
+from money_movement.schemas import (
+    FundSummary,
+    StateSummary,
+    TransferPage,
+    TransferSummary,
+)
+from money_movement.summary import fund_summary_query, in_flight
+from money_movement.tasks import process_withdrawal
+
+_OWNER_COLUMNS = {
+    InvestorAccount: FundingTransaction.investor_account_id,
+    FundAccount: FundingTransaction.fund_account_id,
+}
+
+
+async def process_new_transaction(
+    investor_id, fund_id, amount_minor: int, idempotency_key: str | None = None
+) -> Tuple[str, str]:
+    """
+    Create a transfer and queue its withdrawal. With an idempotency key, a
+    repeat of an earlier request returns that request's result instead, and
+    a different request reusing the key is a "conflict".
+    """
+    request = None
+    if idempotency_key is not None:
+        request = request_hash(investor_id, fund_id, amount_minor)
+        stored = idempotency_cache.get(idempotency_key)
+        if stored is not None:
+            idempotency_stats["cache_replays"] += 1
+            return replay(idempotency_key, stored, request)
+
+    async with AsyncSession() as session:
+        investor_exists = await session.scalar(
+            select(InvestorAccount.id).where(InvestorAccount.id == investor_id)
+        )
+        fund_exists = await session.scalar(
+            select(FundAccount.id).where(FundAccount.id == fund_id)
+        )
+        if investor_exists is None or fund_exists is None:
+            return "failure", "Investor or fund account not found"
+
+        transaction = FundingTransaction(
+            investor_account_id=investor_id,
+            fund_account_id=fund_id,
+            amount_minor=amount_minor,
+            state=TransactionState.INITIATED,
+        )
+        session.add(transaction)
+        if idempotency_key is not None:
+            # Inserted without checking first; a used key fails the commit
+            session.add(
+                IdempotencyKey(
+                    key=idempotency_key,
+                    request_hash=request,
+                    funding_transaction=transaction,
+                )
+            )
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            if idempotency_key is None:
+                raise
+            stored = (await session.execute(stored_key_query(idempotency_key))).first()
+            if stored is None:
+                raise
+            idempotency_cache.set(idempotency_key, tuple(stored))
+            idempotency_stats["stored_replays"] += 1
+            return replay(idempotency_key, tuple(stored), request)
+
+    if idempotency_key is not None:
+        idempotency_cache.set(idempotency_key, (request, transaction.id))
+    # Publishing to the broker is blocking, keep it off the event loop
+    await asyncio.to_thread(process_withdrawal.delay, transaction.id)
+    return "success", f"Transfer {transaction.id} initiated"
+
+
+async def transaction_status(transaction_id) -> TransactionState | None:
+    state = status_cache.get(transaction_id)
+    if state is not None:
+        return state
+
+    generation = status_cache.generation
+    async with AsyncSession() as session:
+        state = await session.scalar(
+            select(FundingTransaction.state).where(
+                FundingTransaction.id == transaction_id
+            )
+        )
+    if state is not None:
+        status_cache.set(transaction_id, state, generation)
+    return state
+
+
+async def list_transfers(
+    owner_model,
+    owner_id: int,
+    limit: int,
+    cursor: str | None = None,
+    state: TransactionState | None = None,
+) -> TransferPage | None:
+    """
+    One page of the transfers of an InvestorAccount or FundAccount, newest
+    first. Returns None if the account doesn't exist and raises ValueError
+    for an invalid cursor.
+    """
+    stmt = transfers_page_query(
+        _OWNER_COLUMNS[owner_model], owner_id, limit, cursor=cursor, state=state
+    )
+    async with AsyncSession() as session:
+        owner_exists = await session.scalar(
+            select(owner_model.id).where(owner_model.id == owner_id)
+        )
+        if owner_exists is None:
+            return None
+        rows = (await session.execute(stmt)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created, rows[-1].id)
+    return TransferPage(
+        transfers=[
+            TransferSummary(
+                id=row.id,
+                investor_id=row.investor_account_id,
+                fund_id=row.fund_account_id,
+                amount=to_decimal(row.amount_minor, row.currency),
+                currency=row.currency,
+                state=row.state.value,
+                created=row.created,
+                modified=row.modified,
+            )
+            for row in rows
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+async def fund_summary(fund_id: int) -> FundSummary | None:
+    """
+    A fund's transfer counts and amounts by state, read from the summary
+    table. Returns None if the fund doesn't exist.
+    """
+    async with AsyncSession() as session:
+        fund_exists = await session.scalar(
+            select(FundAccount.id).where(FundAccount.id == fund_id)
+        )
+        if fund_exists is None:
+            return None
+        rows = (await session.scalars(fund_summary_query(fund_id))).all()
+
+    # In workflow order rather than by the stored state names
+    states = list(TransactionState)
+    rows.sort(key=lambda row: states.index(row.state))
+
+    return FundSummary(
+        fund_id=fund_id,
+        states=[
+            StateSummary(
+                state=row.state.value,
+                currency=row.currency,
+                count=row.transfer_count,
+                amount=to_decimal(row.amount_minor, row.currency),
+            )
+            for row in rows
+        ],
+        in_flight=in_flight(rows),
+    )
+
+
+async def provider_limits() -> List[Dict]:
+    """
+    The shared rate and concurrency limits of every provider called so far.
+    """
+    async with AsyncSession() as session:
+        rows = (await session.execute(provider_limits_query())).all()
+    return [row._asdict() for row in rows]
@@ -0,0 +1,290 @@
+"""
+End-to-end benchmark of the funding workflow.
+
+Runs controller.process_new_transaction -> process_withdrawal ->
+withdraw_investor_batch -> complete_withdrawal -> sweep_pending_transactions ->
+deposit_fund_batch -> complete_deposit -> dispatch_notifications with Celery
+in eager mode, against the mock providers and an in-memory or file SQLite
+database. Transfers are driven in phases, like the workers and the sweeper
+would: all are created, then after the provider settlement delay all
+withdrawals are completed, a sweep batches them into one deposit per fund,
+all deposits are completed and finally the notification outbox is drained.
+
+Reports transactions per second, p50/p99 latency and database queries for
+each step as JSON, so runs can be compared:
+
+    python -m money_movement.benchmark --sizes 1000 10000 --output bench.json
+
+With --provider-latency the providers are called over HTTP, through a local
+stand-in server adding that latency to every response, and the report adds
+the requests the server answered and the connections they arrived on.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List
+
+from celery.signals import task_postrun, task_prerun
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from money_movement import controller, tasks
+from money_movement.amounts import to_minor
+from money_movement.db import create_engine_from_url, init_db
+from money_movement.models import (
+    Base,
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    TransactionState,
+)
+from money_movement.services.fund_accounts import (
+    HttpFundAccountsService,
+    MockFundAccountsService,
+)
+from money_movement.services.investor_accounts import (
+    HttpInvestorAccountsService,
+    MockInvestorAccountsService,
+)
+from money_movement.services.standin import create_standin_app, serve
+from money_movement.util import percentile
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+INVESTOR_COUNT = 100
+FUND_COUNT = 10
+TRANSFER_AMOUNT = 100
+
+
+class StepTimer:
+    """
+    Records exclusive wall time and query counts per workflow step. Steps nest
+    when eager tasks enqueue each other; time and queries spent in a nested
+    step are only counted against that step.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.durations: Dict[str, List[float]] = {}
+        self.queries: Dict[str, int] = {}
+        self._stack: List[List] = []
+
+    def start(self, step: str):
+        self._stack.append([step, self.clock(), 0.0])
+
+    def stop(self):
+        step, started, nested = self._stack.pop()
+        elapsed = self.clock() - started
+        self.durations.setdefault(step, []).append(elapsed - nested)
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def count_query(self, *args, **kwargs):
+        if self._stack:
+            step = self._stack[-1][0]
+            self.queries[step] = self.queries.get(step, 0) + 1
+
+    def task_started(self, sender=None, **kwargs):
+        self.start(sender.name.rsplit(".", 1)[-1])
+
+    def task_finished(self, sender=None, **kwargs):
+        self.stop()
+
+
+@contextmanager
+def _patched(target, **attributes):
+    originals = {name: getattr(target, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(target, name, value)
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(target, name, value)
+
+
+def _seed_accounts(session_factory):
+    with session_factory() as session:
+        investors = [
+            InvestorAccount(external_account_uid=f"investor-{i}")
+            for i in range(INVESTOR_COUNT)
+        ]
+        funds = [
+            FundAccount(external_account_uid=f"fund-{i}") for i in range(FUND_COUNT)
+        ]
+        session.add_all(investors + funds)
+        session.commit()
+        return [a.id for a in investors], [a.id for a in funds]
+
+
+def run_benchmark(
+    transfers: int,
+    engine: Engine,
+    settlement_delay: float = 0.0,
+    provider_latency: float | None = None,
+) -> Dict:
+    """
+    Push `transfers` funding transactions through the whole workflow on a
+    fresh schema in `engine` and return the measurements. With a
+    provider_latency the mock providers are served by a local stand-in
+    server adding that many seconds to each response, and called through the
+    HTTP adapters.
+    """
+    Base.metadata.drop_all(engine)
+    init_db(engine)
+    session_factory = sessionmaker(bind=engine)
+    investor_ids, fund_ids = _seed_accounts(session_factory)
+
+    investor_account_service = MockInvestorAccountsService(
+        accounts={
+            f"investor-{i}": transfers * TRANSFER_AMOUNT for i in range(INVESTOR_COUNT)
+        },
+        settlement_delay=settlement_delay,
+    )
+    fund_account_service = MockFundAccountsService(settlement_delay=settlement_delay)
+    standin = None
+    stack = ExitStack()
+    if provider_latency is not None:
+        standin = create_standin_app(
+            investor_account_service, fund_account_service, latency=provider_latency
+        )
+        url = stack.enter_context(serve(standin))
+        investor_account_service = HttpInvestorAccountsService(url)
+        fund_account_service = HttpFundAccountsService(url)
+
+    timer = StepTimer()
+    event.listen(engine, "before_cursor_execute", timer.count_query)
+    task_prerun.connect(timer.task_started, weak=False)
+    task_postrun.connect(timer.task_finished, weak=False)
+    try:
+        with (
+            _patched(controller, Session=session_factory),
+            _patched(
+                tasks,
+                Session=session_factory,
+                investor_account_service=investor_account_service,
+                fund_account_service=fund_account_service,
+            ),
+            _patched(
+                tasks.app.conf, task_always_eager=True, task_eager_propagates=True
+            ),
+        ):
+            amount_minor = to_minor(TRANSFER_AMOUNT)
+            started = time.perf_counter()
+            for i in range(transfers):
+                timer.start("process_new_transaction")
+                controller.process_new_transaction(
+                    investor_ids[i % len(investor_ids)],
+                    fund_ids[i % len(fund_ids)],
+                    amount_minor,
+                )
+                timer.stop()
+            with session_factory() as session:
+                transaction_ids = session.scalars(
+                    select(FundingTransaction.id).order_by(FundingTransaction.id)
+                ).all()
+
+            time.sleep(settlement_delay)
+            for transaction_id in transaction_ids:
+                tasks.complete_withdrawal.delay(transaction_id)
+
+            # The sweep starts one deposit_fund_batch per fund, which run inline
+            tasks.sweep_pending_transactions.delay()
+
+            time.sleep(settlement_delay)
+            for transaction_id in transaction_ids:
+                tasks.complete_deposit.delay(transaction_id)
+
+            tasks.dispatch_notifications.delay()
+
+            # Waiting on the providers is not part of the throughput
+            elapsed = time.perf_counter() - started - 2 * settlement_delay
+    finally:
+        stack.close()
+        task_postrun.disconnect(timer.task_finished)
+        task_prerun.disconnect(timer.task_started)
+        event.remove(engine, "before_cursor_execute", timer.count_query)
+
+    with session_factory() as session:
+        completed = session.scalar(
+            select(func.count()).where(
+                FundingTransaction.state == TransactionState.DEPOSIT_COMPLETED
+            )
+        )
+
+    total_queries = sum(timer.queries.values())
+    report = {
+        "transfers": transfers,
+        "completed": completed,
+        "elapsed_seconds": elapsed,
+        "transactions_per_second": transfers / elapsed if elapsed else 0.0,
+        "queries_per_transaction": total_queries / transfers if transfers else 0.0,
+        "steps": {
+            step: {
+                "count": len(durations),
+                "p50_ms": percentile(durations, 50) * 1000,
+                "p99_ms": percentile(durations, 99) * 1000,
+                "queries_per_call": timer.queries.get(step, 0) / len(durations),
+            }
+            for step, durations in timer.durations.items()
+        },
+    }
+    if standin is not None:
+        # Far fewer than requests when keep-alive connections are reused
+        report["provider_requests"] = standin.state.stats["requests"]
+        report["provider_connections"] = len(standin.state.connections)
+    return report
+
+
+def main(argv: List[str] | None = None) -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--database-url",
+        default="sqlite://",
+        help="SQLite URL to run against; the schema is dropped and recreated",
+    )
+    parser.add_argument(
+        "--settlement-delay",
+        type=float,
+        default=0.0,
+        help="Seconds the mock providers take to settle each transfer",
+    )
+    parser.add_argument(
+        "--provider-latency",
+        type=float,
+        help="Call the providers over HTTP through a local stand-in server "
+        "adding this many seconds to each response",
+    )
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    engine = create_engine_from_url(args.database_url)
+    report = {
+        "database_url": args.database_url,
+        "settlement_delay": args.settlement_delay,
+        "provider_latency": args.provider_latency,
+        "python": sys.version.split()[0],
+        "results": [
+            run_benchmark(size, engine, args.settlement_delay, args.provider_latency)
+            for size in args.sizes
+        ],
+    }
+    engine.dispose()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, Tuple, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from money_movement.models import (
+    FundingTransaction,
+    TransactionState,
+    session_transitions,
+)
+
+V = TypeVar("V")
+
+STATUS_CACHE_MAXSIZE = int(os.environ.get("STATUS_CACHE_MAXSIZE", 10_000))
+STATUS_CACHE_TTL = float(os.environ.get("STATUS_CACHE_TTL", 5))
+
+
+class TTLCache(Generic[V]):
+    """
+    Bounded LRU cache whose entries also expire after `ttl` seconds.
+
+    Readers take the current `generation` before loading a value and pass it
+    to `set`; if anything was invalidated in the meantime the value may be
+    stale and is not cached.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._entries: OrderedDict[Hashable, Tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> V | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: V, generation: int | None = None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Funding transaction id -> state, for GET /transfer/{id}. Invalidated when a
+# transition commits in this process; the TTL bounds staleness for transitions
+# committed by other processes such as the Celery workers.
+status_cache: TTLCache[TransactionState] = TTLCache(
+    maxsize=STATUS_CACHE_MAXSIZE, ttl=STATUS_CACHE_TTL
+)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_transitions(session):
+    for record in session_transitions(session):
+        if record.model is FundingTransaction:
+            status_cache.invalidate(record.id)
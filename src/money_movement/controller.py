@@ -1,17 +1,26 @@
-from sqlalchemy import Transaction
+from typing import Iterable, List, Set
+
+from celery import group
+from sqlalchemy import insert, select
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import Session
 
+from money_movement.amounts import to_minor
+from money_movement.db import Session
 from money_movement.models import (
     FundAccount,
     InvestorAccount,
     FundingTransaction,
     TransactionState,
 )
+from money_movement.schemas import BatchTransferResult, TransferRequest
+from money_movement.summary import record_new_transfers
 from money_movement.tasks import process_withdrawal
 
+# Keeps each IN (...) list well under SQLite's bound parameter limit.
+LOOKUP_CHUNK_SIZE = 500
+
 
-def process_new_transaction(investor_id, fund_id, amount):
+def process_new_transaction(investor_id, fund_id, amount_minor: int):
     session = Session()
     try:
         investor_account: InvestorAccount = (
@@ -23,25 +32,93 @@ def process_new_transaction(investor_id, fund_id, amount):
         transaction = FundingTransaction(
             investor_account=investor_account,
             fund_account=fund_account,
-            amount=amount,
+            amount_minor=amount_minor,
             state=TransactionState.INITIATED,
         )
         session.add(transaction)
         session.commit()
         process_withdrawal.delay(transaction.id)
+        return "success", f"Transfer {transaction.id} initiated"
+    except NoResultFound:
+        return "failure", "Investor or fund account not found"
     finally:
         session.close()
 
 
-def transaction_status(transaction_id) -> TransactionState:
+def _existing_ids(session, model, ids: Iterable[int]) -> Set[int]:
+    ids = list(ids)
+    found: Set[int] = set()
+    for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+        chunk = ids[start : start + LOOKUP_CHUNK_SIZE]
+        found.update(session.scalars(select(model.id).where(model.id.in_(chunk))))
+    return found
+
+
+def process_new_transactions(
+    transfers: List[TransferRequest],
+) -> List[BatchTransferResult]:
+    """
+    Validate and create many funding transactions at once.
+    Account ids are checked with chunked IN queries, accepted rows are inserted
+    in a single commit and their withdrawals are enqueued as one Celery group.
+    Invalid items are rejected individually without failing the batch.
+    """
+    results: List[BatchTransferResult] = []
     session = Session()
     try:
-        transaction = (
-            session.query(FundingTransaction).filter_by(id=transaction_id).one()
+        investor_ids = _existing_ids(
+            session, InvestorAccount, {t.investor_id for t in transfers}
+        )
+        fund_ids = _existing_ids(session, FundAccount, {t.fund_id for t in transfers})
+
+        rows = []
+        accepted: List[BatchTransferResult] = []
+        for index, transfer in enumerate(transfers):
+            result = BatchTransferResult(index=index, status="rejected", message="")
+            results.append(result)
+            try:
+                amount_minor = to_minor(transfer.amount)
+            except ValueError as e:
+                result.message = str(e)
+                continue
+            if amount_minor <= 0:
+                result.message = "Amount must be positive"
+            elif transfer.investor_id not in investor_ids:
+                result.message = f"Investor account {transfer.investor_id} not found"
+            elif transfer.fund_id not in fund_ids:
+                result.message = f"Fund account {transfer.fund_id} not found"
+            else:
+                rows.append(
+                    {
+                        "investor_account_id": transfer.investor_id,
+                        "fund_account_id": transfer.fund_id,
+                        "amount_minor": amount_minor,
+                        "state": TransactionState.INITIATED,
+                    }
+                )
+                accepted.append(result)
+
+        if not rows:
+            return results
+
+        transaction_ids = session.scalars(
+            insert(FundingTransaction).returning(
+                FundingTransaction.id, sort_by_parameter_order=True
+            ),
+            rows,
+        ).all()
+        record_new_transfers(
+            session, [(id, TransactionState.INITIATED) for id in transaction_ids]
         )
-        return transaction.get_state()
-    except Exception as e:
-        print(f"Failed to fetch transaction status: {e}")
+        session.commit()
     finally:
         session.close()
-        return None
+
+    for result, transaction_id in zip(accepted, transaction_ids):
+        result.status = "success"
+        result.transfer_id = transaction_id
+        result.message = f"Transfer {transaction_id} initiated"
+
+    group(process_withdrawal.s(tid) for tid in transaction_ids).apply_async()
+    return results
+
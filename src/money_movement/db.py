@@ -0,0 +1,125 @@
+"""
+Engine and session factories shared by the API, the controllers and the Celery
+workers. Configured from the environment:
+
+DATABASE_URL: sync SQLAlchemy URL, defaults to a local SQLite file.
+ASYNC_DATABASE_URL: async URL, derived from DATABASE_URL when unset
+    (sqlite -> sqlite+aiosqlite, postgresql -> postgresql+asyncpg).
+DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW: connection pool sizing.
+DATABASE_POOL_PRE_PING: check connections before use.
+DATABASE_POOL_RECYCLE: seconds after which pooled connections are replaced.
+SQLITE_BUSY_TIMEOUT_MS: how long SQLite waits on a locked database.
+"""
+
+import os
+
+from sqlalchemy import QueuePool, create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session as OrmSession, sessionmaker
+
+from money_movement.migrations import migrate
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///money_movement.db")
+DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 5))
+DATABASE_MAX_OVERFLOW = int(os.environ.get("DATABASE_MAX_OVERFLOW", 10))
+DATABASE_POOL_PRE_PING = _env_bool("DATABASE_POOL_PRE_PING", True)
+DATABASE_POOL_RECYCLE = int(os.environ.get("DATABASE_POOL_RECYCLE", 1800))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def async_url(url: str | URL) -> URL:
+    """
+    The async driver equivalent of a sync database URL.
+    """
+    url = make_url(url)
+    return url.set(drivername=_ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def engine_options(url: str | URL) -> dict:
+    """
+    Pool and connection options for a URL. Pool sizing only applies to the
+    queue pools; in-memory SQLite and aiosqlite files use single or null pools.
+    """
+    url = make_url(url)
+    options = {
+        "pool_pre_ping": DATABASE_POOL_PRE_PING,
+        "pool_recycle": DATABASE_POOL_RECYCLE,
+    }
+    if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        options["pool_size"] = DATABASE_POOL_SIZE
+        options["max_overflow"] = DATABASE_MAX_OVERFLOW
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer, and NORMAL sync is
+    # durable across application crashes in WAL mode.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def configure_engine(engine: Engine) -> Engine:
+    """
+    Apply per-connection settings for the engine's backend.
+    """
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+def create_engine_from_url(url: str | URL) -> Engine:
+    return configure_engine(create_engine(url, **engine_options(url)))
+
+
+def create_async_engine_from_url(url: str | URL):
+    async_engine = create_async_engine(url, **engine_options(url))
+    configure_engine(async_engine.sync_engine)
+    return async_engine
+
+
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or async_url(DATABASE_URL)
+
+engine = create_engine_from_url(DATABASE_URL)
+Session = sessionmaker(bind=engine)
+
+async_engine = create_async_engine_from_url(ASYNC_DATABASE_URL)
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+_DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def dialect_insert(session: OrmSession, model):
+    """
+    An INSERT for the session's backend, which supports ON CONFLICT clauses
+    on both SQLite and PostgreSQL.
+    """
+    return _DIALECT_INSERTS[session.get_bind().dialect.name](model)
+
+
+def init_db(bind: Engine = engine):
+    """
+    Create any missing tables and apply pending schema migrations.
+    """
+    migrate(bind)
@@ -0,0 +1,147 @@
+"""
+Streaming export of funding transactions for reconciliation.
+
+Rows are read with a server-side cursor (`stream_results`) in partitions of
+EXPORT_BATCH_SIZE and written out one partition at a time, as plain rows
+rather than ORM objects, so memory stays flat however many rows match.
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import Iterable, Iterator, List
+
+from sqlalchemy import Row, Select, select
+from sqlalchemy.orm import aliased
+
+from money_movement.db import Session
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    TransactionState,
+)
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+EXPORT_FIELDS: List[str] = [
+    "id",
+    "investor_account_id",
+    "investor_account_uid",
+    "fund_account_id",
+    "fund_account_uid",
+    "amount_minor",
+    "currency",
+    "state",
+    "withdrawal_transaction_id",
+    "deposit_transaction_id",
+    "created",
+    "modified",
+]
+
+
+def export_query(
+    state: TransactionState | None = None,
+    fund_id: int | None = None,
+    investor_id: int | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+) -> Select:
+    """
+    Funding transactions matching every given filter, in id order.
+    `created_to` is exclusive.
+    """
+    investor = aliased(InvestorAccount)
+    fund = aliased(FundAccount)
+    stmt = (
+        select(
+            FundingTransaction.id,
+            FundingTransaction.investor_account_id,
+            investor.external_account_uid.label("investor_account_uid"),
+            FundingTransaction.fund_account_id,
+            fund.external_account_uid.label("fund_account_uid"),
+            FundingTransaction.amount_minor,
+            FundingTransaction.currency,
+            FundingTransaction.state,
+            FundingTransaction.withdrawal_transaction_id,
+            FundingTransaction.deposit_transaction_id,
+            FundingTransaction.created,
+            FundingTransaction.modified,
+        )
+        .join(investor, FundingTransaction.investor_account_id == investor.id)
+        .join(fund, FundingTransaction.fund_account_id == fund.id)
+        .order_by(FundingTransaction.id)
+    )
+    if state is not None:
+        stmt = stmt.where(FundingTransaction.state == state)
+    if fund_id is not None:
+        stmt = stmt.where(FundingTransaction.fund_account_id == fund_id)
+    if investor_id is not None:
+        stmt = stmt.where(FundingTransaction.investor_account_id == investor_id)
+    if created_from is not None:
+        stmt = stmt.where(FundingTransaction.created >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(FundingTransaction.created < created_to)
+    return stmt
+
+
+def _values(row: Row) -> List:
+    values = []
+    for value in row:
+        if isinstance(value, TransactionState):
+            value = value.value
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        elif value is not None and not isinstance(value, (int, str)):
+            value = str(value)
+        values.append(value)
+    return values
+
+
+def ndjson_chunks(partitions: Iterable[List[Row]]) -> Iterator[str]:
+    for rows in partitions:
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_FIELDS, _values(row)))) + "\n" for row in rows
+        )
+
+
+def csv_chunks(partitions: Iterable[List[Row]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for rows in partitions:
+        writer.writerows(_values(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header of an empty export
+        yield buffer.getvalue()
+
+
+def export_transfers(
+    format: str = "ndjson", batch_size: int | None = None, **filters
+) -> Iterator[str]:
+    """
+    Stream matching funding transactions as NDJSON or CSV text chunks, one
+    chunk per partition read. The session stays open until the generator is
+    exhausted or closed.
+    """
+    chunks = {"ndjson": ndjson_chunks, "csv": csv_chunks}[format]
+    session = Session()
+    try:
+        result = session.execute(
+            export_query(**filters).execution_options(
+                stream_results=True, yield_per=batch_size or EXPORT_BATCH_SIZE
+            )
+        )
+        yield from chunks(result.partitions())
+    finally:
+        session.close()
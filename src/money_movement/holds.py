@@ -0,0 +1,213 @@
+"""
+Local holds ledger for investor balances.
+
+Each investor has an investor_balance row caching the provider balance and
+the total held for transfers admitted since, both in integer minor units. A
+transfer is admitted with a single conditional UPDATE that adds its amount to
+the held total only while the cached balance is fresh and enough headroom is
+left afterwards, so most transfers never call the provider and concurrent
+admissions can't overdraw. When the cache is stale, missing or the margin is
+thin, the balance is refreshed from the provider and the transfer admitted
+against that; transfers are only ever rejected against a fresh provider
+balance. The provider is only called with nothing written, so no write
+transaction, on SQLite the database's one write lock, is held across it.
+
+Holds become WITHDRAWN when the provider withdrawal is made, moving the amount
+out of both the held total and the balance, and are released if their funding
+transaction fails first.
+"""
+
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from decimal import Decimal
+from logging import Logger, getLogger
+from typing import Callable
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from money_movement.amounts import to_minor
+from money_movement.db import dialect_insert
+from money_movement.models import (
+    BalanceHold,
+    FundingTransaction,
+    HoldState,
+    InvestorAccount,
+    InvestorBalance,
+    TransactionState,
+    session_transitions,
+)
+from money_movement.services.investor_accounts import AbstractInvestorAccountsService
+
+logger: Logger = getLogger(__name__)
+
+# Seconds a provider balance can be used to admit transfers locally
+BALANCE_CACHE_TTL = float(os.environ.get("BALANCE_CACHE_TTL", 60))
+# Fraction of the cached balance that must be left over to admit locally
+BALANCE_MIN_HEADROOM = Decimal(os.environ.get("BALANCE_MIN_HEADROOM", "0.10"))
+# The same in basis points, so admission stays in integer arithmetic
+_HEADROOM_BPS = int(BALANCE_MIN_HEADROOM * 10_000)
+
+# local_admits, provider_refreshes and rejections, for /metrics
+hold_stats: Counter = Counter()
+
+
+def _admit(
+    session: Session,
+    investor_account_id: int,
+    amount_minor: int,
+    fresh_after: datetime | None = None,
+    headroom_bps: int = 0,
+) -> bool:
+    left = InvestorBalance.balance_minor - InvestorBalance.held_minor - amount_minor
+    criteria = [
+        InvestorBalance.investor_account_id == investor_account_id,
+        left * 10_000 >= InvestorBalance.balance_minor * headroom_bps,
+    ]
+    if fresh_after is not None:
+        criteria.append(InvestorBalance.refreshed_at >= fresh_after)
+    result = session.execute(
+        update(InvestorBalance)
+        .where(*criteria)
+        .values(held_minor=InvestorBalance.held_minor + amount_minor)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def refresh_balance(
+    session: Session,
+    investor_account_service: AbstractInvestorAccountsService,
+    investor_account: InvestorAccount,
+) -> int:
+    """
+    Replace the cached balance with the provider's, returning it in minor
+    units. Outstanding holds are kept, since the provider doesn't know about
+    them yet. The provider is called before anything is written.
+    """
+    balance = investor_account_service.check_balance(
+        investor_account.external_account_uid
+    )
+    balance_minor = to_minor(balance)
+    now = datetime.now()
+    session.execute(
+        dialect_insert(session, InvestorBalance)
+        .values(
+            investor_account_id=investor_account.id,
+            balance_minor=balance_minor,
+            held_minor=0,
+            currency=balance.currency.code,
+            refreshed_at=now,
+        )
+        .on_conflict_do_update(
+            index_elements=[InvestorBalance.investor_account_id],
+            set_={"balance_minor": balance_minor, "refreshed_at": now},
+        )
+    )
+    hold_stats["provider_refreshes"] += 1
+    return balance_minor
+
+
+def place_hold(
+    session: Session,
+    investor_account_service: AbstractInvestorAccountsService,
+    transaction: FundingTransaction,
+    claim: Callable[[], bool] | None = None,
+) -> bool | None:
+    """
+    Hold the transaction's amount against the investor's balance, as part of
+    the session's transaction. Returns False if the investor can't cover it.
+
+    When the cached balance won't do, the session is rolled back, the balance
+    refreshed and committed, and the admission made again, so the session
+    must have nothing else uncommitted. Writes the caller needs in the same
+    transaction go in `claim`, run before every admission; if it returns False
+    nothing is held and None is returned.
+    """
+    amount_minor = transaction.amount_minor
+    investor_account_id = transaction.investor_account_id
+    fresh_after = datetime.now() - timedelta(seconds=BALANCE_CACHE_TTL)
+    if claim is not None and not claim():
+        return None
+    if _admit(session, investor_account_id, amount_minor, fresh_after, _HEADROOM_BPS):
+        hold_stats["local_admits"] += 1
+    else:
+        session.rollback()
+        refresh_balance(session, investor_account_service, transaction.investor_account)
+        session.commit()
+        if claim is not None and not claim():
+            return None
+        if not _admit(session, investor_account_id, amount_minor):
+            hold_stats["rejections"] += 1
+            return False
+
+    session.add(
+        BalanceHold(
+            funding_transaction_id=transaction.id,
+            investor_account_id=investor_account_id,
+            amount_minor=amount_minor,
+            currency=transaction.currency,
+        )
+    )
+    return True
+
+
+def _settle_hold(
+    session: Session, funding_transaction_id: int, state: HoldState
+) -> bool:
+    hold = session.execute(
+        select(
+            BalanceHold.id, BalanceHold.investor_account_id, BalanceHold.amount_minor
+        ).where(
+            BalanceHold.funding_transaction_id == funding_transaction_id,
+            BalanceHold.state == HoldState.HELD,
+        )
+    ).first()
+    if hold is None:
+        return False
+    result = session.execute(
+        update(BalanceHold)
+        .where(BalanceHold.id == hold.id, BalanceHold.state == HoldState.HELD)
+        .values(state=state, modified=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+
+    values = {"held_minor": InvestorBalance.held_minor - hold.amount_minor}
+    if state == HoldState.WITHDRAWN:
+        # The provider balance now reflects the withdrawal
+        values["balance_minor"] = InvestorBalance.balance_minor - hold.amount_minor
+    session.execute(
+        update(InvestorBalance)
+        .where(InvestorBalance.investor_account_id == hold.investor_account_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def consume_hold(session: Session, funding_transaction_id: int) -> bool:
+    """
+    Mark a transaction's hold as withdrawn once the provider has the withdrawal.
+    """
+    return _settle_hold(session, funding_transaction_id, HoldState.WITHDRAWN)
+
+
+def release_hold(session: Session, funding_transaction_id: int) -> bool:
+    """
+    Give back a transaction's held funds. Safe to call more than once.
+    """
+    return _settle_hold(session, funding_transaction_id, HoldState.RELEASED)
+
+
+@event.listens_for(Session, "before_commit")
+def _release_failed_holds(session):
+    # Failed transactions release their hold in the same commit
+    for record in list(session_transitions(session)):
+        if (
+            record.model is FundingTransaction
+            and record.new_state == TransactionState.FAILED
+        ):
+            release_hold(session, record.id)
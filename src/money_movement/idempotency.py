@@ -0,0 +1,97 @@
+"""
+Idempotency keys for POST /transfer.
+
+A request with an Idempotency-Key header creates its transfer and an
+idempotency_key row in one transaction, and the key's primary key makes a
+second insert of the same key fail. Most keys are new, so the insert is tried
+straight away with no lookup first; a unique violation means the key was
+already used, and the stored transfer is returned instead of a new one.
+
+Each process also remembers the keys it has answered in an LRU, so a client
+retrying against the same API process is answered without touching the
+database. Keys are purged once older than IDEMPOTENCY_KEY_RETENTION.
+"""
+
+import hashlib
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from logging import Logger, getLogger
+from typing import Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from money_movement.cache import TTLCache
+from money_movement.models import IdempotencyKey
+
+logger: Logger = getLogger(__name__)
+
+# Seconds a key is honoured for, and kept in the database
+IDEMPOTENCY_KEY_RETENTION = float(os.environ.get("IDEMPOTENCY_KEY_RETENTION", 86_400))
+IDEMPOTENCY_CACHE_MAXSIZE = int(os.environ.get("IDEMPOTENCY_CACHE_MAXSIZE", 10_000))
+IDEMPOTENCY_PURGE_BATCH_SIZE = int(os.environ.get("IDEMPOTENCY_PURGE_BATCH_SIZE", 1000))
+
+# cache_replays, stored_replays, conflicts and purged, for /metrics
+idempotency_stats: Counter = Counter()
+
+# Key -> (request hash, funding transaction id) for keys answered here
+idempotency_cache: TTLCache[Tuple[str, int]] = TTLCache(
+    maxsize=IDEMPOTENCY_CACHE_MAXSIZE, ttl=IDEMPOTENCY_KEY_RETENTION
+)
+
+
+def request_hash(investor_id: int, fund_id: int, amount_minor: int) -> str:
+    return hashlib.sha256(
+        f"{investor_id}:{fund_id}:{amount_minor}".encode()
+    ).hexdigest()
+
+
+def replay(key: str, stored: Tuple[str, int], request: str) -> Tuple[str, str]:
+    """
+    The result of the request that first used `key`, or a conflict if this
+    request isn't the same one.
+    """
+    stored_hash, funding_transaction_id = stored
+    if stored_hash != request:
+        idempotency_stats["conflicts"] += 1
+        return "conflict", f"Idempotency key {key!r} was used for another transfer"
+    return "success", f"Transfer {funding_transaction_id} initiated"
+
+
+def stored_key_query(key: str):
+    return select(
+        IdempotencyKey.request_hash, IdempotencyKey.funding_transaction_id
+    ).where(IdempotencyKey.key == key)
+
+
+def purge_expired_keys(
+    session: Session,
+    retention: float = IDEMPOTENCY_KEY_RETENTION,
+    batch_size: int = IDEMPOTENCY_PURGE_BATCH_SIZE,
+) -> int:
+    """
+    Delete keys older than `retention` seconds, committing every `batch_size`
+    rows so the purge never holds locks for long. Returns the number deleted.
+    """
+    cutoff = datetime.now() - timedelta(seconds=retention)
+    purged = 0
+    while True:
+        expired = (
+            select(IdempotencyKey.key)
+            .where(IdempotencyKey.created < cutoff)
+            .limit(batch_size)
+        )
+        result = session.execute(
+            delete(IdempotencyKey)
+            .where(IdempotencyKey.key.in_(expired.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        purged += result.rowcount
+        if result.rowcount < batch_size:
+            break
+    idempotency_stats["purged"] += purged
+    if purged:
+        logger.info(f"Purged {purged} expired idempotency keys")
+    return purged
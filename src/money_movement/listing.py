@@ -0,0 +1,73 @@
+"""
+Keyset pagination over an account's funding transactions, newest first.
+
+A page ends with an opaque cursor encoding the (created, id) of its last row,
+and the next page starts strictly after it. Pages are read through the
+(account, created, id) indexes, so a deep page costs the same as the first
+one, unlike OFFSET paging which reads and discards every earlier row.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Tuple
+
+from sqlalchemy import Select, select, tuple_
+
+from money_movement.models import FundingTransaction, TransactionState
+
+
+def encode_cursor(created: datetime, id: int) -> str:
+    payload = json.dumps([created.isoformat(), id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Raises ValueError for a cursor that wasn't made by encode_cursor.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created, id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created), int(id)
+    except (binascii.Error, TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+
+def transfers_page_query(
+    owner_column,
+    owner_id: int,
+    limit: int,
+    cursor: str | None = None,
+    state: TransactionState | None = None,
+) -> Select:
+    """
+    One page of an account's transfers, as plain rows rather than ORM
+    objects. `owner_column` is FundingTransaction.investor_account_id or
+    FundingTransaction.fund_account_id. One row more than `limit` is
+    selected, to tell whether there is a next page.
+    """
+    stmt = (
+        select(
+            FundingTransaction.id,
+            FundingTransaction.investor_account_id,
+            FundingTransaction.fund_account_id,
+            FundingTransaction.amount_minor,
+            FundingTransaction.currency,
+            FundingTransaction.state,
+            FundingTransaction.created,
+            FundingTransaction.modified,
+        )
+        .where(owner_column == owner_id)
+        .order_by(FundingTransaction.created.desc(), FundingTransaction.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        stmt = stmt.where(
+            tuple_(FundingTransaction.created, FundingTransaction.id)
+            < tuple_(*decode_cursor(cursor))
+        )
+    if state is not None:
+        stmt = stmt.where(FundingTransaction.state == state)
+    return stmt
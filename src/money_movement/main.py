@@ -1,32 +1,164 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Literal
 
-from money_movement.controller import process_new_transaction, transaction_status
-from money_movement.models import TransactionState
-from money_movement.schemas import TransferRequest, TransferStatus
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
-app = FastAPI()
+from money_movement import async_controller, export
+from money_movement.amounts import to_minor
+from money_movement.cache import status_cache
+from money_movement.controller import process_new_transactions
+from money_movement.db import init_db
+from money_movement.holds import hold_stats
+from money_movement.idempotency import idempotency_stats
+from money_movement.models import FundAccount, InvestorAccount, TransactionState
+from money_movement.outbox import outbox_stats
+from money_movement.ratelimit import rate_limit_stats
+from money_movement.retries import retry_stats
+from money_movement.schemas import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    BatchTransferRequest,
+    BatchTransferResponse,
+    FundSummary,
+    TransferPage,
+    TransferRequest,
+    TransferStatus,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.post("/transfer", response_model=TransferStatus)
-def initiate_transfer(request: TransferRequest):
-    status, message = process_new_transaction(
-        request.investor_id, request.fund_id, request.amount
+async def initiate_transfer(
+    request: TransferRequest,
+    idempotency_key: str | None = Header(None, max_length=255),
+):
+    """
+    Retries with the same Idempotency-Key header get the first request's
+    result rather than a second transfer.
+    """
+    try:
+        amount_minor = to_minor(request.amount)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if amount_minor <= 0:
+        raise HTTPException(status_code=422, detail="Amount must be positive")
+    status, message = await async_controller.process_new_transaction(
+        request.investor_id, request.fund_id, amount_minor, idempotency_key
     )
     if status == "success":
         return TransferStatus(status=status, message=message)
     elif status == "retry":
         # Logic to handle retry, could include a more sophisticated retry mechanism
         return TransferStatus(status="failure", message=message)
+    elif status == "conflict":
+        raise HTTPException(status_code=422, detail=message)
     else:
         raise HTTPException(status_code=400, detail=message)
 
 
+@app.post("/transfers/batch", response_model=BatchTransferResponse)
+def initiate_transfers(request: BatchTransferRequest):
+    results = process_new_transactions(request.transfers)
+    return BatchTransferResponse(results=results)
+
+
+@app.get("/transfers/export")
+def export_transfers(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    state: TransactionState | None = None,
+    fund_id: int | None = None,
+    investor_id: int | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+):
+    """
+    Stream every matching transfer, oldest first. `created_to` is exclusive.
+    """
+    return StreamingResponse(
+        export.export_transfers(
+            format,
+            state=state,
+            fund_id=fund_id,
+            investor_id=investor_id,
+            created_from=created_from,
+            created_to=created_to,
+        ),
+        media_type=export.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="transfers.{format}"'},
+    )
+
+
 @app.get("/transfer/{transfer_id}", response_model=TransferStatus)
-def check_transfer_status(transfer_id: int):
-    state: TransactionState = transaction_status(transfer_id)
+async def check_transfer_status(transfer_id: int):
+    state: TransactionState = await async_controller.transaction_status(transfer_id)
     if state:
         return TransferStatus(
             status=state.value, message=f"Transaction is in state {state.value}"
         )
     else:
         raise HTTPException(status_code=404, detail="Transfer not found")
+
+
+async def _list_transfers(owner_model, owner_id, limit, cursor, state) -> TransferPage:
+    try:
+        page = await async_controller.list_transfers(
+            owner_model, owner_id, limit, cursor=cursor, state=state
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    return page
+
+
+@app.get("/investors/{investor_id}/transfers", response_model=TransferPage)
+async def list_investor_transfers(
+    investor_id: int,
+    cursor: str | None = None,
+    state: TransactionState | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    return await _list_transfers(InvestorAccount, investor_id, limit, cursor, state)
+
+
+@app.get("/funds/{fund_id}/transfers", response_model=TransferPage)
+async def list_fund_transfers(
+    fund_id: int,
+    cursor: str | None = None,
+    state: TransactionState | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    return await _list_transfers(FundAccount, fund_id, limit, cursor, state)
+
+
+@app.get("/funds/{fund_id}/summary", response_model=FundSummary)
+async def fund_summary(fund_id: int):
+    summary = await async_controller.fund_summary(fund_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Fund not found")
+    return summary
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "status_cache": status_cache.stats(),
+        "holds": dict(hold_stats),
+        "outbox": dict(outbox_stats),
+        "idempotency": dict(idempotency_stats),
+        "rate_limits": {
+            "providers": await async_controller.provider_limits(),
+            **rate_limit_stats,
+        },
+        "retries": dict(retry_stats),
+    }
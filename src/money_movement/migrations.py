@@ -0,0 +1,171 @@
+"""
+Schema migrations for databases created by an earlier version of the models.
+
+New tables are created by create_all, so migrations only need to alter tables
+that already exist. Applied versions are tracked in the schema_version table.
+Run with `python -m money_movement.migrations`.
+"""
+
+from logging import Logger, getLogger
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Column, Connection, Engine, Integer, MetaData, Table, inspect
+from sqlalchemy import func, select, text
+
+from money_movement.amounts import DEFAULT_CURRENCY, minor_unit_places
+from money_movement.models import (
+    Base,
+    BalanceHold,
+    FundAccount,
+    FundDepositTransaction,
+    FundingTransaction,
+    InvestorBalance,
+    NotificationOutbox,
+    WithdrawalTransaction,
+)
+
+logger: Logger = getLogger(__name__)
+
+schema_version = Table(
+    "schema_version", MetaData(), Column("version", Integer, primary_key=True)
+)
+
+
+def _column_names(connection: Connection, table_name: str) -> set:
+    return {c["name"] for c in inspect(connection).get_columns(table_name)}
+
+
+def _add_column(connection: Connection, column: Column):
+    table = column.table
+    if column.name not in _column_names(connection, table.name):
+        column_type = column.type.compile(dialect=connection.dialect)
+        connection.execute(
+            text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+        )
+
+
+def _create_indexes(connection: Connection, *models):
+    for model in models:
+        for index in model.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _add_external_transaction_uids(connection: Connection):
+    _add_column(connection, WithdrawalTransaction.__table__.c.external_transaction_uid)
+    _add_column(connection, FundDepositTransaction.__table__.c.external_transaction_uid)
+
+
+def _add_state_indexes(connection: Connection):
+    _create_indexes(
+        connection, FundingTransaction, WithdrawalTransaction, FundDepositTransaction
+    )
+
+
+def _add_listing_indexes(connection: Connection):
+    # The investor index gained the id column, for keyset paging on (created, id)
+    connection.execute(
+        text("DROP INDEX IF EXISTS ix_funding_transaction_investor_created")
+    )
+    _create_indexes(connection, FundingTransaction)
+
+
+def _to_minor_units(connection: Connection):
+    # Decimal amounts become integer minor units. Every existing amount is in
+    # the default currency, so that is what the new currency columns get.
+    scale = 10 ** minor_unit_places(DEFAULT_CURRENCY)
+    renames = {
+        WithdrawalTransaction: {"amount": "amount_minor"},
+        FundDepositTransaction: {"amount": "amount_minor"},
+        FundingTransaction: {"amount": "amount_minor"},
+        BalanceHold: {"amount": "amount_minor"},
+        NotificationOutbox: {"amount": "amount_minor"},
+        InvestorBalance: {"balance": "balance_minor", "held": "held_minor"},
+        FundAccount: {"min_investment_threshold": "min_investment_minor"},
+    }
+    for model, columns in renames.items():
+        table = model.__table__
+        if "currency" in table.c:
+            _add_column(connection, table.c.currency)
+            connection.execute(
+                text(
+                    f"UPDATE {table.name} SET currency = :currency "
+                    "WHERE currency IS NULL"
+                ).bindparams(currency=DEFAULT_CURRENCY)
+            )
+        existing = _column_names(connection, table.name)
+        for old, new in columns.items():
+            if old not in existing:
+                continue
+            _add_column(connection, table.c[new])
+            connection.execute(
+                text(
+                    f"UPDATE {table.name} "
+                    f"SET {new} = CAST(ROUND({old} * {scale}) AS BIGINT)"
+                )
+            )
+            connection.execute(text(f"ALTER TABLE {table.name} DROP COLUMN {old}"))
+
+
+def _build_fund_summaries(connection: Connection):
+    # The summary table is new, so fill it from the transfers already there.
+    # Imported here because money_movement.summary depends on db, which
+    # imports this module.
+    from money_movement.summary import rebuild_summary
+
+    rebuild_summary(connection)
+
+
+def _add_retry_counts(connection: Connection):
+    _add_column(connection, FundingTransaction.__table__.c.retries)
+    connection.execute(
+        text("UPDATE funding_transaction SET retries = 0 WHERE retries IS NULL")
+    )
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Add external transaction uids", _add_external_transaction_uids),
+    (2, "Add workflow state indexes", _add_state_indexes),
+    (3, "Add transfer listing indexes", _add_listing_indexes),
+    (4, "Store amounts as integer minor units", _to_minor_units),
+    (5, "Build fund state summaries", _build_fund_summaries),
+    (6, "Add transaction retry counts", _add_retry_counts),
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+
+def current_version(connection: Connection) -> int:
+    schema_version.create(connection, checkfirst=True)
+    return connection.scalar(select(func.max(schema_version.c.version))) or 0
+
+
+def migrate(engine: Engine) -> List[int]:
+    """
+    Bring the schema up to date. A new database is created at the head
+    version; an existing one has each pending migration applied in its own
+    transaction. Returns the versions that were applied.
+    """
+    with engine.begin() as connection:
+        is_new = not inspect(connection).has_table(FundingTransaction.__tablename__)
+        Base.metadata.create_all(connection)
+        version = current_version(connection)
+        if is_new and version == 0:
+            connection.execute(schema_version.insert(), {"version": HEAD})
+            return []
+
+    applied = []
+    for migration_version, description, upgrade in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        with engine.begin() as connection:
+            logger.info(f"Applying migration {migration_version}: {description}")
+            upgrade(connection)
+            connection.execute(schema_version.insert(), {"version": migration_version})
+        applied.append(migration_version)
+    return applied
+
+
+if __name__ == "__main__":
+    from money_movement.db import engine
+
+    print(f"Applied migrations: {migrate(engine)}")
@@ -1,15 +1,13 @@
-from decimal import Decimal
 from enum import Enum as PyEnum
 from datetime import UTC, datetime
-from typing import List
+from typing import Any, Dict, List, NamedTuple
 from moneyed import Money
-from sqlalchemy import (
-    ForeignKey,
-    create_engine,
-)
-from sqlalchemy.orm import Mapped, mapped_column, declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy import BigInteger, ForeignKey, Index, String, event, insert, update
+from sqlalchemy.orm import Mapped, Session, mapped_column, declarative_base
+from sqlalchemy.orm import object_session, relationship
+from sqlalchemy.orm.attributes import set_committed_value
 
+from money_movement.amounts import DEFAULT_CURRENCY, to_money
 from money_movement.state_machine import GenericStateMachine
 
 Base = declarative_base()
@@ -17,12 +15,260 @@ Base = declarative_base()
 
 class TimestampMixin:
     created: Mapped[datetime] = mapped_column(nullable=False, default=datetime.now)
-    modified: Mapped[datetime] = mapped_column(nullable=False, default=datetime.now)
+    modified: Mapped[datetime] = mapped_column(
+        nullable=False, default=datetime.now, onupdate=datetime.now
+    )
+
+
+class AmountMixin:
+    """
+    An amount in integer minor units of `currency`, so sums and comparisons
+    are exact integer arithmetic. Money is only built for display.
+    """
+
+    amount_minor: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    currency: Mapped[str] = mapped_column(
+        String(3), nullable=False, default=DEFAULT_CURRENCY
+    )
+
+    def amount_money(self) -> Money:
+        return to_money(self.amount_minor, self.currency)
+
+
+TRANSITIONS_INFO_KEY = "money_movement.transitions"
+
+
+class TransitionRecord(NamedTuple):
+    model: type
+    id: int
+    previous_state: Any
+    new_state: Any
+    version: int | None
+    occurred_at: datetime | None = None
+
+
+def record_transition(session: Session, record: TransitionRecord):
+    """
+    Remember a transition on the session it happened in, so listeners can act
+    on it before or after the owning transaction commits.
+    """
+    if record.occurred_at is None:
+        record = record._replace(occurred_at=datetime.now())
+    session.info.setdefault(TRANSITIONS_INFO_KEY, []).append(record)
+
+
+def session_transitions(session: Session) -> List[TransitionRecord]:
+    return session.info.get(TRANSITIONS_INFO_KEY, [])
+
+
+@event.listens_for(Session, "after_transaction_create")
+def _reset_transitions(session, transaction):
+    # Only a new top-level transaction starts afresh, so that a commit with
+    # nothing new to do doesn't see the previous transaction's transitions
+    if transaction.parent is None:
+        session.info.pop(TRANSITIONS_INFO_KEY, None)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_transitions(session, previous_transaction):
+    session.info.pop(TRANSITIONS_INFO_KEY, None)
+
+
+@event.listens_for(Session, "before_commit")
+def _write_transition_events(session):
+    # Append the transaction's transitions to the event log in one
+    # multi-row INSERT, committed or rolled back with the state changes
+    records = session_transitions(session)
+    if records:
+        session.execute(
+            insert(TransitionEvent),
+            [
+                {
+                    "entity": record.model.__tablename__,
+                    "entity_id": record.id,
+                    "from_state": record.previous_state.name,
+                    "to_state": record.new_state.name,
+                    "version": record.version,
+                    "occurred_at": record.occurred_at,
+                }
+                for record in records
+            ],
+        )
 
 
 class VersionedMixin:
+    """
+    Optimistic concurrency for state machine models. Transitions are applied
+    as a single conditional UPDATE guarded on the expected state and version,
+    so concurrent workers never overwrite each other and no row locks are held.
+    """
+
     version: Mapped[int] = mapped_column(nullable=False, default=1)
 
+    @classmethod
+    def _compare_and_swap(
+        cls,
+        session: Session,
+        id: int,
+        expected_state,
+        new_state,
+        expected_version: int | None,
+    ) -> bool:
+        criteria = [cls.id == id, cls.state == expected_state]
+        if expected_version is not None:
+            criteria.append(cls.version == expected_version)
+        result = session.execute(
+            update(cls)
+            .where(*criteria)
+            .values(state=new_state, version=cls.version + 1, modified=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    @classmethod
+    def compare_and_set_state(
+        cls,
+        session: Session,
+        id: int,
+        expected_state,
+        new_state,
+        expected_version: int | None = None,
+    ) -> bool:
+        """
+        Move row `id` from expected_state to new_state without loading it.
+        Returns whether this call won; False means the row had already moved on.
+        Transition hooks need an object and are not run, but the transition is
+        still recorded on the session.
+        """
+        if new_state not in cls._successors.get(expected_state, ()):
+            raise ValueError(
+                f"Invalid transition from {expected_state.name} to {new_state.name}"
+            )
+        if not cls._compare_and_swap(
+            session, id, expected_state, new_state, expected_version
+        ):
+            return False
+        new_version = expected_version + 1 if expected_version is not None else None
+        record_transition(
+            session, TransitionRecord(cls, id, expected_state, new_state, new_version)
+        )
+        return True
+
+    @classmethod
+    def transition_where(
+        cls,
+        session: Session,
+        expected_state,
+        new_state,
+        *criteria,
+        returning=(),
+        **values,
+    ) -> List:
+        """
+        Move every row matching `criteria` from expected_state to new_state in
+        one UPDATE, also setting `values`. Returns a row of (id, version,
+        *returning) for each row that moved. Like compare_and_set_state, the
+        transitions are recorded on the session but hooks are not run.
+        """
+        if new_state not in cls._successors.get(expected_state, ()):
+            raise ValueError(
+                f"Invalid transition from {expected_state.name} to {new_state.name}"
+            )
+        rows = session.execute(
+            update(cls)
+            .where(cls.state == expected_state, *criteria)
+            .values(
+                state=new_state,
+                version=cls.version + 1,
+                modified=datetime.now(),
+                **values,
+            )
+            .returning(cls.id, cls.version, *returning)
+            .execution_options(synchronize_session=False)
+        ).all()
+        for row in rows:
+            record_transition(
+                session,
+                TransitionRecord(cls, row.id, expected_state, new_state, row.version),
+            )
+        return rows
+
+    def transition_cas(self, session: Session, new_state) -> bool:
+        """
+        Compare-and-swap transition from this object's loaded state and version.
+        On success the object is updated in place and the post-transition hooks
+        run; on failure it is left as is.
+        """
+        previous_state = self.state
+        self.validate_transition(new_state)
+        for hook in self.pre_transition_hooks:
+            hook(self, previous_state, new_state)
+        if not self._compare_and_swap(
+            session, self.id, previous_state, new_state, self.version
+        ):
+            return False
+        set_committed_value(self, "state", new_state)
+        set_committed_value(self, "version", self.version + 1)
+        for hook in self.post_transition_hooks:
+            hook(self, previous_state, new_state)
+        return True
+
+    @classmethod
+    def transition_all_cas(cls, session: Session, objects: List, new_state) -> List:
+        """
+        Compare-and-swap many objects to new_state with one UPDATE per loaded
+        state. Guarding on the state alone is enough because transition graphs
+        are acyclic, so a row still in its loaded state has its loaded version.
+        Returns the objects that moved, each updated in place with its
+        post-transition hooks run.
+        """
+        by_state: Dict[Any, List] = {}
+        for obj in objects:
+            obj.validate_transition(new_state)
+            by_state.setdefault(obj.state, []).append(obj)
+
+        moved = []
+        for previous_state, group in by_state.items():
+            for obj in group:
+                for hook in obj.pre_transition_hooks:
+                    hook(obj, previous_state, new_state)
+            won = set(
+                session.scalars(
+                    update(cls)
+                    .where(
+                        cls.id.in_([obj.id for obj in group]),
+                        cls.state == previous_state,
+                    )
+                    .values(
+                        state=new_state,
+                        version=cls.version + 1,
+                        modified=datetime.now(),
+                    )
+                    .returning(cls.id)
+                    .execution_options(synchronize_session=False)
+                )
+            )
+            for obj in group:
+                if obj.id not in won:
+                    continue
+                set_committed_value(obj, "state", new_state)
+                set_committed_value(obj, "version", obj.version + 1)
+                for hook in obj.post_transition_hooks:
+                    hook(obj, previous_state, new_state)
+                moved.append(obj)
+        return moved
+
+
+def _record_session_transition(machine, previous_state, new_state):
+    session = object_session(machine)
+    if session is not None:
+        record_transition(
+            session,
+            TransitionRecord(
+                type(machine), machine.id, previous_state, new_state, machine.version
+            ),
+        )
+
 
 class InvestorAccount(Base, TimestampMixin):
     __tablename__ = "investor_account"
@@ -67,8 +313,18 @@ class SingleTransactionSM(GenericStateMachine[SingleTransferState]):
     )
 
 
-class WithdrawalTransaction(Base, TimestampMixin, VersionedMixin, SingleTransactionSM):
+class WithdrawalTransaction(
+    Base, TimestampMixin, AmountMixin, VersionedMixin, SingleTransactionSM
+):
     __tablename__ = "withdrawal_transaction"
+    __table_args__ = (
+        Index("ix_withdrawal_transaction_state_modified", "state", "modified"),
+        Index(
+            "ix_withdrawal_transaction_investor_created",
+            "investor_account_id",
+            "created",
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     investor_account_id: Mapped[int] = mapped_column(ForeignKey("investor_account.id"))
@@ -78,11 +334,7 @@ class WithdrawalTransaction(Base, TimestampMixin, VersionedMixin, SingleTransact
     funding_transactions: Mapped[List["FundingTransaction"]] = relationship(
         back_populates="withdrawal_transaction"
     )
-
-    amount: Mapped[Decimal] = mapped_column(nullable=False)
-
-    def amount_money(self) -> Money:
-        return Money(self.amount, "USD")
+    external_transaction_uid: Mapped[str] = mapped_column(nullable=True)
 
 
 class FundAccount(Base, TimestampMixin):
@@ -94,7 +346,8 @@ class FundAccount(Base, TimestampMixin):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     external_account_uid: Mapped[str] = mapped_column(nullable=True)
-    min_investment_threshold: Mapped[int] = mapped_column(nullable=True)
+    # In minor units of the fund's transfers
+    min_investment_minor: Mapped[int] = mapped_column(BigInteger, nullable=True)
     seat_availability: Mapped[int] = mapped_column(nullable=True)
 
     funding_transactions: Mapped[List["FundingTransaction"]] = relationship(
@@ -105,14 +358,21 @@ class FundAccount(Base, TimestampMixin):
     )
 
 
-class FundDepositTransaction(Base, TimestampMixin, VersionedMixin, SingleTransactionSM):
+class FundDepositTransaction(
+    Base, TimestampMixin, AmountMixin, VersionedMixin, SingleTransactionSM
+):
     __tablename__ = "deposit_transaction"
+    __table_args__ = (
+        Index("ix_deposit_transaction_state_modified", "state", "modified"),
+        Index("ix_deposit_transaction_fund_state", "fund_account_id", "state"),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
     fund_account_id: Mapped[int] = mapped_column(ForeignKey("fund_account.id"))
     fund_account: Mapped[FundAccount] = relationship(
         back_populates="deposit_transactions"
     )
-    amount: Mapped[Decimal] = mapped_column(nullable=False)
+    external_transaction_uid: Mapped[str] = mapped_column(nullable=True)
 
     funding_transactions: Mapped[List["FundingTransaction"]] = relationship(
         back_populates="deposit_transaction"
@@ -155,8 +415,26 @@ class TransactionSM(GenericStateMachine[TransactionState]):
     }
 
 
-class FundingTransaction(Base, TimestampMixin, VersionedMixin, TransactionSM):
+class FundingTransaction(
+    Base, TimestampMixin, AmountMixin, VersionedMixin, TransactionSM
+):
     __tablename__ = "funding_transaction"
+    __table_args__ = (
+        # Sweeps of every transaction in a state, oldest first
+        Index("ix_funding_transaction_state_modified", "state", "modified"),
+        # Keyset pages of an investor's or a fund's transfers, newest first
+        Index(
+            "ix_funding_transaction_investor_created",
+            "investor_account_id",
+            "created",
+            "id",
+        ),
+        Index(
+            "ix_funding_transaction_fund_created", "fund_account_id", "created", "id"
+        ),
+        # All transfers into a fund in a state
+        Index("ix_funding_transaction_fund_state", "fund_account_id", "state"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     investor_account_id: Mapped[int] = mapped_column(
@@ -183,16 +461,209 @@ class FundingTransaction(Base, TimestampMixin, VersionedMixin, TransactionSM):
     deposit_transaction: Mapped[FundDepositTransaction] = relationship(
         back_populates="funding_transactions"
     )
-    amount: Mapped[Decimal] = mapped_column(nullable=False)
     state: Mapped[TransactionState] = mapped_column(
         default=TransactionState.INITIATED, nullable=False
     )
+    # Transient failures retried so far, against the retry budget
+    retries: Mapped[int] = mapped_column(nullable=False, default=0)
 
-    def amount_money(self) -> Money:
-        return Money(self.amount, "USD")
+
+class FundSeatShard(Base):
+    """
+    One slice of a fund's seat_availability. Seats are spread over several
+    counter rows so concurrent reservations don't all update the same row.
+    """
+
+    __tablename__ = "fund_seat_shard"
+
+    fund_account_id: Mapped[int] = mapped_column(
+        ForeignKey("fund_account.id"), primary_key=True
+    )
+    shard: Mapped[int] = mapped_column(primary_key=True)
+    capacity: Mapped[int] = mapped_column(nullable=False)
+    reserved: Mapped[int] = mapped_column(nullable=False, default=0)
+
+
+class SeatReservation(Base, TimestampMixin):
+    """
+    The seat held by a funding transaction and the shard it was taken from.
+    """
+
+    __tablename__ = "seat_reservation"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    funding_transaction_id: Mapped[int] = mapped_column(
+        ForeignKey("funding_transaction.id"), nullable=False, unique=True
+    )
+    fund_account_id: Mapped[int] = mapped_column(
+        ForeignKey("fund_account.id"), nullable=False
+    )
+    shard: Mapped[int] = mapped_column(nullable=False)
+    released: Mapped[bool] = mapped_column(nullable=False, default=False)
+
+
+class InvestorBalance(Base):
+    """
+    Local shadow of an investor's provider balance, in minor units.
+    `balance_minor` is what the provider last reported and `held_minor` is the
+    total of holds placed since that the provider doesn't know about yet.
+    """
+
+    __tablename__ = "investor_balance"
+
+    investor_account_id: Mapped[int] = mapped_column(
+        ForeignKey("investor_account.id"), primary_key=True
+    )
+    balance_minor: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    held_minor: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    currency: Mapped[str] = mapped_column(
+        String(3), nullable=False, default=DEFAULT_CURRENCY
+    )
+    refreshed_at: Mapped[datetime] = mapped_column(nullable=False)
+
+
+class HoldState(PyEnum):
+    HELD = "HELD"
+    WITHDRAWN = "WITHDRAWN"
+    RELEASED = "RELEASED"
+
+
+class BalanceHold(Base, TimestampMixin, AmountMixin):
+    """
+    Funds set aside for a funding transaction until the provider withdrawal
+    happens or the transaction fails.
+    """
+
+    __tablename__ = "balance_hold"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    funding_transaction_id: Mapped[int] = mapped_column(
+        ForeignKey("funding_transaction.id"), nullable=False, unique=True
+    )
+    investor_account_id: Mapped[int] = mapped_column(
+        ForeignKey("investor_account.id"), nullable=False
+    )
+    state: Mapped[HoldState] = mapped_column(nullable=False, default=HoldState.HELD)
+
+
+class NotificationOutbox(Base, TimestampMixin, AmountMixin):
+    """
+    A notification waiting to be delivered to one sink. Rows are written in
+    the same database transaction as the state change they announce and
+    delivered afterwards by the outbox dispatcher.
+    """
+
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index("ix_notification_outbox_due", "delivered_at", "next_attempt_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    sink: Mapped[str] = mapped_column(nullable=False)
+    funding_transaction_id: Mapped[int] = mapped_column(
+        ForeignKey("funding_transaction.id"), nullable=False
+    )
+    investor_account_uid: Mapped[str] = mapped_column(nullable=False)
+    fund_account_uid: Mapped[str] = mapped_column(nullable=False)
+    attempts: Mapped[int] = mapped_column(nullable=False, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(
+        nullable=False, default=datetime.now
+    )
+    delivered_at: Mapped[datetime] = mapped_column(nullable=True)
+    last_error: Mapped[str] = mapped_column(nullable=True)
+
+
+class TransitionEvent(Base):
+    """
+    Append-only log of state machine transitions, one row per transition,
+    written when the transaction that made it commits.
+    """
+
+    __tablename__ = "transition_event"
+    __table_args__ = (
+        Index("ix_transition_event_entity", "entity", "entity_id", "occurred_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # Table name of the model that transitioned
+    entity: Mapped[str] = mapped_column(nullable=False)
+    entity_id: Mapped[int] = mapped_column(nullable=False)
+    from_state: Mapped[str] = mapped_column(nullable=False)
+    to_state: Mapped[str] = mapped_column(nullable=False)
+    version: Mapped[int] = mapped_column(nullable=True)
+    occurred_at: Mapped[datetime] = mapped_column(nullable=False)
+
+
+class FundStateSummary(Base):
+    """
+    Number and total amount of a fund's funding transactions in one state,
+    kept up to date by money_movement.summary.
+    """
+
+    __tablename__ = "fund_state_summary"
+
+    fund_account_id: Mapped[int] = mapped_column(
+        ForeignKey("fund_account.id"), primary_key=True
+    )
+    state: Mapped[TransactionState] = mapped_column(primary_key=True)
+    currency: Mapped[str] = mapped_column(String(3), primary_key=True)
+    transfer_count: Mapped[int] = mapped_column(nullable=False, default=0)
+    amount_minor: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """
+    A client's Idempotency-Key for POST /transfer and the transfer it created,
+    so retries of the request get the original result instead of a new
+    transfer. Purged once older than the retention window.
+    """
+
+    __tablename__ = "idempotency_key"
+    __table_args__ = (Index("ix_idempotency_key_created", "created"),)
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    # Fingerprint of the request, to tell a retry from a reused key
+    request_hash: Mapped[str] = mapped_column(nullable=False)
+    funding_transaction_id: Mapped[int] = mapped_column(
+        ForeignKey("funding_transaction.id"), nullable=False
+    )
+    funding_transaction: Mapped[FundingTransaction] = relationship()
+    created: Mapped[datetime] = mapped_column(nullable=False, default=datetime.now)
+
+
+class ProviderLimit(Base):
+    """
+    Shared rate and concurrency limits for calls to one external provider,
+    updated by every worker process through money_movement.ratelimit.
+    """
+
+    __tablename__ = "provider_limit"
+
+    provider: Mapped[str] = mapped_column(primary_key=True)
+    # Token bucket: tokens available as of refilled_at. Negative while the
+    # provider has asked us to back off.
+    tokens: Mapped[float] = mapped_column(nullable=False)
+    refilled_at: Mapped[datetime] = mapped_column(nullable=False)
+    # Calls allowed in flight at once, adjusted after every call
+    concurrency_limit: Mapped[float] = mapped_column(nullable=False)
+    version: Mapped[int] = mapped_column(nullable=False, default=1)
+
+
+class ProviderPermit(Base):
+    """
+    A call to a provider in flight. Permits left behind by a worker that died
+    mid-call stop counting once they expire.
+    """
+
+    __tablename__ = "provider_permit"
+    __table_args__ = (Index("ix_provider_permit_expires", "provider", "expires_at"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    provider: Mapped[str] = mapped_column(
+        ForeignKey("provider_limit.provider"), nullable=False
+    )
+    expires_at: Mapped[datetime] = mapped_column(nullable=False)
 
 
-engine = create_engine("sqlite:///money_movement.db")
-Base.metadata.create_all(engine)
-Session = sessionmaker(bind=engine)
-session = Session()
+for model in (WithdrawalTransaction, FundDepositTransaction, FundingTransaction):
+    model.add_post_transition_hook(_record_session_transition)
@@ -0,0 +1,311 @@
+"""
+Transactional outbox for notifications.
+
+Completing a deposit writes one notification_outbox row per sink in the same
+database transaction as the state change, so a notification is never lost or
+sent for a change that rolled back, and no sink is called on the workflow's
+critical path. dispatch_outbox drains due rows in batches: a batch is claimed
+with a guarded UPDATE so concurrent dispatchers don't share rows, each sink
+gets its own pool of OUTBOX_SINK_CONCURRENCY threads, and a sink's results
+are committed as soon as its deliveries finish, so a slow sink can't hold up
+the others. Failed deliveries are retried with a doubling delay until
+OUTBOX_MAX_ATTEMPTS.
+
+A claim hides its rows from other dispatchers for OUTBOX_LEASE, by default
+long enough for every delivery in the batch to take the whole
+OUTBOX_DELIVERY_TIMEOUT. A row whose delivery could no longer finish inside
+the lease is not attempted but left for the next claim, and results are only
+recorded for rows still under this dispatcher's lease. Overlapping
+dispatchers then don't deliver a notification twice, as long as sinks keep
+to the timeout.
+"""
+
+import math
+import os
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from logging import Logger, getLogger
+from typing import Dict, Iterator, List, Tuple
+
+from sqlalchemy import insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    NotificationOutbox,
+)
+from money_movement.services.notification import (
+    AbstractNotificationService,
+    LoggingNotificationService,
+    WebhookNotificationService,
+)
+
+logger: Logger = getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+# Deliveries in flight at once for each sink
+OUTBOX_SINK_CONCURRENCY = int(os.environ.get("OUTBOX_SINK_CONCURRENCY", 4))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+# Seconds before the first retry; doubles on every attempt
+OUTBOX_RETRY_DELAY = float(os.environ.get("OUTBOX_RETRY_DELAY", 10))
+# Seconds a sink may take to deliver one notification
+OUTBOX_DELIVERY_TIMEOUT = float(os.environ.get("OUTBOX_DELIVERY_TIMEOUT", 5))
+# Seconds a claimed batch is hidden from other dispatchers
+OUTBOX_LEASE = float(
+    os.environ.get(
+        "OUTBOX_LEASE",
+        (math.ceil(OUTBOX_BATCH_SIZE / OUTBOX_SINK_CONCURRENCY) + 1)
+        * OUTBOX_DELIVERY_TIMEOUT,
+    )
+)
+
+# Sinks by name. Every notification gets one row per sink, so each sink is
+# delivered and retried on its own.
+notification_sinks: Dict[str, AbstractNotificationService] = {
+    "log": LoggingNotificationService()
+}
+if os.environ.get("NOTIFICATION_WEBHOOK_URL"):
+    notification_sinks["webhook"] = WebhookNotificationService(
+        os.environ["NOTIFICATION_WEBHOOK_URL"], timeout=OUTBOX_DELIVERY_TIMEOUT
+    )
+
+# delivered, retried, dead_lettered and lease_expired, for /metrics
+outbox_stats: Counter = Counter()
+
+
+def enqueue_funds_transferred(session: Session, funding_transaction_ids: List[int]):
+    """
+    Queue a funds transferred notification for each transaction and sink, as
+    part of the session's transaction. The account uids are copied in the
+    same statement, so neither the caller nor the dispatcher loads accounts.
+    """
+    if not funding_transaction_ids:
+        return
+    now = datetime.now()
+    for sink in notification_sinks:
+        session.execute(
+            insert(NotificationOutbox).from_select(
+                [
+                    "sink",
+                    "funding_transaction_id",
+                    "amount_minor",
+                    "currency",
+                    "investor_account_uid",
+                    "fund_account_uid",
+                    "attempts",
+                    "next_attempt_at",
+                    "created",
+                    "modified",
+                ],
+                select(
+                    literal(sink),
+                    FundingTransaction.id,
+                    FundingTransaction.amount_minor,
+                    FundingTransaction.currency,
+                    InvestorAccount.external_account_uid,
+                    FundAccount.external_account_uid,
+                    literal(0),
+                    literal(now),
+                    literal(now),
+                    literal(now),
+                )
+                .join(FundingTransaction.investor_account)
+                .join(FundingTransaction.fund_account)
+                .where(FundingTransaction.id.in_(funding_transaction_ids)),
+            )
+        )
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def claim_batch(
+    session: Session, sink_names: List[str], batch_size: int = OUTBOX_BATCH_SIZE
+) -> List[NotificationOutbox]:
+    """
+    Claim up to batch_size due notifications for the named sinks by pushing
+    their next attempt out by OUTBOX_LEASE, and commit the claim.
+    """
+    now = datetime.now()
+    due = (
+        select(NotificationOutbox.id)
+        .where(
+            NotificationOutbox.delivered_at.is_(None),
+            NotificationOutbox.next_attempt_at <= now,
+            NotificationOutbox.attempts < OUTBOX_MAX_ATTEMPTS,
+            NotificationOutbox.sink.in_(sink_names),
+        )
+        .order_by(NotificationOutbox.next_attempt_at, NotificationOutbox.id)
+        .limit(batch_size)
+    )
+    claimed = session.scalars(
+        update(NotificationOutbox)
+        .where(
+            NotificationOutbox.id.in_(due.scalar_subquery()),
+            NotificationOutbox.delivered_at.is_(None),
+            NotificationOutbox.next_attempt_at <= now,
+        )
+        .values(next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE))
+        .returning(NotificationOutbox.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    session.commit()
+    if not claimed:
+        return []
+    return session.scalars(
+        select(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(claimed))
+        .order_by(NotificationOutbox.id)
+    ).all()
+
+
+# Returned for a notification left undelivered because the lease ran short
+LEASE_EXPIRED = "lease expired"
+
+
+def _deliver(sink: AbstractNotificationService, notification: NotificationOutbox):
+    # Claimed rows carry the end of their lease as their next attempt
+    deadline = datetime.now() + timedelta(seconds=OUTBOX_DELIVERY_TIMEOUT)
+    if deadline > notification.next_attempt_at:
+        return LEASE_EXPIRED
+    try:
+        sink.funds_transfered(notification)
+        return None
+    except Exception as e:
+        logger.warning(
+            f"Notification {notification.id} to {notification.sink} failed: {e!r}"
+        )
+        return repr(e)
+
+
+def _deliver_batch(
+    notifications: List[NotificationOutbox],
+    sinks: Dict[str, AbstractNotificationService],
+) -> Iterator[Tuple[str, Dict[int, str | None]]]:
+    """
+    Deliver the notifications, each sink on its own pool, yielding a sink's
+    errors by notification id as soon as all of its deliveries have finished.
+    """
+    by_sink: Dict[str, List[NotificationOutbox]] = {}
+    for notification in notifications:
+        by_sink.setdefault(notification.sink, []).append(notification)
+
+    executors = {
+        name: ThreadPoolExecutor(
+            max_workers=OUTBOX_SINK_CONCURRENCY, thread_name_prefix=f"outbox-{name}"
+        )
+        for name in by_sink
+    }
+    try:
+        remaining = {
+            name: {
+                notification.id: executors[name].submit(
+                    _deliver, sinks[name], notification
+                )
+                for notification in pending
+            }
+            for name, pending in by_sink.items()
+        }
+        while remaining:
+            wait(
+                [f for futures in remaining.values() for f in futures.values()],
+                return_when=FIRST_COMPLETED,
+            )
+            for name, futures in list(remaining.items()):
+                if all(future.done() for future in futures.values()):
+                    del remaining[name]
+                    yield (
+                        name,
+                        {
+                            notification_id: future.result()
+                            for notification_id, future in futures.items()
+                        },
+                    )
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+
+
+def _record(
+    session: Session,
+    errors: Dict[int, str | None],
+    attempts: Dict[int, int],
+    lease_until: datetime,
+) -> List[int]:
+    """
+    Mark the delivered notifications and schedule the failed ones for a
+    retry, leaving out any no longer under the lease ending at `lease_until`.
+    Returns the ids delivered.
+    """
+    now = datetime.now()
+    still_leased = NotificationOutbox.next_attempt_at == lease_until
+    delivered = [n for n, error in errors.items() if error is None]
+    if delivered:
+        session.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id.in_(delivered), still_leased)
+            .values(
+                delivered_at=now,
+                attempts=NotificationOutbox.attempts + 1,
+                last_error=None,
+            )
+            .execution_options(synchronize_session=False)
+        )
+    for notification_id, error in errors.items():
+        if error is None:
+            continue
+        if error is LEASE_EXPIRED:
+            outbox_stats["lease_expired"] += 1
+            continue
+        if attempts[notification_id] >= OUTBOX_MAX_ATTEMPTS:
+            logger.error(f"Giving up on notification {notification_id}: {error}")
+            outbox_stats["dead_lettered"] += 1
+        else:
+            outbox_stats["retried"] += 1
+        session.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id == notification_id, still_leased)
+            .values(
+                attempts=attempts[notification_id],
+                next_attempt_at=now + retry_delay(attempts[notification_id]),
+                last_error=error[:500],
+            )
+            .execution_options(synchronize_session=False)
+        )
+    return delivered
+
+
+def dispatch_outbox(
+    session: Session,
+    sinks: Dict[str, AbstractNotificationService] | None = None,
+    batch_size: int = OUTBOX_BATCH_SIZE,
+) -> int:
+    """
+    Deliver due notifications until none are left, committing each sink's
+    share of a batch as soon as it has been delivered. Returns the number
+    delivered.
+    """
+    if sinks is None:
+        sinks = notification_sinks
+    delivered_count = 0
+    while True:
+        notifications = claim_batch(session, list(sinks), batch_size)
+        if not notifications:
+            return delivered_count
+        attempts = {n.id: n.attempts + 1 for n in notifications}
+        lease_until = notifications[0].next_attempt_at
+        # Sinks still delivering read these while another sink's results are
+        # committed, so they must not be expired by the commit
+        for notification in notifications:
+            session.expunge(notification)
+        for _, errors in _deliver_batch(notifications, sinks):
+            delivered = _record(session, errors, attempts, lease_until)
+            session.commit()
+            outbox_stats["delivered"] += len(delivered)
+            delivered_count += len(delivered)
+        if len(notifications) < batch_size:
+            return delivered_count
@@ -0,0 +1,413 @@
+"""
+Rate and concurrency limits for calls to external providers, shared by every
+worker process through the database.
+
+Each provider has a provider_limit row holding two limits:
+
+- A token bucket refilled at PROVIDER_RATE_LIMIT calls a second up to
+  PROVIDER_BURST, so calls never go out faster than the provider allows.
+- A limit on calls in flight, adjusted after every call AIMD-style: it grows
+  by 1/limit when a call returns within PROVIDER_TARGET_LATENCY, is cut by a
+  tenth when the provider is slower than that, and halved when it throttles
+  us. Calls stay close to what the provider can take without queuing on it.
+
+A call first takes a permit. Spending a token is a guarded UPDATE on the
+row's version, made only while fewer unexpired permits than the limit exist,
+so concurrent workers can't overshoot either limit. Without a permit the
+caller sleeps until one could be due, for up to PROVIDER_PERMIT_TIMEOUT. A
+throttled call empties the bucket for the provider's Retry-After, so every
+worker backs off together, and is retried up to PROVIDER_THROTTLE_RETRIES
+times. Permits expire after PROVIDER_PERMIT_LEASE, so a worker that dies
+mid-call can't leak capacity, and a permit that can't be given back, say
+while another writer holds the database lock, is left to expire rather than
+losing the provider's answer.
+
+The limiter writes in its own session, so a limited call must never be made
+while the caller has a write transaction open: on SQLite the limiter would
+wait on the caller's write lock until it timed out. The tasks call providers
+only between commits.
+"""
+
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from logging import Logger, getLogger
+from typing import IO, Callable, Dict, List, Tuple, TypeVar
+
+from moneyed import Money
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from money_movement import db
+from money_movement.db import dialect_insert
+from money_movement.models import ProviderLimit, ProviderPermit
+from money_movement.services.errors import ProviderThrottled
+from money_movement.services.fund_accounts import (
+    AbstractFundAccountsService,
+    Deposit,
+    DepositState,
+)
+from money_movement.services.investor_accounts import (
+    AbstractInvestorAccountsService,
+    Withdrawal,
+    WithdrawalState,
+)
+
+logger: Logger = getLogger(__name__)
+
+T = TypeVar("T")
+
+# Calls per second, and calls that may go out at once after a quiet spell
+PROVIDER_RATE_LIMIT = float(os.environ.get("PROVIDER_RATE_LIMIT", 10))
+PROVIDER_BURST = float(os.environ.get("PROVIDER_BURST", 20))
+# Bounds and starting point of the adaptive limit on calls in flight
+PROVIDER_MIN_CONCURRENCY = float(os.environ.get("PROVIDER_MIN_CONCURRENCY", 1))
+PROVIDER_INITIAL_CONCURRENCY = float(os.environ.get("PROVIDER_INITIAL_CONCURRENCY", 4))
+PROVIDER_MAX_CONCURRENCY = float(os.environ.get("PROVIDER_MAX_CONCURRENCY", 64))
+# Seconds a call may take before the concurrency limit is cut
+PROVIDER_TARGET_LATENCY = float(os.environ.get("PROVIDER_TARGET_LATENCY", 1))
+# Seconds a caller waits for a permit before giving up
+PROVIDER_PERMIT_TIMEOUT = float(os.environ.get("PROVIDER_PERMIT_TIMEOUT", 30))
+# Seconds after which a permit not given back is reclaimed
+PROVIDER_PERMIT_LEASE = float(os.environ.get("PROVIDER_PERMIT_LEASE", 60))
+PROVIDER_THROTTLE_RETRIES = int(os.environ.get("PROVIDER_THROTTLE_RETRIES", 3))
+
+# Multiplicative decreases of the concurrency limit
+SLOW_CALL_BACKOFF = 0.9
+THROTTLE_BACKOFF = 0.5
+
+# permits, waits, timeouts, slow_calls, throttled, reclaimed and release_errors,
+# for /metrics
+rate_limit_stats: Counter = Counter()
+
+
+class ProviderLimiter:
+    """
+    Limits calls to the provider named `provider`, together with every other
+    limiter for the same provider in any process.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        rate: float = PROVIDER_RATE_LIMIT,
+        burst: float = PROVIDER_BURST,
+        min_concurrency: float = PROVIDER_MIN_CONCURRENCY,
+        initial_concurrency: float = PROVIDER_INITIAL_CONCURRENCY,
+        max_concurrency: float = PROVIDER_MAX_CONCURRENCY,
+        target_latency: float = PROVIDER_TARGET_LATENCY,
+        permit_timeout: float = PROVIDER_PERMIT_TIMEOUT,
+        permit_lease: float = PROVIDER_PERMIT_LEASE,
+        throttle_retries: int = PROVIDER_THROTTLE_RETRIES,
+        session_factory: Callable[[], Session] | None = None,
+        clock: Callable[[], datetime] = datetime.now,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        session_factory: defaults to money_movement.db.Session, looked up on
+        every call. clock and sleep are replaceable for tests.
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError("Rate must be positive and burst at least 1")
+        if not 1 <= min_concurrency <= initial_concurrency <= max_concurrency:
+            raise ValueError(
+                "Concurrency limits must satisfy 1 <= min <= initial <= max"
+            )
+        self.provider = provider
+        self.rate = rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.permit_timeout = permit_timeout
+        self.permit_lease = permit_lease
+        self.throttle_retries = throttle_retries
+        self.session_factory = session_factory
+        self.clock = clock
+        self.sleep = sleep
+
+    def _session(self) -> Session:
+        return (self.session_factory or db.Session)()
+
+    def _load(self, session: Session) -> ProviderLimit:
+        limit = session.get(ProviderLimit, self.provider, populate_existing=True)
+        if limit is None:
+            session.execute(
+                dialect_insert(session, ProviderLimit)
+                .values(
+                    provider=self.provider,
+                    tokens=self.burst,
+                    refilled_at=self.clock(),
+                    concurrency_limit=self.initial_concurrency,
+                    version=1,
+                )
+                .on_conflict_do_nothing(index_elements=[ProviderLimit.provider])
+            )
+            limit = session.get(ProviderLimit, self.provider, populate_existing=True)
+        return limit
+
+    def _tokens(self, limit: ProviderLimit, now: datetime) -> float:
+        elapsed = max((now - limit.refilled_at).total_seconds(), 0)
+        return min(self.burst, limit.tokens + elapsed * self.rate)
+
+    def _cas(self, session: Session, limit: ProviderLimit, **values) -> bool:
+        result = session.execute(
+            update(ProviderLimit)
+            .where(
+                ProviderLimit.provider == self.provider,
+                ProviderLimit.version == limit.version,
+            )
+            .values(version=ProviderLimit.version + 1, **values)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def _try_acquire(self) -> Tuple[int | None, float]:
+        """
+        Take a permit if both limits allow one. Returns the permit id, or None
+        and the seconds to wait before trying again.
+        """
+        with self._session() as session:
+            now = self.clock()
+            # Read before counting permits, so a permit taken after this read
+            # also changes the version and fails the update below
+            limit = self._load(session)
+            reclaimed = session.execute(
+                delete(ProviderPermit).where(
+                    ProviderPermit.provider == self.provider,
+                    ProviderPermit.expires_at <= now,
+                )
+            ).rowcount
+            if reclaimed:
+                rate_limit_stats["reclaimed"] += reclaimed
+                logger.warning(f"Reclaimed {reclaimed} expired {self.provider} permits")
+            in_flight = session.scalar(
+                select(func.count()).where(ProviderPermit.provider == self.provider)
+            )
+            tokens = self._tokens(limit, now)
+            if tokens < 1:
+                session.commit()
+                return None, (1 - tokens) / self.rate
+            if in_flight >= int(limit.concurrency_limit):
+                session.commit()
+                return None, 1 / self.rate
+            if not self._cas(session, limit, tokens=tokens - 1, refilled_at=now):
+                # Another caller took a permit or returned one; look again
+                session.rollback()
+                return None, 0.0
+            permit = ProviderPermit(
+                provider=self.provider,
+                expires_at=now + timedelta(seconds=self.permit_lease),
+            )
+            session.add(permit)
+            session.commit()
+            return permit.id, 0.0
+
+    def acquire(self) -> int:
+        """
+        Wait for a permit to call the provider and return its id. Raises
+        ProviderThrottled if none comes within the permit timeout.
+        """
+        deadline = self.clock() + timedelta(seconds=self.permit_timeout)
+        waited = False
+        while True:
+            permit_id, wait = self._try_acquire()
+            if permit_id is not None:
+                rate_limit_stats["permits"] += 1
+                rate_limit_stats["waits"] += waited
+                return permit_id
+            if wait > (deadline - self.clock()).total_seconds():
+                rate_limit_stats["timeouts"] += 1
+                raise ProviderThrottled(
+                    f"No {self.provider} permit within {self.permit_timeout}s",
+                    retry_after=wait,
+                )
+            if wait:
+                waited = True
+                self.sleep(wait)
+
+    def release(
+        self,
+        permit_id: int,
+        latency: float | None = None,
+        throttled: bool = False,
+        retry_after: float | None = None,
+    ):
+        """
+        Give back a permit and adjust the concurrency limit by how the call
+        went: its latency in seconds, or whether the provider throttled it.
+        Calls that failed otherwise leave the limit as it was.
+        """
+        with self._session() as session:
+            session.execute(
+                delete(ProviderPermit).where(ProviderPermit.id == permit_id)
+            )
+            if throttled or latency is not None:
+                # Counted once; only the versioned update is retried
+                backoff = self._backoff(latency, throttled)
+                while True:
+                    limit = self._load(session)
+                    values = {
+                        "concurrency_limit": self._adjusted(
+                            limit.concurrency_limit, backoff
+                        )
+                    }
+                    if throttled:
+                        # Nothing goes out until the provider's delay has passed
+                        now = self.clock()
+                        values["tokens"] = min(
+                            self._tokens(limit, now),
+                            -(retry_after or 0) * self.rate,
+                        )
+                        values["refilled_at"] = now
+                    if self._cas(session, limit, **values):
+                        break
+            session.commit()
+
+    def _backoff(self, latency: float | None, throttled: bool) -> float | None:
+        """
+        The factor to cut the concurrency limit by after a call, or None to
+        grow it.
+        """
+        if throttled:
+            rate_limit_stats["throttled"] += 1
+            return THROTTLE_BACKOFF
+        if latency > self.target_latency:
+            rate_limit_stats["slow_calls"] += 1
+            return SLOW_CALL_BACKOFF
+        return None
+
+    def _adjusted(self, limit: float, backoff: float | None) -> float:
+        if backoff is not None:
+            return max(self.min_concurrency, limit * backoff)
+        return min(self.max_concurrency, limit + 1 / limit)
+
+    def call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Call `fn` under a permit, retrying calls the provider throttles.
+        """
+        for attempt in range(self.throttle_retries + 1):
+            permit_id = self.acquire()
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except ProviderThrottled as e:
+                self._give_back(permit_id, throttled=True, retry_after=e.retry_after)
+                if attempt == self.throttle_retries:
+                    raise
+                logger.info(f"{self.provider} throttled a call, retrying")
+                continue
+            except BaseException:
+                self._give_back(permit_id)
+                raise
+            self._give_back(permit_id, latency=time.perf_counter() - started)
+            return result
+
+    def _give_back(self, permit_id: int, **outcome):
+        """
+        Release a permit after a call, leaving it to expire if the database
+        won't take the release.
+        """
+        try:
+            self.release(permit_id, **outcome)
+        except OperationalError as e:
+            rate_limit_stats["release_errors"] += 1
+            logger.warning(
+                f"Could not release {self.provider} permit {permit_id}, "
+                f"leaving it to expire: {e!r}"
+            )
+
+
+def provider_limits_query():
+    """
+    Every provider's current limits, with the number of unexpired permits.
+    """
+    in_flight = (
+        select(func.count())
+        .where(
+            ProviderPermit.provider == ProviderLimit.provider,
+            ProviderPermit.expires_at > datetime.now(),
+        )
+        .scalar_subquery()
+    )
+    return select(
+        ProviderLimit.provider,
+        ProviderLimit.concurrency_limit,
+        in_flight.label("in_flight"),
+        ProviderLimit.tokens,
+        ProviderLimit.refilled_at,
+    ).order_by(ProviderLimit.provider)
+
+
+class RateLimitedInvestorAccountsService(AbstractInvestorAccountsService):
+    """
+    Makes every call to `service` through `limiter`.
+    """
+
+    def __init__(
+        self, service: AbstractInvestorAccountsService, limiter: ProviderLimiter
+    ):
+        self.service = service
+        self.limiter = limiter
+
+    def check_balance(self, account_id: str) -> Money:
+        return self.limiter.call(self.service.check_balance, account_id=account_id)
+
+    def withdraw_funds(
+        self, account_id: str, amount: Money, idempotency_key: str | None = None
+    ) -> Withdrawal:
+        return self.limiter.call(
+            self.service.withdraw_funds,
+            account_id=account_id,
+            amount=amount,
+            idempotency_key=idempotency_key,
+        )
+
+    def withdrawal_status(self, withdrawal_id: str, account_id: str) -> WithdrawalState:
+        return self.limiter.call(
+            self.service.withdrawal_status,
+            withdrawal_id=withdrawal_id,
+            account_id=account_id,
+        )
+
+    def withdrawal_status_many(
+        self, withdrawal_ids: List[str]
+    ) -> Dict[str, WithdrawalState]:
+        return self.limiter.call(self.service.withdrawal_status_many, withdrawal_ids)
+
+    def write_statement(self, file: IO[str], format: str = "csv"):
+        return self.limiter.call(self.service.write_statement, file, format)
+
+
+class RateLimitedFundAccountsService(AbstractFundAccountsService):
+    """
+    Makes every call to `service` through `limiter`.
+    """
+
+    def __init__(self, service: AbstractFundAccountsService, limiter: ProviderLimiter):
+        self.service = service
+        self.limiter = limiter
+
+    def deposit_funds(
+        self, account_id: str, amount: Money, idempotency_key: str | None = None
+    ) -> Deposit:
+        return self.limiter.call(
+            self.service.deposit_funds,
+            account_id=account_id,
+            amount=amount,
+            idempotency_key=idempotency_key,
+        )
+
+    def deposit_status(self, deposit_id: str, account_id: str) -> DepositState:
+        return self.limiter.call(
+            self.service.deposit_status, deposit_id=deposit_id, account_id=account_id
+        )
+
+    def deposit_status_many(self, deposit_ids: List[str]) -> Dict[str, DepositState]:
+        return self.limiter.call(self.service.deposit_status_many, deposit_ids)
+
+    def write_statement(self, file: IO[str], format: str = "csv"):
+        return self.limiter.call(self.service.write_statement, file, format)
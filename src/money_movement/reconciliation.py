@@ -0,0 +1,243 @@
+"""
+Reconciliation of our withdrawal and deposit records against provider
+statements.
+
+Our records and the statement are both read as streams sorted by the
+provider's transfer id and merge-joined in a single pass, so memory stays
+bounded by the number of entries sharing one id, however long the statement
+is. Every id is reported as matched or as a discrepancy:
+
+    missing_from_statement  we recorded a transfer the provider doesn't list
+    missing_from_records    the provider lists a transfer we have no record of
+    duplicate_in_statement  the provider lists the id more than once
+    duplicate_in_records    more than one of our records has the id
+    amount_mismatch         both sides have the id with different amounts
+    status_mismatch         the provider lists as failed a transfer we have not
+
+Amounts are compared as integer minor units; statement amounts are converted
+exactly on reading. Failed transfers are otherwise left out on both sides.
+Run with
+`python -m money_movement.reconciliation withdrawals statement.csv`.
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from enum import Enum
+from itertools import groupby
+from typing import IO, Iterable, Iterator, List, NamedTuple, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from money_movement import db
+from money_movement.amounts import to_minor
+from money_movement.models import (
+    FundDepositTransaction,
+    SingleTransferState,
+    WithdrawalTransaction,
+)
+from money_movement.services.statements import (
+    FAILED_STATUS,
+    StatementEntry,
+    read_statement,
+    statement_format,
+)
+
+RECONCILIATION_BATCH_SIZE = int(os.environ.get("RECONCILIATION_BATCH_SIZE", 1000))
+
+MODELS = {"withdrawals": WithdrawalTransaction, "deposits": FundDepositTransaction}
+
+
+class DiscrepancyKind(Enum):
+    MISSING_FROM_STATEMENT = "missing_from_statement"
+    MISSING_FROM_RECORDS = "missing_from_records"
+    DUPLICATE_IN_STATEMENT = "duplicate_in_statement"
+    DUPLICATE_IN_RECORDS = "duplicate_in_records"
+    AMOUNT_MISMATCH = "amount_mismatch"
+    STATUS_MISMATCH = "status_mismatch"
+
+
+class RecordEntry(NamedTuple):
+    transaction_id: str
+    id: int
+    amount_minor: int
+
+
+class Discrepancy(NamedTuple):
+    kind: DiscrepancyKind
+    transaction_id: str
+    record_ids: List[int]
+    record_amount_minor: int | None
+    statement_amount_minor: int | None
+
+    def to_dict(self) -> dict:
+        return {**self._asdict(), "kind": self.kind.value}
+
+
+def stream_records(
+    session: Session, model, batch_size: int = RECONCILIATION_BATCH_SIZE
+) -> Iterator[RecordEntry]:
+    """
+    Our transfers of `model` that have a provider id and didn't fail, sorted
+    by provider id, read through a server-side cursor.
+    """
+    uid = model.external_transaction_uid
+    if session.get_bind().dialect.name == "postgresql":
+        # Sort bytewise, like the statement and Python's string comparison
+        uid = uid.collate("C")
+    result = session.execute(
+        select(model.external_transaction_uid, model.id, model.amount_minor)
+        .where(
+            model.external_transaction_uid.is_not(None),
+            model.state != SingleTransferState.FAILED,
+        )
+        .order_by(uid, model.id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for row in result:
+        yield RecordEntry(*row)
+
+
+def _groups(entries: Iterable, side: str) -> Iterator[Tuple[str, List]]:
+    previous = None
+    for transaction_id, group in groupby(entries, key=lambda e: e.transaction_id):
+        if previous is not None and transaction_id <= previous:
+            raise ValueError(
+                f"{side} is not sorted by transaction id at {transaction_id!r}"
+            )
+        previous = transaction_id
+        yield transaction_id, list(group)
+
+
+def reconcile(
+    records: Iterable[RecordEntry], statement: Iterable[StatementEntry]
+) -> Iterator[Discrepancy | None]:
+    """
+    Merge-join two streams sorted by transaction id. Yields a Discrepancy
+    for each problem found and None for each id that matched, and raises
+    ValueError if either stream turns out not to be sorted.
+    """
+    ours = _groups(records, "Records")
+    theirs = _groups(statement, "Statement")
+    record = next(ours, None)
+    entry = next(theirs, None)
+    while record is not None or entry is not None:
+        if entry is None or (record is not None and record[0] < entry[0]):
+            transaction_id, matched = record
+            yield Discrepancy(
+                DiscrepancyKind.MISSING_FROM_STATEMENT,
+                transaction_id,
+                [r.id for r in matched],
+                sum(r.amount_minor for r in matched),
+                None,
+            )
+            record = next(ours, None)
+        elif record is None or entry[0] < record[0]:
+            transaction_id, listed = entry
+            listed = _succeeded(listed)
+            if listed:
+                yield Discrepancy(
+                    DiscrepancyKind.MISSING_FROM_RECORDS,
+                    transaction_id,
+                    [],
+                    None,
+                    _statement_amount(listed),
+                )
+            entry = next(theirs, None)
+        else:
+            yield from _compare(record[0], record[1], entry[1])
+            record = next(ours, None)
+            entry = next(theirs, None)
+
+
+def _compare(
+    transaction_id: str, matched: List[RecordEntry], listed: List[StatementEntry]
+) -> Iterator[Discrepancy | None]:
+    record_ids = [r.id for r in matched]
+    record_amount = sum(r.amount_minor for r in matched)
+    succeeded = _succeeded(listed)
+    if not succeeded:
+        yield Discrepancy(
+            DiscrepancyKind.STATUS_MISMATCH,
+            transaction_id,
+            record_ids,
+            record_amount,
+            _statement_amount(listed),
+        )
+        return
+    listed = succeeded
+    statement_amount = _statement_amount(listed)
+    problems = []
+    if len(matched) > 1:
+        problems.append(DiscrepancyKind.DUPLICATE_IN_RECORDS)
+    if len(listed) > 1:
+        problems.append(DiscrepancyKind.DUPLICATE_IN_STATEMENT)
+    if not problems and record_amount != statement_amount:
+        problems.append(DiscrepancyKind.AMOUNT_MISMATCH)
+    if not problems:
+        yield None
+    for kind in problems:
+        yield Discrepancy(
+            kind, transaction_id, record_ids, record_amount, statement_amount
+        )
+
+
+def _succeeded(listed: List[StatementEntry]) -> List[StatementEntry]:
+    return [e for e in listed if e.status.upper() != FAILED_STATUS]
+
+
+def _statement_amount(listed: List[StatementEntry]) -> int:
+    return sum(to_minor(e.amount, e.currency) for e in listed)
+
+
+def reconcile_statement(
+    session: Session, model, statement: IO[str], output: IO[str], format="csv"
+) -> Counter:
+    """
+    Reconcile a statement file against our records of `model`, writing each
+    discrepancy to `output` as a line of NDJSON. Returns the number of
+    matched ids and of each kind of discrepancy.
+    """
+    counts: Counter = Counter()
+    for discrepancy in reconcile(
+        stream_records(session, model), read_statement(statement, format)
+    ):
+        if discrepancy is None:
+            counts["matched"] += 1
+            continue
+        counts[discrepancy.kind.value] += 1
+        output.write(json.dumps(discrepancy.to_dict()) + "\n")
+    return counts
+
+
+def main(argv: List[str] | None = None) -> Counter:
+    parser = argparse.ArgumentParser(
+        description="Reconcile a provider statement against our records"
+    )
+    parser.add_argument("transfers", choices=sorted(MODELS))
+    parser.add_argument("statement", help="CSV, or NDJSON if named .ndjson/.jsonl")
+    parser.add_argument("--output", help="Write discrepancies here, not stdout")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        with db.Session() as session, open(args.statement, newline="") as file:
+            counts = reconcile_statement(
+                session,
+                MODELS[args.transfers],
+                file,
+                output,
+                statement_format(args.statement),
+            )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(json.dumps(dict(counts)), file=sys.stderr)
+    return counts
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Retries of workflow tasks after transient failures.
+
+A provider timing out, being unreachable, answering with a server error or
+throttling us, and the database dropping a connection or timing out on a
+lock (SQLite's "database is locked", a PostgreSQL lock timeout, deadlock or
+serialization failure), are transient: the task is retried by Celery after a
+backoff and the transfer stays where it was. Anything else is terminal and
+fails the transfer, as before. That includes other database errors, such as
+bad SQL or a missing table, which retrying would only hide.
+
+Backoff doubles from TASK_RETRY_BASE_DELAY up to TASK_RETRY_MAX_DELAY with
+full jitter, a uniformly random delay up to that bound, so tasks that failed
+together against a struggling provider don't all come back together. A
+provider's Retry-After is a lower bound. Every transfer has a retry budget of
+TRANSACTION_RETRY_BUDGET transient failures, counted across all of its tasks
+in funding_transaction.retries; once spent, the next failure is terminal.
+"""
+
+import os
+import random
+from collections import Counter
+from typing import Callable
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import Session
+
+from money_movement.models import FundingTransaction
+from money_movement.services.errors import TransientProviderError
+
+TASK_RETRY_BASE_DELAY = float(os.environ.get("TASK_RETRY_BASE_DELAY", 2))
+TASK_RETRY_MAX_DELAY = float(os.environ.get("TASK_RETRY_MAX_DELAY", 300))
+TRANSACTION_RETRY_BUDGET = int(os.environ.get("TRANSACTION_RETRY_BUDGET", 10))
+
+TRANSIENT_ERRORS = (TransientProviderError, ConnectionError, TimeoutError)
+
+# SQLite result codes and PostgreSQL SQLSTATEs of an operation that lost out
+# to another's lock: lock not available, deadlock, serialization failure
+LOCK_ERROR_CODES = ("SQLITE_BUSY", "SQLITE_LOCKED", "55P03", "40P01", "40001")
+# For drivers that give no code
+LOCK_ERROR_MESSAGES = ("database is locked", "database table is locked")
+
+# retried, exhausted and terminal, for /metrics
+retry_stats: Counter = Counter()
+
+
+def is_transient(error: BaseException) -> bool:
+    if isinstance(error, DBAPIError):
+        # A lost connection, which the pool replaces before the retry, or a
+        # lock held by someone else
+        return error.connection_invalidated or (
+            isinstance(error, OperationalError) and _is_lock_error(error.orig)
+        )
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def _is_lock_error(orig: BaseException) -> bool:
+    code = (
+        getattr(orig, "sqlite_errorname", None)
+        or getattr(orig, "pgcode", None)
+        or getattr(orig, "sqlstate", None)
+    )
+    if code is not None:
+        return code.startswith(LOCK_ERROR_CODES)
+    return any(message in str(orig) for message in LOCK_ERROR_MESSAGES)
+
+
+def retry_countdown(
+    retries: int,
+    error: BaseException | None = None,
+    base_delay: float = TASK_RETRY_BASE_DELAY,
+    max_delay: float = TASK_RETRY_MAX_DELAY,
+    rng: Callable[[], float] = random.random,
+) -> float:
+    """
+    Seconds to wait before retrying after `retries` earlier retries: a random
+    delay up to the doubling bound, but no less than the error's retry_after.
+    """
+    countdown = rng() * min(max_delay, base_delay * 2**retries)
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        countdown = max(countdown, retry_after)
+    return countdown
+
+
+def spend_retry(
+    session: Session, *criteria, budget: int = TRANSACTION_RETRY_BUDGET
+) -> int | None:
+    """
+    Count a retry against every funding transaction matching `criteria` and
+    commit, after rolling back whatever the session had pending. Returns the
+    most retries any of them has now had, or None if that is over the budget.
+    """
+    session.rollback()
+    session.execute(
+        update(FundingTransaction)
+        .where(*criteria)
+        .values(retries=FundingTransaction.retries + 1)
+        .execution_options(synchronize_session=False)
+    )
+    retries = session.scalar(
+        select(func.max(FundingTransaction.retries)).where(*criteria)
+    )
+    session.commit()
+    if retries is None or retries > budget:
+        retry_stats["exhausted"] += 1
+        return None
+    retry_stats["retried"] += 1
+    return retries
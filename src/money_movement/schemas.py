@@ -1,12 +1,67 @@
-from pydantic import BaseModel
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+MAX_BATCH_TRANSFERS = 50_000
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
 
 
 class TransferRequest(BaseModel):
     investor_id: int
     fund_id: int
-    amount: float
+    # Major units, parsed exactly and converted to minor units on receipt
+    amount: Decimal
 
 
 class TransferStatus(BaseModel):
     status: str
     message: str
+
+
+class BatchTransferRequest(BaseModel):
+    transfers: List[TransferRequest] = Field(max_length=MAX_BATCH_TRANSFERS)
+
+
+class BatchTransferResult(BaseModel):
+    index: int
+    status: str
+    transfer_id: Optional[int] = None
+    message: str
+
+
+class BatchTransferResponse(BaseModel):
+    results: List[BatchTransferResult]
+
+
+class TransferSummary(BaseModel):
+    id: int
+    investor_id: int
+    fund_id: int
+    amount: Decimal
+    currency: str
+    state: str
+    created: datetime
+    modified: datetime
+
+
+class TransferPage(BaseModel):
+    transfers: List[TransferSummary]
+    # Pass as `cursor` to get the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+class StateSummary(BaseModel):
+    state: str
+    currency: str
+    count: int
+    amount: Decimal
+
+
+class FundSummary(BaseModel):
+    fund_id: int
+    states: List[StateSummary]
+    # Amount per currency not yet deposited into the fund or failed
+    in_flight: Dict[str, Decimal]
@@ -0,0 +1,189 @@
+"""
+Seat reservations for funds with a limited seat_availability.
+
+A fund's seats are split over SEAT_SHARDS counter rows. A reservation is a
+conditional `UPDATE ... SET reserved = reserved + 1 WHERE reserved < capacity`
+on one shard, starting from a shard picked by the transaction id and moving on
+when that one is full. Concurrent reservations spread over rows instead of
+queueing on the fund, and the guard means a fund can never be overbooked.
+
+Seats are taken in process_withdrawal before any money moves and are given
+back when their funding transaction fails. Shards are created from the fund's
+seat_availability on first use.
+"""
+
+import os
+from datetime import datetime
+from logging import Logger, getLogger
+from typing import List, Tuple
+
+from sqlalchemy import event, func, select, update
+from sqlalchemy.orm import Session
+
+from money_movement.db import dialect_insert
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    FundSeatShard,
+    SeatReservation,
+    TransactionState,
+    session_transitions,
+)
+
+logger: Logger = getLogger(__name__)
+
+SEAT_SHARDS = int(os.environ.get("SEAT_SHARDS", 8))
+
+
+def shard_capacities(seats: int, shards: int = SEAT_SHARDS) -> List[int]:
+    """
+    Split `seats` as evenly as possible over at most `shards` rows, without
+    creating shards that have no seats.
+    """
+    shards = max(min(shards, seats), 1)
+    base, extra = divmod(seats, shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+def create_seat_shards(session: Session, fund_account_id: int, seats: int):
+    """
+    Create the shard rows for a fund. Shards that already exist, for example
+    because another worker created them first, are left alone.
+    """
+    session.execute(
+        dialect_insert(session, FundSeatShard).on_conflict_do_nothing(),
+        [
+            {
+                "fund_account_id": fund_account_id,
+                "shard": shard,
+                "capacity": capacity,
+                "reserved": 0,
+            }
+            for shard, capacity in enumerate(shard_capacities(seats))
+        ],
+    )
+
+
+def _take_seat(
+    session: Session, fund_account_id: int, funding_transaction_id: int, shards: int
+) -> int | None:
+    for offset in range(shards):
+        shard = (funding_transaction_id + offset) % shards
+        result = session.execute(
+            update(FundSeatShard)
+            .where(
+                FundSeatShard.fund_account_id == fund_account_id,
+                FundSeatShard.shard == shard,
+                FundSeatShard.reserved < FundSeatShard.capacity,
+            )
+            .values(reserved=FundSeatShard.reserved + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            return shard
+    return None
+
+
+def _has_shards(session: Session, fund_account_id: int) -> bool:
+    return (
+        session.scalar(
+            select(FundSeatShard.shard)
+            .where(FundSeatShard.fund_account_id == fund_account_id)
+            .limit(1)
+        )
+        is not None
+    )
+
+
+def reserve_seat(
+    session: Session, fund_account: FundAccount, funding_transaction_id: int
+) -> bool:
+    """
+    Take a seat in the fund for a funding transaction, as part of the
+    session's transaction. Returns False when the fund is full. Funds without
+    a seat_availability are never full.
+    """
+    seats = fund_account.seat_availability
+    if seats is None:
+        return True
+    shards = len(shard_capacities(seats))
+    shard = _take_seat(session, fund_account.id, funding_transaction_id, shards)
+    if shard is None and not _has_shards(session, fund_account.id):
+        create_seat_shards(session, fund_account.id, seats)
+        shard = _take_seat(session, fund_account.id, funding_transaction_id, shards)
+    if shard is None:
+        logger.info(f"No seats left in fund {fund_account.id}")
+        return False
+
+    session.add(
+        SeatReservation(
+            funding_transaction_id=funding_transaction_id,
+            fund_account_id=fund_account.id,
+            shard=shard,
+        )
+    )
+    return True
+
+
+def release_seat(session: Session, funding_transaction_id: int) -> bool:
+    """
+    Give back the seat held by a funding transaction, if it holds one.
+    Safe to call more than once.
+    """
+    reservation = session.execute(
+        select(
+            SeatReservation.id, SeatReservation.fund_account_id, SeatReservation.shard
+        ).where(
+            SeatReservation.funding_transaction_id == funding_transaction_id,
+            SeatReservation.released.is_(False),
+        )
+    ).first()
+    if reservation is None:
+        return False
+
+    result = session.execute(
+        update(SeatReservation)
+        .where(
+            SeatReservation.id == reservation.id,
+            SeatReservation.released.is_(False),
+        )
+        .values(released=True, modified=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    session.execute(
+        update(FundSeatShard)
+        .where(
+            FundSeatShard.fund_account_id == reservation.fund_account_id,
+            FundSeatShard.shard == reservation.shard,
+            FundSeatShard.reserved > 0,
+        )
+        .values(reserved=FundSeatShard.reserved - 1)
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def seat_usage(session: Session, fund_account_id: int) -> Tuple[int, int]:
+    """
+    (reserved, capacity) summed over a fund's shards.
+    """
+    reserved, capacity = session.execute(
+        select(
+            func.coalesce(func.sum(FundSeatShard.reserved), 0),
+            func.coalesce(func.sum(FundSeatShard.capacity), 0),
+        ).where(FundSeatShard.fund_account_id == fund_account_id)
+    ).one()
+    return reserved, capacity
+
+
+@event.listens_for(Session, "before_commit")
+def _release_failed_seats(session):
+    # Failed transactions give their seat back in the same commit
+    for record in list(session_transitions(session)):
+        if (
+            record.model is FundingTransaction
+            and record.new_state == TransactionState.FAILED
+        ):
+            release_seat(session, record.id)
@@ -0,0 +1,45 @@
+"""
+Errors raised by provider services.
+
+A TransientProviderError means the call may well succeed if made again
+later: the provider timed out, was unreachable, answered with a server error
+or throttled us. A TerminalProviderError means the provider rejected the
+request itself, and making it again won't help. The workflow tasks retry the
+first kind and fail the transfer on the second.
+"""
+
+
+class ProviderError(Exception):
+    pass
+
+
+class TransientProviderError(ProviderError):
+    """
+    `retry_after` is how long the provider asked us to wait in seconds, if it
+    said.
+    """
+
+    def __init__(self, message: str = "", retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ProviderThrottled(TransientProviderError):
+    """
+    The provider turned a call away because we are calling too often, as with
+    an HTTP 429.
+    """
+
+    def __init__(
+        self,
+        message: str = "Provider throttled the call",
+        retry_after: float | None = None,
+    ):
+        super().__init__(message, retry_after)
+
+
+class TerminalProviderError(ProviderError):
+    """
+    The provider rejected the request, for example for an unknown account or
+    an invalid amount.
+    """
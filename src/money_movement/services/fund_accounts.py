@@ -1,6 +1,19 @@
+import time
+from decimal import Decimal
 from enum import Enum
-from typing import Dict, List
+from typing import IO, Dict, List
+from urllib.parse import quote
+
+import httpx
 from moneyed import Money
+from money_movement.services.http import (
+    PROVIDER_STATUS_BATCH_SIZE,
+    check_response,
+    idempotency_headers,
+    provider_client,
+    transport_errors,
+)
+from money_movement.services.statements import StatementEntry, write_statement
 
 from money_movement.util import generate_random_id
 from money_movement.state_machine import GenericStateMachine
@@ -35,6 +48,8 @@ class Deposit(GenericStateMachine[DepositState]):
         self.transition(DepositState.FAILED)
 
     def complete(self):
+        if self.get_state() == DepositState.CREATED:
+            self.transition(DepositState.IN_PROGRESS)
         self.transition(DepositState.COMPLETED)
 
     def get_account_id(self) -> str:
@@ -54,10 +69,30 @@ class AbstractFundAccountsService:
     def __init__(self):
         pass
 
-    def deposit_funds(self, account_id: str, amount: Money) -> Deposit:
+    def deposit_funds(
+        self, account_id: str, amount: Money, idempotency_key: str | None = None
+    ) -> Deposit:
+        """
+        Repeating a deposit with the same idempotency key returns the first
+        deposit instead of making another.
+        """
         pass
 
-    def deposit_status(self, deposit_id: str) -> DepositState:
+    def deposit_status(self, deposit_id: str, account_id: str) -> DepositState:
+        pass
+
+    def deposit_status_many(self, deposit_ids: List[str]) -> Dict[str, DepositState]:
+        """
+        Look up many deposits in one provider call.
+        Unknown deposit ids are left out of the result.
+        """
+        pass
+
+    def write_statement(self, file: IO[str], format: str = "csv"):
+        """
+        Write a statement of every deposit that didn't fail, sorted by
+        deposit id.
+        """
         pass
 
 
@@ -66,32 +101,160 @@ class MockFundAccountsService:
     Mock implementation of a service that handles depositing funds into investment firm accounts.
     """
 
-    def __init__(self, accounts: List[str] = []):
+    def __init__(self, accounts: List[str] = [], settlement_delay: float | None = None):
+        """
+        settlement_delay: seconds after which deposits report as completed.
+        When None they stay as created until _complete_deposit.
+        """
         self.accounts = accounts
         self.default_currency = "USD"
         self.deposits: Dict[str, Dict[str]] = {}
         for account_id in accounts:
             self.deposits[account_id] = {}
+        self.settlement_delay = settlement_delay
+        self._settles_at: Dict[str, float] = {}
+        self._deposits_by_id: Dict[str, Deposit] = {}
+        self._idempotency_keys: Dict[str, str] = {}
 
-    def deposit_funds(self, account_id: str, amount: Money) -> str:
+    def deposit_funds(
+        self, account_id: str, amount: Money, idempotency_key: str | None = None
+    ) -> Deposit:
+        if idempotency_key in self._idempotency_keys:
+            return self._deposits_by_id[self._idempotency_keys[idempotency_key]]
         deposit_id = generate_random_id()
         deposit = Deposit(deposit_id, account_id, amount)
-        if account_id in self.deposits:
-            self.deposits[account_id][deposit_id] = deposit
+        if idempotency_key is not None:
+            self._idempotency_keys[idempotency_key] = deposit_id
+        self.deposits.setdefault(account_id, {})[deposit_id] = deposit
+        self._deposits_by_id[deposit_id] = deposit
+        if self.settlement_delay is not None:
+            self._settles_at[deposit_id] = time.monotonic() + self.settlement_delay
         return deposit
 
     def deposit_status(self, account_id: str, deposit_id: str) -> DepositState:
-        if deposit_id in self.deposits[account_id]:
-            return self.deposits[account_id][deposit_id].get_state()
+        if deposit_id in self.deposits.get(account_id, {}):
+            deposit = self.deposits[account_id][deposit_id]
+            self._settle(deposit)
+            return deposit.get_state()
         else:
             raise ValueError("Deposit not found")
 
-    def _complete_deposit(account_id: str, deposit_id: str) -> None:
+    def deposit_status_many(self, deposit_ids: List[str]) -> Dict[str, DepositState]:
+        statuses = {}
+        for deposit_id in deposit_ids:
+            deposit = self._deposits_by_id.get(deposit_id)
+            if deposit is not None:
+                self._settle(deposit)
+                statuses[deposit_id] = deposit.get_state()
+        return statuses
+
+    def _settle(self, deposit: Deposit):
+        settles_at = self._settles_at.get(deposit.get_deposit_id())
+        if (
+            settles_at is not None
+            and deposit.get_state() == DepositState.CREATED
+            and time.monotonic() >= settles_at
+        ):
+            deposit.complete()
+
+    def write_statement(self, file: IO[str], format: str = "csv"):
+        write_statement(
+            file,
+            (
+                StatementEntry(
+                    deposit_id,
+                    deposit.get_account_id(),
+                    deposit.amount.amount,
+                    str(deposit.amount.currency),
+                    deposit.get_state().value,
+                )
+                for deposit_id, deposit in sorted(self._deposits_by_id.items())
+                if deposit.get_state() != DepositState.FAILED
+            ),
+            format,
+        )
+
+    def _complete_deposit(self, account_id: str, deposit_id: str) -> None:
         """
         Helper for testing"""
         self.deposits[account_id][deposit_id].complete()
 
-    def _fail_deposit(account_id: str, deposit_id: str) -> None:
+    def _fail_deposit(self, account_id: str, deposit_id: str) -> None:
         """
         Helper for testing"""
         self.deposits[account_id][deposit_id].fail()
+
+
+class HttpFundAccountsService(AbstractFundAccountsService):
+    """
+    A provider reached over HTTP at `base_url`, through the process's pooled
+    keep-alive client unless given one. Status lookups for many deposits are
+    made PROVIDER_STATUS_BATCH_SIZE at a time. Failures are raised as
+    TransientProviderError or TerminalProviderError.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        client: httpx.Client | None = None,
+        status_batch_size: int = PROVIDER_STATUS_BATCH_SIZE,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.client = client
+        self.status_batch_size = status_batch_size
+
+    def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        client = self.client or provider_client()
+        with transport_errors():
+            response = client.request(method, self.base_url + path, **kwargs)
+        return check_response(response)
+
+    def _account_path(self, account_id: str) -> str:
+        return f"/fund-accounts/{quote(account_id, safe='')}"
+
+    def deposit_funds(
+        self, account_id: str, amount: Money, idempotency_key: str | None = None
+    ) -> Deposit:
+        body = self._request(
+            "POST",
+            f"{self._account_path(account_id)}/deposits",
+            json={"amount": str(amount.amount), "currency": amount.currency.code},
+            headers=idempotency_headers(idempotency_key),
+        ).json()
+        return _deposit_from_json(body)
+
+    def deposit_status(self, deposit_id: str, account_id: str) -> DepositState:
+        body = self._request(
+            "GET",
+            f"{self._account_path(account_id)}/deposits/{quote(deposit_id, safe='')}",
+        ).json()
+        return DepositState(body["state"])
+
+    def deposit_status_many(self, deposit_ids: List[str]) -> Dict[str, DepositState]:
+        statuses = {}
+        for start in range(0, len(deposit_ids), self.status_batch_size):
+            ids = deposit_ids[start : start + self.status_batch_size]
+            body = self._request("GET", "/deposits", params={"ids": ids}).json()
+            for deposit in body["deposits"]:
+                statuses[deposit["id"]] = DepositState(deposit["state"])
+        return statuses
+
+    def write_statement(self, file: IO[str], format: str = "csv"):
+        client = self.client or provider_client()
+        with transport_errors(), client.stream(
+            "GET", f"{self.base_url}/deposits/statement", params={"format": format}
+        ) as response:
+            check_response(response)
+            for text in response.iter_text():
+                file.write(text)
+
+
+def _deposit_from_json(body: dict) -> Deposit:
+    deposit = Deposit(
+        body["id"],
+        body["account_id"],
+        Money(Decimal(body["amount"]), body["currency"]),
+    )
+    # The provider's state as reported, not a transition made here
+    deposit.state = DepositState(body["state"])
+    return deposit
@@ -0,0 +1,156 @@
+"""
+The HTTP client shared by the provider adapters.
+
+Each process has one httpx.Client, which keeps a pool of keep-alive
+connections to every provider host, so a call reuses an open connection
+instead of paying for a new TCP and TLS handshake. The client is created on
+first use, and again in a forked child such as a Celery prefork worker, since
+pooled sockets can't be shared between processes. Configured from the
+environment:
+
+PROVIDER_HTTP_TIMEOUT: seconds to wait for a response, or for a pooled
+    connection to come free.
+PROVIDER_HTTP_CONNECT_TIMEOUT: seconds to wait for a new connection.
+PROVIDER_HTTP_MAX_CONNECTIONS, PROVIDER_HTTP_MAX_KEEPALIVE: pool sizing.
+PROVIDER_HTTP_KEEPALIVE_EXPIRY: seconds an idle connection is kept open.
+PROVIDER_HTTP2: use HTTP/2, which needs the http2 extra (httpx[http2]).
+PROVIDER_STATUS_BATCH_SIZE: transfers looked up per batch status request.
+"""
+
+import email.utils
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator
+
+import httpx
+
+from money_movement.services.errors import (
+    ProviderThrottled,
+    TerminalProviderError,
+    TransientProviderError,
+)
+
+PROVIDER_HTTP_TIMEOUT = float(os.environ.get("PROVIDER_HTTP_TIMEOUT", 10))
+PROVIDER_HTTP_CONNECT_TIMEOUT = float(
+    os.environ.get("PROVIDER_HTTP_CONNECT_TIMEOUT", 3)
+)
+PROVIDER_HTTP_MAX_CONNECTIONS = int(
+    os.environ.get("PROVIDER_HTTP_MAX_CONNECTIONS", 100)
+)
+PROVIDER_HTTP_MAX_KEEPALIVE = int(os.environ.get("PROVIDER_HTTP_MAX_KEEPALIVE", 20))
+PROVIDER_HTTP_KEEPALIVE_EXPIRY = float(
+    os.environ.get("PROVIDER_HTTP_KEEPALIVE_EXPIRY", 30)
+)
+PROVIDER_HTTP2 = os.environ.get("PROVIDER_HTTP2", "").strip().lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
+PROVIDER_STATUS_BATCH_SIZE = int(os.environ.get("PROVIDER_STATUS_BATCH_SIZE", 100))
+
+_client: httpx.Client | None = None
+_client_lock = threading.Lock()
+
+
+def create_provider_client() -> httpx.Client:
+    return httpx.Client(
+        timeout=httpx.Timeout(
+            PROVIDER_HTTP_TIMEOUT, connect=PROVIDER_HTTP_CONNECT_TIMEOUT
+        ),
+        limits=httpx.Limits(
+            max_connections=PROVIDER_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=PROVIDER_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=PROVIDER_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        http2=PROVIDER_HTTP2,
+    )
+
+
+def provider_client() -> httpx.Client:
+    """
+    This process's shared client, created on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_provider_client()
+    return _client
+
+
+def close_provider_client():
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
+
+def _forget_client():
+    # The parent's pooled sockets belong to the parent; start a new pool
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_client)
+
+
+def retry_after(response: httpx.Response) -> float | None:
+    """
+    The Retry-After header in seconds, given as seconds or as an HTTP date.
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.now(when.tzinfo)).total_seconds(), 0.0)
+
+
+def idempotency_headers(idempotency_key: str | None) -> Dict[str, str]:
+    return {} if idempotency_key is None else {"Idempotency-Key": idempotency_key}
+
+
+# Error statuses worth retrying: timeouts, throttling and server errors
+TRANSIENT_STATUS_CODES = frozenset({408, 425, 429})
+
+
+def check_response(response: httpx.Response) -> httpx.Response:
+    """
+    Raise ProviderThrottled for a 429, TransientProviderError for other
+    statuses worth retrying and TerminalProviderError for any other error.
+    """
+    if response.is_success:
+        return response
+    message = (
+        f"{response.request.method} {response.request.url} "
+        f"returned {response.status_code}"
+    )
+    if response.status_code == 429:
+        raise ProviderThrottled(message, retry_after=retry_after(response))
+    if response.status_code in TRANSIENT_STATUS_CODES or response.is_server_error:
+        raise TransientProviderError(message, retry_after=retry_after(response))
+    raise TerminalProviderError(message)
+
+
+@contextmanager
+def transport_errors() -> Iterator[None]:
+    """
+    Raise connection failures and timeouts as TransientProviderError. Requests
+    that move money carry an idempotency key, so retrying one that may have
+    reached the provider is safe.
+    """
+    try:
+        yield
+    except httpx.TransportError as e:
+        raise TransientProviderError(f"{type(e).__name__}: {e}") from e
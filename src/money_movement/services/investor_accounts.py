@@ -1,6 +1,19 @@
+import time
+from decimal import Decimal
 from enum import Enum
-from typing import Dict, List, Tuple
+from typing import IO, Dict, List, Tuple
+from urllib.parse import quote
+
+import httpx
 from moneyed import Money
+from money_movement.services.http import (
+    PROVIDER_STATUS_BATCH_SIZE,
+    check_response,
+    idempotency_headers,
+    provider_client,
+    transport_errors,
+)
+from money_movement.services.statements import StatementEntry, write_statement
 from money_movement.util import generate_random_id
 from money_movement.state_machine import GenericStateMachine
 
@@ -59,20 +72,51 @@ class AbstractInvestorAccountsService:
     def check_balance(self, account_id: str) -> Money:
         pass
 
-    def withdraw_funds(self, account_id: str, amount: Money) -> Withdrawal:
+    def withdraw_funds(
+        self, account_id: str, amount: Money, idempotency_key: str | None = None
+    ) -> Withdrawal:
+        """
+        Repeating a withdrawal with the same idempotency key returns the first
+        withdrawal instead of making another.
+        """
         pass
 
-    def withdrawal_status(self, withdrawal_id: str) -> WithdrawalState:
+    def withdrawal_status(self, withdrawal_id: str, account_id: str) -> WithdrawalState:
+        pass
+
+    def withdrawal_status_many(
+        self, withdrawal_ids: List[str]
+    ) -> Dict[str, WithdrawalState]:
+        """
+        Look up many withdrawals in one provider call.
+        Unknown withdrawal ids are left out of the result.
+        """
+        pass
+
+    def write_statement(self, file: IO[str], format: str = "csv"):
+        """
+        Write a statement of every withdrawal that didn't fail, sorted by
+        withdrawal id.
+        """
         pass
 
 
 class MockInvestorAccountsService:
-    def __init__(self, accounts: Dict[str, int] = {}):
+    def __init__(
+        self, accounts: Dict[str, int] = {}, settlement_delay: float | None = None
+    ):
+        """
+        settlement_delay: seconds after which in-progress withdrawals report as
+        completed. When None they stay in progress until _complete_withdrawal.
+        """
         self.accounts = {}
         self.default_currency = "USD"
         for account_id, balance in accounts.items():
             self.accounts[account_id] = Money(balance, self.default_currency)
+        self.settlement_delay = settlement_delay
         self._transactions = {}
+        self._settles_at: Dict[str, float] = {}
+        self._idempotency_keys: Dict[str, str] = {}
 
     def check_balance(self, account_id: str) -> Money:
         if account_id in self.accounts:
@@ -80,12 +124,20 @@ class MockInvestorAccountsService:
         else:
             raise ValueError("Account not found")
 
-    def withdraw_funds(self, account_id: str, amount: Money) -> Withdrawal:
+    def withdraw_funds(
+        self, account_id: str, amount: Money, idempotency_key: str | None = None
+    ) -> Withdrawal:
+        if idempotency_key in self._idempotency_keys:
+            return self._transactions[self._idempotency_keys[idempotency_key]]
         self.accounts[account_id] -= amount
         withdrawal_id = generate_random_id()
         withdrawal = Withdrawal(withdrawal_id, account_id, amount)
+        if idempotency_key is not None:
+            self._idempotency_keys[idempotency_key] = withdrawal_id
         withdrawal.transition(WithdrawalState.IN_PROGRESS)
         self._transactions[withdrawal_id] = withdrawal
+        if self.settlement_delay is not None:
+            self._settles_at[withdrawal_id] = time.monotonic() + self.settlement_delay
         return withdrawal
 
     def withdrawal_status(self, withdrawal_id: str, account_id: str) -> WithdrawalState:
@@ -94,10 +146,130 @@ class MockInvestorAccountsService:
         withdrawal = self._transactions[withdrawal_id]
         if withdrawal.get_account_id() != account_id:
             raise ValueError("Withdrawal does not match account")
+        self._settle(withdrawal)
         return withdrawal.get_state()
 
+    def withdrawal_status_many(
+        self, withdrawal_ids: List[str]
+    ) -> Dict[str, WithdrawalState]:
+        statuses = {}
+        for withdrawal_id in withdrawal_ids:
+            withdrawal = self._transactions.get(withdrawal_id)
+            if withdrawal is not None:
+                self._settle(withdrawal)
+                statuses[withdrawal_id] = withdrawal.get_state()
+        return statuses
+
+    def _settle(self, withdrawal: Withdrawal):
+        settles_at = self._settles_at.get(withdrawal.get_withdrawal_id())
+        if (
+            settles_at is not None
+            and withdrawal.get_state() == WithdrawalState.IN_PROGRESS
+            and time.monotonic() >= settles_at
+        ):
+            withdrawal.transition(WithdrawalState.COMPLETED)
+
+    def write_statement(self, file: IO[str], format: str = "csv"):
+        write_statement(
+            file,
+            (
+                StatementEntry(
+                    withdrawal_id,
+                    withdrawal.get_account_id(),
+                    withdrawal.get_amount().amount,
+                    str(withdrawal.get_amount().currency),
+                    withdrawal.get_state().value,
+                )
+                for withdrawal_id, withdrawal in sorted(self._transactions.items())
+                if withdrawal.get_state() != WithdrawalState.FAILED
+            ),
+            format,
+        )
+
     def _complete_withdrawal(self, withdrawal_id: str):
         self._transactions[withdrawal_id].transition(WithdrawalState.COMPLETED)
 
     def _fail_withdrawal(self, withdrawal_id: str):
         self._transactions[withdrawal_id].transition(WithdrawalState.FAILED)
+
+
+class HttpInvestorAccountsService(AbstractInvestorAccountsService):
+    """
+    A provider reached over HTTP at `base_url`, through the process's pooled
+    keep-alive client unless given one. Status lookups for many withdrawals
+    are made PROVIDER_STATUS_BATCH_SIZE at a time. Failures are raised as
+    TransientProviderError or TerminalProviderError.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        client: httpx.Client | None = None,
+        status_batch_size: int = PROVIDER_STATUS_BATCH_SIZE,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.client = client
+        self.status_batch_size = status_batch_size
+
+    def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        client = self.client or provider_client()
+        with transport_errors():
+            response = client.request(method, self.base_url + path, **kwargs)
+        return check_response(response)
+
+    def _account_path(self, account_id: str) -> str:
+        return f"/investor-accounts/{quote(account_id, safe='')}"
+
+    def check_balance(self, account_id: str) -> Money:
+        body = self._request("GET", f"{self._account_path(account_id)}/balance").json()
+        return Money(Decimal(body["amount"]), body["currency"])
+
+    def withdraw_funds(
+        self, account_id: str, amount: Money, idempotency_key: str | None = None
+    ) -> Withdrawal:
+        body = self._request(
+            "POST",
+            f"{self._account_path(account_id)}/withdrawals",
+            json={"amount": str(amount.amount), "currency": amount.currency.code},
+            headers=idempotency_headers(idempotency_key),
+        ).json()
+        return _withdrawal_from_json(body)
+
+    def withdrawal_status(self, withdrawal_id: str, account_id: str) -> WithdrawalState:
+        body = self._request(
+            "GET",
+            f"{self._account_path(account_id)}/withdrawals/"
+            f"{quote(withdrawal_id, safe='')}",
+        ).json()
+        return WithdrawalState(body["state"])
+
+    def withdrawal_status_many(
+        self, withdrawal_ids: List[str]
+    ) -> Dict[str, WithdrawalState]:
+        statuses = {}
+        for start in range(0, len(withdrawal_ids), self.status_batch_size):
+            ids = withdrawal_ids[start : start + self.status_batch_size]
+            body = self._request("GET", "/withdrawals", params={"ids": ids}).json()
+            for withdrawal in body["withdrawals"]:
+                statuses[withdrawal["id"]] = WithdrawalState(withdrawal["state"])
+        return statuses
+
+    def write_statement(self, file: IO[str], format: str = "csv"):
+        client = self.client or provider_client()
+        with transport_errors(), client.stream(
+            "GET", f"{self.base_url}/withdrawals/statement", params={"format": format}
+        ) as response:
+            check_response(response)
+            for text in response.iter_text():
+                file.write(text)
+
+
+def _withdrawal_from_json(body: dict) -> Withdrawal:
+    withdrawal = Withdrawal(
+        body["id"],
+        body["account_id"],
+        Money(Decimal(body["amount"]), body["currency"]),
+    )
+    # The provider's state as reported, not a transition made here
+    withdrawal.state = WithdrawalState(body["state"])
+    return withdrawal
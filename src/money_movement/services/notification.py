@@ -1,24 +1,61 @@
+import json
+import urllib.request
 from abc import ABC, abstractmethod
 from logging import Logger, getLogger
-from money_movement.models import FundingTransaction
+from money_movement.amounts import to_decimal
+from money_movement.models import NotificationOutbox
 
 logger: Logger = getLogger(__name__)
 
 
 class AbstractNotificationService(ABC):
+    """
+    A notification sink. Called by the outbox dispatcher, possibly from
+    several threads at once; raising marks the notification for a retry.
+    """
+
     @abstractmethod
-    def funds_transfered(self, funding_transaction: FundingTransaction):
+    def funds_transfered(self, notification: NotificationOutbox):
         pass
 
 
 class LoggingNotificationService(AbstractNotificationService):
-
     def __init__(self):
         pass
 
-    def funds_transfered(self, funding_transaction: FundingTransaction):
-        logger.log(
-            f"Funds transfered: {funding_transaction.amount_money()} from"
-            f"{funding_transaction.investor_account.external_account_uid} to"
-            f"{funding_transaction.fund_account.external_account_uid}"
+    def funds_transfered(self, notification: NotificationOutbox):
+        logger.info(
+            f"Funds transfered: {notification.amount_money()} from "
+            f"{notification.investor_account_uid} to "
+            f"{notification.fund_account_uid}"
+        )
+
+
+class WebhookNotificationService(AbstractNotificationService):
+    """
+    POSTs each notification as JSON to a URL. Any non-2xx response or
+    connection error raises, so the dispatcher retries it later.
+    """
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def funds_transfered(self, notification: NotificationOutbox):
+        body = {
+            "event": "funds_transferred",
+            "notification_id": notification.id,
+            "funding_transaction_id": notification.funding_transaction_id,
+            "amount": str(to_decimal(notification.amount_minor, notification.currency)),
+            "currency": notification.currency,
+            "investor_account": notification.investor_account_uid,
+            "fund_account": notification.fund_account_uid,
+        }
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
         )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
@@ -0,0 +1,267 @@
+"""
+A local stand-in for the investor and fund account providers, serving the
+HTTP API the HTTP adapters call from the in-memory mocks.
+
+Every response is held back by `latency` seconds, so connection reuse and
+throughput can be measured offline much as against a remote provider, and
+with `rate_limit` set, requests over that many a second get a 429 with a
+Retry-After. Withdrawals and deposits honour an Idempotency-Key header.
+The server counts the requests it answers and the distinct
+client connections they came in on. Run with
+
+    python -m money_movement.services.standin --port 8081 --latency 0.05
+
+or in a background thread with `serve(create_standin_app(...))`.
+"""
+
+import argparse
+import asyncio
+import io
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Iterator, List
+
+import uvicorn
+from fastapi import FastAPI, Header, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from moneyed import Money
+from pydantic import BaseModel
+
+from money_movement.services.fund_accounts import Deposit, MockFundAccountsService
+from money_movement.services.investor_accounts import (
+    MockInvestorAccountsService,
+    Withdrawal,
+)
+
+
+class TransferRequest(BaseModel):
+    amount: Decimal
+    currency: str
+
+
+def _transfer_json(id: str, account_id: str, amount: Money, state) -> dict:
+    return {
+        "id": id,
+        "account_id": account_id,
+        "amount": str(amount.amount),
+        "currency": amount.currency.code,
+        "state": state.value,
+    }
+
+
+def _withdrawal_json(withdrawal: Withdrawal) -> dict:
+    return _transfer_json(
+        withdrawal.get_withdrawal_id(),
+        withdrawal.get_account_id(),
+        withdrawal.get_amount(),
+        withdrawal.get_state(),
+    )
+
+
+def _deposit_json(deposit: Deposit) -> dict:
+    return _transfer_json(
+        deposit.get_deposit_id(),
+        deposit.get_account_id(),
+        deposit.amount,
+        deposit.get_state(),
+    )
+
+
+def create_standin_app(
+    investor_service: MockInvestorAccountsService | None = None,
+    fund_service: MockFundAccountsService | None = None,
+    latency: float = 0.0,
+    rate_limit: float | None = None,
+    opening_balance: int | None = None,
+) -> FastAPI:
+    """
+    opening_balance: investor accounts the mock doesn't know are opened with
+    this balance on first use, instead of being not found.
+    """
+    investor_service = investor_service or MockInvestorAccountsService()
+    fund_service = fund_service or MockFundAccountsService()
+    app = FastAPI()
+    app.state.stats = Counter()
+    app.state.connections = set()
+    bucket = {"tokens": rate_limit or 0, "refilled_at": time.monotonic()}
+
+    def throttled() -> float | None:
+        # Seconds until the next request is allowed, if this one isn't
+        now = time.monotonic()
+        bucket["tokens"] = min(
+            rate_limit, bucket["tokens"] + (now - bucket["refilled_at"]) * rate_limit
+        )
+        bucket["refilled_at"] = now
+        if bucket["tokens"] >= 1:
+            bucket["tokens"] -= 1
+            return None
+        return (1 - bucket["tokens"]) / rate_limit
+
+    @app.middleware("http")
+    async def simulate_provider(request: Request, call_next):
+        app.state.connections.add(request.scope.get("client"))
+        app.state.stats["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        if rate_limit:
+            wait = throttled()
+            if wait is not None:
+                app.state.stats["throttled"] += 1
+                return JSONResponse(
+                    {"detail": "Too many requests"},
+                    status_code=429,
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+        return await call_next(request)
+
+    @app.exception_handler(KeyError)
+    @app.exception_handler(ValueError)
+    async def not_found(request: Request, e: Exception):
+        return JSONResponse({"detail": str(e)}, status_code=404)
+
+    def investor_account(account_id: str) -> str:
+        if account_id not in investor_service.accounts:
+            if opening_balance is None:
+                raise ValueError("Account not found")
+            investor_service.accounts[account_id] = Money(
+                opening_balance, investor_service.default_currency
+            )
+        return account_id
+
+    @app.get("/investor-accounts/{account_id}/balance")
+    async def check_balance(account_id: str):
+        balance = investor_service.check_balance(investor_account(account_id))
+        return {"amount": str(balance.amount), "currency": balance.currency.code}
+
+    @app.post("/investor-accounts/{account_id}/withdrawals")
+    async def withdraw_funds(
+        account_id: str,
+        request: TransferRequest,
+        idempotency_key: str | None = Header(None),
+    ):
+        withdrawal = investor_service.withdraw_funds(
+            investor_account(account_id),
+            Money(request.amount, request.currency),
+            idempotency_key=idempotency_key,
+        )
+        return _withdrawal_json(withdrawal)
+
+    @app.get("/investor-accounts/{account_id}/withdrawals/{withdrawal_id}")
+    async def withdrawal_status(account_id: str, withdrawal_id: str):
+        investor_service.withdrawal_status(withdrawal_id, account_id)
+        return _withdrawal_json(investor_service._transactions[withdrawal_id])
+
+    @app.get("/withdrawals/statement")
+    async def withdrawal_statement(format: str = "csv"):
+        statement = io.StringIO()
+        investor_service.write_statement(statement, format)
+        return PlainTextResponse(statement.getvalue())
+
+    @app.get("/withdrawals")
+    async def withdrawal_status_many(ids: List[str] = Query([])):
+        statuses = investor_service.withdrawal_status_many(ids)
+        return {
+            "withdrawals": [
+                _withdrawal_json(investor_service._transactions[id]) for id in statuses
+            ]
+        }
+
+    @app.post("/fund-accounts/{account_id}/deposits")
+    async def deposit_funds(
+        account_id: str,
+        request: TransferRequest,
+        idempotency_key: str | None = Header(None),
+    ):
+        deposit = fund_service.deposit_funds(
+            account_id,
+            Money(request.amount, request.currency),
+            idempotency_key=idempotency_key,
+        )
+        return _deposit_json(deposit)
+
+    @app.get("/fund-accounts/{account_id}/deposits/{deposit_id}")
+    async def deposit_status(account_id: str, deposit_id: str):
+        fund_service.deposit_status(account_id=account_id, deposit_id=deposit_id)
+        return _deposit_json(fund_service.deposits[account_id][deposit_id])
+
+    @app.get("/deposits/statement")
+    async def deposit_statement(format: str = "csv"):
+        statement = io.StringIO()
+        fund_service.write_statement(statement, format)
+        return PlainTextResponse(statement.getvalue())
+
+    @app.get("/deposits")
+    async def deposit_status_many(ids: List[str] = Query([])):
+        statuses = fund_service.deposit_status_many(ids)
+        return {
+            "deposits": [
+                _deposit_json(fund_service._deposits_by_id[id]) for id in statuses
+            ]
+        }
+
+    return app
+
+
+@contextmanager
+def serve(app: FastAPI, host: str = "127.0.0.1", port: int = 0) -> Iterator[str]:
+    """
+    Run `app` in a background thread for the duration of the block, yielding
+    its base URL. Port 0 picks a free port.
+    """
+    server = uvicorn.Server(
+        uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="off")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            if not thread.is_alive():
+                raise RuntimeError("Stand-in provider failed to start")
+            time.sleep(0.01)
+        port = server.servers[0].sockets[0].getsockname()[1]
+        yield f"http://{host}:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description="Run a stand-in provider server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every response"
+    )
+    parser.add_argument(
+        "--settlement-delay",
+        type=float,
+        default=10.0,
+        help="Seconds before transfers report as completed",
+    )
+    parser.add_argument(
+        "--rate-limit", type=float, help="Requests a second before answering 429"
+    )
+    parser.add_argument(
+        "--opening-balance",
+        type=int,
+        default=1_000_000,
+        help="Balance of investor accounts opened on first use",
+    )
+    args = parser.parse_args(argv)
+
+    app = create_standin_app(
+        MockInvestorAccountsService(settlement_delay=args.settlement_delay),
+        MockFundAccountsService(settlement_delay=args.settlement_delay),
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        opening_balance=args.opening_balance,
+    )
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Provider statement files: one line per transfer the provider made, sorted by
+the provider's transfer id, as CSV with a header row or as NDJSON.
+"""
+
+import csv
+import json
+from decimal import Decimal
+from typing import IO, Iterable, Iterator, NamedTuple
+
+STATEMENT_FIELDS = ["transaction_id", "account_id", "amount", "currency", "status"]
+# The status of a transfer the provider didn't make
+FAILED_STATUS = "FAILED"
+
+
+class StatementEntry(NamedTuple):
+    transaction_id: str
+    account_id: str
+    amount: Decimal
+    currency: str
+    status: str
+
+
+def statement_format(path: str) -> str:
+    """
+    "ndjson" for .ndjson/.jsonl files, otherwise "csv".
+    """
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+def write_statement(file: IO[str], entries: Iterable[StatementEntry], format="csv"):
+    if format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(STATEMENT_FIELDS)
+        writer.writerows(entries)
+    elif format == "ndjson":
+        for entry in entries:
+            line = entry._asdict()
+            line["amount"] = str(entry.amount)
+            file.write(json.dumps(line) + "\n")
+    else:
+        raise ValueError(f"Unknown statement format {format!r}")
+
+
+def read_statement(file: IO[str], format="csv") -> Iterator[StatementEntry]:
+    """
+    Stream the entries of a statement one line at a time.
+    """
+    if format == "csv":
+        rows = csv.DictReader(file)
+    elif format == "ndjson":
+        rows = (json.loads(line) for line in file if line.strip())
+    else:
+        raise ValueError(f"Unknown statement format {format!r}")
+    for row in rows:
+        yield StatementEntry(
+            transaction_id=row["transaction_id"],
+            account_id=row["account_id"],
+            amount=Decimal(row["amount"]),
+            currency=row["currency"],
+            status=row["status"],
+        )
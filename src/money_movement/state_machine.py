@@ -1,14 +1,96 @@
-from typing import Dict, List, TypeVar, Generic
+from logging import Logger, getLogger
+from typing import Callable, Dict, FrozenSet, Iterator, List, Tuple, TypeVar, Generic
 from enum import Enum
 
+logger: Logger = getLogger(__name__)
+
 # Define a type variable that must be an instance of Enum
 T = TypeVar("T", bound=Enum)
 
+# Called as hook(machine, from_state, to_state)
+TransitionHook = Callable[["GenericStateMachine", Enum, Enum], None]
+
 
 class GenericStateMachine(Generic[T]):
+    """
+    Subclasses declare `transitions` as {state: [next states]}, listing the
+    initial state first. When the class is created the graph is validated and
+    compiled into lookup tables, so checks at runtime are a single set lookup.
+    """
 
     transitions: Dict[T, List[T]] = {}
 
+    # Compiled from `transitions` by __init_subclass__
+    states: FrozenSet[T] = frozenset()
+    terminal_states: FrozenSet[T] = frozenset()
+    reachable_states: Dict[T, FrozenSet[T]] = {}
+    _successors: Dict[T, FrozenSet[T]] = {}
+
+    pre_transition_hooks: Tuple[TransitionHook, ...] = ()
+    post_transition_hooks: Tuple[TransitionHook, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "transitions" in cls.__dict__:
+            cls._compile_transitions()
+
+    @classmethod
+    def _compile_transitions(cls):
+        if not cls.transitions:
+            raise ValueError(f"{cls.__name__} declares no transitions")
+        initial_state = next(iter(cls.transitions))
+        enum_type = type(initial_state)
+
+        missing = set(enum_type) - set(cls.transitions)
+        if missing:
+            raise ValueError(
+                f"{cls.__name__} has no transitions for {sorted(s.name for s in missing)}"
+            )
+        for source, targets in cls.transitions.items():
+            for state in [source, *targets]:
+                if not isinstance(state, enum_type):
+                    raise ValueError(
+                        f"{cls.__name__} has unknown state {state!r} "
+                        f"in transitions from {source!r}"
+                    )
+
+        cls._successors = {
+            source: frozenset(targets) for source, targets in cls.transitions.items()
+        }
+        cls.states = frozenset(cls._successors)
+        cls.terminal_states = frozenset(
+            state for state, targets in cls._successors.items() if not targets
+        )
+        cls.reachable_states = {
+            state: frozenset(_walk(cls._successors, state)) for state in cls.states
+        }
+
+        unreachable = cls.states - cls.reachable_states[initial_state] - {initial_state}
+        if unreachable:
+            raise ValueError(
+                f"{cls.__name__} states {sorted(s.name for s in unreachable)} "
+                f"are unreachable from {initial_state.name}"
+            )
+
+    @classmethod
+    def add_pre_transition_hook(cls, hook: TransitionHook):
+        """
+        Run `hook` before every transition of this class and its subclasses.
+        Raising from the hook prevents the transition.
+        """
+        for klass in _with_subclasses(cls):
+            if klass is cls or "pre_transition_hooks" in klass.__dict__:
+                klass.pre_transition_hooks = klass.pre_transition_hooks + (hook,)
+
+    @classmethod
+    def add_post_transition_hook(cls, hook: TransitionHook):
+        """
+        Run `hook` after every transition of this class and its subclasses.
+        """
+        for klass in _with_subclasses(cls):
+            if klass is cls or "post_transition_hooks" in klass.__dict__:
+                klass.post_transition_hooks = klass.post_transition_hooks + (hook,)
+
     def __init__(self, initial_state: T | None = None):
         self.state = initial_state
 
@@ -19,16 +101,53 @@ class GenericStateMachine(Generic[T]):
             raise ValueError("Initial state already set")
 
     def can_transition(self, new_state: T) -> bool:
-        return new_state in self.transitions[self.state]
+        return new_state in self._successors.get(self.state, ())
 
-    def transition(self, new_state: T):
-        if self.can_transition(new_state):
-            print(f"Transitioning from {self.state.name} to {new_state.name}")
-            self.state = new_state
-        else:
+    def validate_transition(self, new_state: T):
+        if new_state not in self._successors.get(self.state, ()):
+            if new_state not in self.states:
+                raise ValueError(f"Unknown state {new_state!r}")
             raise ValueError(
                 f"Invalid transition from {self.state.name} to {new_state.name}"
             )
 
+    def transition(self, new_state: T):
+        previous_state = self.state
+        self.validate_transition(new_state)
+        for hook in self.pre_transition_hooks:
+            hook(self, previous_state, new_state)
+        self.state = new_state
+        for hook in self.post_transition_hooks:
+            hook(self, previous_state, new_state)
+
+    def is_terminal(self) -> bool:
+        return self.state in self.terminal_states
+
     def get_state(self) -> T:
         return self.state
+
+
+def log_transition(machine: GenericStateMachine, from_state: Enum, to_state: Enum):
+    """
+    Post-transition hook that logs each transition at debug level.
+    """
+    logger.debug(
+        f"{type(machine).__name__} transitioning from {from_state.name} to {to_state.name}"
+    )
+
+
+def _walk(successors: Dict[T, FrozenSet[T]], start: T) -> Iterator[T]:
+    seen = set()
+    stack = list(successors[start])
+    while stack:
+        state = stack.pop()
+        if state not in seen:
+            seen.add(state)
+            yield state
+            stack.extend(successors[state])
+
+
+def _with_subclasses(cls: type) -> Iterator[type]:
+    yield cls
+    for subclass in cls.__subclasses__():
+        yield from _with_subclasses(subclass)
@@ -0,0 +1,287 @@
+"""
+Per-fund, per-state totals of funding transactions.
+
+fund_state_summary holds the number and summed amount of a fund's transfers
+in each state (and currency), so "how much is in flight into this fund" reads
+a handful of rows instead of grouping all of funding_transaction. The table is
+maintained in the same database transaction as the changes it reflects: new
+transfers are counted when they are flushed, every recorded transition moves
+its transfer from one row to another, and the net changes are applied when the
+session commits as one upsert per row touched, in key order so concurrent
+commits can't deadlock.
+
+Transfers inserted in bulk, bypassing the unit of work, are counted by calling
+record_new_transfers. `rebuild_summary` recomputes the table from scratch and
+`check_summary` compares it against a recomputation. Run with
+`python -m money_movement.summary check` or `... rebuild`.
+"""
+
+import argparse
+import json
+import sys
+from collections import defaultdict
+from decimal import Decimal
+from logging import Logger, getLogger
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from sqlalchemy import Connection, delete, event, func, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+from money_movement import db
+from money_movement.amounts import to_decimal
+from money_movement.db import dialect_insert
+from money_movement.models import (
+    FundingTransaction,
+    FundStateSummary,
+    TransactionState,
+    session_transitions,
+)
+
+logger: Logger = getLogger(__name__)
+
+NEW_TRANSFERS_INFO_KEY = "money_movement.new_transfers"
+
+# States whose money has left the investor but not yet reached the fund
+IN_FLIGHT_STATES = (
+    TransactionState.INITIATED,
+    TransactionState.WITHDRAWAL_PENDING,
+    TransactionState.WITHDRAWAL_COMPLETED,
+    TransactionState.DEPOSIT_PENDING,
+)
+
+# Keeps each IN (...) list well under SQLite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+SummaryKey = Tuple[int, TransactionState, str]
+
+_SUMMARIZED_BY = {"fund_account_id", "currency", "amount_minor"}
+
+
+class SummaryMismatch(NamedTuple):
+    fund_account_id: int
+    state: TransactionState
+    currency: str
+    # (transfer_count, amount_minor) recomputed and as summarized
+    expected: Tuple[int, int]
+    actual: Tuple[int, int]
+
+
+def record_new_transfers(
+    session: Session, transfers: Iterable[Tuple[int, TransactionState]]
+):
+    """
+    Count (id, state) transfers inserted without the unit of work, such as
+    bulk inserts, when the session commits.
+    """
+    transfers = list(transfers)
+    if transfers:
+        session.info.setdefault(NEW_TRANSFERS_INFO_KEY, []).extend(transfers)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flushed_transfers(session, flush_context):
+    record_new_transfers(
+        session,
+        [
+            (obj.id, obj.state)
+            for obj in session.new
+            if isinstance(obj, FundingTransaction)
+        ],
+    )
+
+
+@event.listens_for(Session, "after_transaction_create")
+def _reset_new_transfers(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(NEW_TRANSFERS_INFO_KEY, None)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_new_transfers(session, previous_transaction):
+    session.info.pop(NEW_TRANSFERS_INFO_KEY, None)
+
+
+def _summary_deltas(session: Session) -> Dict[SummaryKey, List[int]]:
+    created = session.info.get(NEW_TRANSFERS_INFO_KEY, [])
+    moves = [r for r in session_transitions(session) if r.model is FundingTransaction]
+    if not created and not moves:
+        return {}
+
+    # Transfers loaded in the session are used as they are, only the others
+    # are looked up
+    transfers = {}
+    ids = {id for id, _ in created} | {r.id for r in moves}
+    for id in ids:
+        obj = session.identity_map.get(identity_key(FundingTransaction, id))
+        if obj is not None and _SUMMARIZED_BY.issubset(obj.__dict__):
+            transfers[id] = obj
+    ids = sorted(ids - transfers.keys())
+    for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+        rows = session.execute(
+            select(
+                FundingTransaction.id,
+                FundingTransaction.fund_account_id,
+                FundingTransaction.currency,
+                FundingTransaction.amount_minor,
+            ).where(FundingTransaction.id.in_(ids[start : start + LOOKUP_CHUNK_SIZE]))
+        )
+        transfers.update((row.id, row) for row in rows)
+
+    deltas: Dict[SummaryKey, List[int]] = defaultdict(lambda: [0, 0])
+
+    def move(id, state, sign):
+        transfer = transfers[id]
+        delta = deltas[(transfer.fund_account_id, state, transfer.currency)]
+        delta[0] += sign
+        delta[1] += sign * transfer.amount_minor
+
+    for id, state in created:
+        move(id, state, 1)
+    for record in moves:
+        move(record.id, record.previous_state, -1)
+        move(record.id, record.new_state, 1)
+    return {key: delta for key, delta in deltas.items() if delta != [0, 0]}
+
+
+def apply_summary_deltas(session: Session, deltas: Dict[SummaryKey, List[int]]):
+    if not deltas:
+        return
+    stmt = dialect_insert(session, FundStateSummary)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            FundStateSummary.fund_account_id,
+            FundStateSummary.state,
+            FundStateSummary.currency,
+        ],
+        set_={
+            "transfer_count": FundStateSummary.transfer_count
+            + stmt.excluded.transfer_count,
+            "amount_minor": FundStateSummary.amount_minor + stmt.excluded.amount_minor,
+        },
+    )
+    ordered = sorted(deltas.items(), key=lambda item: (item[0][0], item[0][1].name))
+    session.execute(
+        stmt,
+        [
+            {
+                "fund_account_id": fund_account_id,
+                "state": state,
+                "currency": currency,
+                "transfer_count": count,
+                "amount_minor": amount_minor,
+            }
+            for (fund_account_id, state, currency), (count, amount_minor) in ordered
+        ],
+    )
+
+
+@event.listens_for(Session, "before_commit")
+def _update_summary(session):
+    # Transfers added since the last flush are only counted once flushed
+    session.flush()
+    apply_summary_deltas(session, _summary_deltas(session))
+
+
+def _recomputed():
+    return select(
+        FundingTransaction.fund_account_id,
+        FundingTransaction.state,
+        FundingTransaction.currency,
+        func.count(),
+        func.sum(FundingTransaction.amount_minor),
+    ).group_by(
+        FundingTransaction.fund_account_id,
+        FundingTransaction.state,
+        FundingTransaction.currency,
+    )
+
+
+def rebuild_summary(session: Session | Connection):
+    """
+    Replace the summary with a recomputation from funding_transaction. Run it
+    while no transfers are moving, or their changes may be lost.
+    """
+    session.execute(delete(FundStateSummary))
+    session.execute(
+        insert(FundStateSummary).from_select(
+            ["fund_account_id", "state", "currency", "transfer_count", "amount_minor"],
+            _recomputed(),
+        )
+    )
+
+
+def check_summary(session: Session) -> List[SummaryMismatch]:
+    """
+    Every summary row that disagrees with a full recomputation, including
+    missing rows. Rows summarizing no transfers count as missing.
+    """
+    expected = {
+        tuple(row[:3]): tuple(row[3:]) for row in session.execute(_recomputed())
+    }
+    actual = {
+        (row.fund_account_id, row.state, row.currency): (
+            row.transfer_count,
+            row.amount_minor,
+        )
+        for row in session.scalars(select(FundStateSummary))
+        if row.transfer_count or row.amount_minor
+    }
+    return [
+        SummaryMismatch(*key, expected.get(key, (0, 0)), actual.get(key, (0, 0)))
+        for key in sorted(
+            expected.keys() | actual.keys(), key=lambda k: (k[0], k[1].name)
+        )
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+def fund_summary_query(fund_account_id: int):
+    return (
+        select(FundStateSummary)
+        .where(
+            FundStateSummary.fund_account_id == fund_account_id,
+            FundStateSummary.transfer_count > 0,
+        )
+        .order_by(FundStateSummary.currency)
+    )
+
+
+def in_flight(rows: Iterable[FundStateSummary]) -> Dict[str, Decimal]:
+    """
+    Amount in flight into the fund per currency.
+    """
+    totals: Dict[str, int] = defaultdict(int)
+    for row in rows:
+        if row.state in IN_FLIGHT_STATES:
+            totals[row.currency] += row.amount_minor
+    return {currency: to_decimal(total, currency) for currency, total in totals.items()}
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain fund state summaries")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    args = parser.parse_args(argv)
+
+    with db.Session() as session:
+        if args.command == "rebuild":
+            rebuild_summary(session)
+            session.commit()
+            logger.info("Rebuilt fund state summaries")
+            return 0
+        mismatches = check_summary(session)
+    for mismatch in mismatches:
+        print(
+            json.dumps(
+                {
+                    **mismatch._asdict(),
+                    "state": mismatch.state.name,
+                }
+            )
+        )
+    print(f"{len(mismatches)} mismatched summary rows", file=sys.stderr)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
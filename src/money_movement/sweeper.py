@@ -0,0 +1,230 @@
+from datetime import datetime
+from functools import partial
+from logging import Logger, getLogger
+from typing import Callable, Iterator, List, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session, selectinload
+
+from money_movement.models import (
+    FundDepositTransaction,
+    FundingTransaction,
+    SingleTransferState,
+    TransactionState,
+    WithdrawalTransaction,
+)
+from money_movement.outbox import enqueue_funds_transferred
+from money_movement.services.fund_accounts import (
+    AbstractFundAccountsService,
+    DepositState,
+)
+from money_movement.services.investor_accounts import (
+    AbstractInvestorAccountsService,
+    WithdrawalState,
+)
+
+logger: Logger = getLogger(__name__)
+
+SWEEP_CHUNK_SIZE = 500
+
+
+def pending_transfers_query(model, after=None, limit=None):
+    """
+    One keyset page of provider withdrawals or deposits (`model`) still
+    pending, oldest first, with the funding transactions batched into each.
+    `after` is the (modified, id) of the last row of the previous page.
+    """
+    stmt = (
+        select(model)
+        .options(selectinload(model.funding_transactions))
+        .where(
+            model.state == SingleTransferState.TRANSFER_PENDING,
+            model.external_transaction_uid.is_not(None),
+        )
+        .order_by(model.modified, model.id)
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(model.modified, model.id) > tuple_(*after))
+    return stmt
+
+
+def funds_ready_for_deposit(session: Session) -> List[int]:
+    """
+    Ids of funds with completed withdrawals that are not in a deposit yet.
+    """
+    return session.scalars(
+        select(FundingTransaction.fund_account_id)
+        .where(FundingTransaction.state == TransactionState.WITHDRAWAL_COMPLETED)
+        .distinct()
+        .order_by(FundingTransaction.fund_account_id)
+    ).all()
+
+
+def stalled_withdrawal_batches(
+    session: Session, before: datetime
+) -> List[Tuple[int, int | None]]:
+    """
+    Withdrawal work left behind since `before` by a task that died or was
+    lost, as (investor account id, withdrawal id) pairs to hand back to
+    withdraw_investor_batch: batches still INITIATED with no provider
+    withdrawal, and claimed transactions never linked to a batch, for which
+    the withdrawal id is None.
+    """
+    batches = session.execute(
+        select(WithdrawalTransaction.investor_account_id, WithdrawalTransaction.id)
+        .where(
+            WithdrawalTransaction.state == SingleTransferState.INITIATED,
+            WithdrawalTransaction.external_transaction_uid.is_(None),
+            WithdrawalTransaction.modified < before,
+        )
+        .order_by(WithdrawalTransaction.id)
+    ).all()
+    unbatched = session.scalars(
+        select(FundingTransaction.investor_account_id)
+        .where(
+            FundingTransaction.state == TransactionState.WITHDRAWAL_PENDING,
+            FundingTransaction.withdrawal_transaction_id.is_(None),
+            FundingTransaction.modified < before,
+        )
+        .distinct()
+        .order_by(FundingTransaction.investor_account_id)
+    ).all()
+    return [(row.investor_account_id, row.id) for row in batches] + [
+        (investor_account_id, None) for investor_account_id in unbatched
+    ]
+
+
+def stalled_deposit_batches(
+    session: Session, before: datetime
+) -> List[Tuple[int, int]]:
+    """
+    Deposit batches still INITIATED with no provider deposit since `before`,
+    as (fund account id, deposit id) pairs to hand back to deposit_fund_batch.
+    """
+    rows = session.execute(
+        select(FundDepositTransaction.fund_account_id, FundDepositTransaction.id)
+        .where(
+            FundDepositTransaction.state == SingleTransferState.INITIATED,
+            FundDepositTransaction.external_transaction_uid.is_(None),
+            FundDepositTransaction.modified < before,
+        )
+        .order_by(FundDepositTransaction.id)
+    ).all()
+    return [(row.fund_account_id, row.id) for row in rows]
+
+
+def _keyset_chunks(
+    session: Session, page_query: Callable, chunk_size: int
+) -> Iterator[List]:
+    after = None
+    while True:
+        chunk = session.scalars(page_query(after, chunk_size)).all()
+        if not chunk:
+            return
+        after = (chunk[-1].modified, chunk[-1].id)
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+
+
+def settle(session: Session, transfer, state: SingleTransferState):
+    """
+    Move a provider withdrawal or deposit to `state`, if it can still go
+    there. A missing transfer is left alone.
+    """
+    if transfer is not None and transfer.can_transition(state):
+        transfer.transition_cas(session, state)
+
+
+def still_pending(
+    transactions: List[FundingTransaction], state: TransactionState
+) -> List[FundingTransaction]:
+    """
+    The funding transactions of a batch that are still in `state`.
+    """
+    return [t for t in transactions if t.state == state]
+
+
+def sweep_withdrawals(
+    session: Session,
+    investor_account_service: AbstractInvestorAccountsService,
+    chunk_size: int = SWEEP_CHUNK_SIZE,
+) -> List[int]:
+    """
+    Check every pending provider withdrawal in batches and move the funding
+    transactions batched into each one together, committing once per chunk.
+    Returns the ids of funding transactions whose withdrawal completed.
+    """
+    completed: List[int] = []
+    for chunk in _keyset_chunks(
+        session, partial(pending_transfers_query, WithdrawalTransaction), chunk_size
+    ):
+        statuses = investor_account_service.withdrawal_status_many(
+            [w.external_transaction_uid for w in chunk]
+        )
+        for withdrawal in chunk:
+            state = statuses.get(withdrawal.external_transaction_uid)
+            pending = still_pending(
+                withdrawal.funding_transactions, TransactionState.WITHDRAWAL_PENDING
+            )
+            if state == WithdrawalState.COMPLETED:
+                settle(session, withdrawal, SingleTransferState.TRANSFER_COMPLETED)
+                moved = FundingTransaction.transition_all_cas(
+                    session, pending, TransactionState.WITHDRAWAL_COMPLETED
+                )
+                completed.extend(t.id for t in moved)
+            elif state == WithdrawalState.FAILED:
+                settle(session, withdrawal, SingleTransferState.FAILED)
+                FundingTransaction.transition_all_cas(
+                    session, pending, TransactionState.FAILED
+                )
+            elif state is None:
+                logger.warning(
+                    f"Withdrawal {withdrawal.external_transaction_uid} not found"
+                )
+        session.commit()
+    return completed
+
+
+def sweep_deposits(
+    session: Session,
+    fund_account_service: AbstractFundAccountsService,
+    chunk_size: int = SWEEP_CHUNK_SIZE,
+) -> List[int]:
+    """
+    Check every pending provider deposit in batches and move the funding
+    transactions batched into each one together, committing once per chunk
+    with their notifications queued in the outbox. Returns the ids of funding
+    transactions whose deposit completed.
+    """
+    completed: List[int] = []
+    for chunk in _keyset_chunks(
+        session, partial(pending_transfers_query, FundDepositTransaction), chunk_size
+    ):
+        statuses = fund_account_service.deposit_status_many(
+            [d.external_transaction_uid for d in chunk]
+        )
+        chunk_completed: List[int] = []
+        for deposit in chunk:
+            state = statuses.get(deposit.external_transaction_uid)
+            pending = still_pending(
+                deposit.funding_transactions, TransactionState.DEPOSIT_PENDING
+            )
+            if state == DepositState.COMPLETED:
+                settle(session, deposit, SingleTransferState.TRANSFER_COMPLETED)
+                moved = FundingTransaction.transition_all_cas(
+                    session, pending, TransactionState.DEPOSIT_COMPLETED
+                )
+                chunk_completed.extend(t.id for t in moved)
+            elif state == DepositState.FAILED:
+                settle(session, deposit, SingleTransferState.FAILED)
+                FundingTransaction.transition_all_cas(
+                    session, pending, TransactionState.FAILED
+                )
+            elif state is None:
+                logger.warning(f"Deposit {deposit.external_transaction_uid} not found")
+        enqueue_funds_transferred(session, chunk_completed)
+        session.commit()
+        completed.extend(chunk_completed)
+    return completed
@@ -1,184 +1,747 @@
 # tasks.py
+import os
+from datetime import datetime, timedelta
+from functools import partial
 from logging import Logger, getLogger
-from celery import Celery
+from typing import List
+from celery import Celery, group
+from celery.signals import worker_init
+from sqlalchemy import select, update
+from money_movement.db import Session, init_db
 from money_movement.models import (
+    FundDepositTransaction,
     FundingTransaction,
+    SingleTransferState,
     TransactionState,
+    WithdrawalTransaction,
 )
 from money_movement.services.fund_accounts import (
     AbstractFundAccountsService,
+    DepositState,
+    HttpFundAccountsService,
     MockFundAccountsService,
 )
 from money_movement.services.investor_accounts import (
     AbstractInvestorAccountsService,
+    HttpInvestorAccountsService,
     MockInvestorAccountsService,
     WithdrawalState,
 )
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-from moneyed import Money
 
-from money_movement.services.notification import (
-    AbstractNotificationService,
-    LoggingNotificationService,
+from money_movement.holds import consume_hold, place_hold
+from money_movement.idempotency import purge_expired_keys
+from money_movement.outbox import (
+    dispatch_outbox,
+    enqueue_funds_transferred,
+    notification_sinks,
+)
+from money_movement.ratelimit import (
+    ProviderLimiter,
+    RateLimitedFundAccountsService,
+    RateLimitedInvestorAccountsService,
+)
+from money_movement.retries import (
+    is_transient,
+    retry_countdown,
+    retry_stats,
+    spend_retry,
+)
+from money_movement.seats import reserve_seat
+
+# Registers the listeners that keep fund summaries current as transfers move
+from money_movement import summary  # noqa: F401
+from money_movement.sweeper import (
+    funds_ready_for_deposit,
+    settle,
+    stalled_deposit_batches,
+    stalled_withdrawal_batches,
+    still_pending,
+    sweep_deposits,
+    sweep_withdrawals,
 )
 
 logger: Logger = getLogger(__name__)
 
 app = Celery("tasks", broker="pyamqp://guest@localhost//")
-# coreate a new sqlalchemy session
 
-engine = create_engine("sqlite:///money_movement.db")
-Session = sessionmaker(bind=engine)
+# Pending provider operations are re-checked on a schedule instead of blocking
+# a worker. The countdown doubles on every attempt up to the maximum.
+STATUS_POLL_COUNTDOWN = 10
+STATUS_POLL_MAX_COUNTDOWN = 15 * 60
+
+# All pending transactions are swept together on this interval.
+SWEEP_INTERVAL = STATUS_POLL_COUNTDOWN
+
+# Seconds between runs of the notification outbox dispatcher.
+NOTIFICATION_DISPATCH_INTERVAL = float(
+    os.environ.get("NOTIFICATION_DISPATCH_INTERVAL", 5)
+)
+
+# Seconds between purges of expired idempotency keys.
+IDEMPOTENCY_PURGE_INTERVAL = float(os.environ.get("IDEMPOTENCY_PURGE_INTERVAL", 3600))
+
+# Transfers an investor initiates within this many seconds of each other are
+# withdrawn from their account in one provider withdrawal.
+WITHDRAWAL_BATCH_WINDOW = float(os.environ.get("WITHDRAWAL_BATCH_WINDOW", 5))
+
+# Batches left without a provider call for this many seconds, by a worker that
+# died or a task that was lost, are started again by the sweep.
+STALLED_BATCH_AFTER = float(os.environ.get("STALLED_BATCH_AFTER", 15 * 60))
+
+# Providers are called over HTTP at INVESTOR_ACCOUNTS_URL and
+# FUND_ACCOUNTS_URL. Without them the mock providers are used, settling after
+# a delay to simulate real transfer latency. Calls to each provider are rate
+# limited across all workers.
+INVESTOR_ACCOUNTS_URL = os.environ.get("INVESTOR_ACCOUNTS_URL")
+FUND_ACCOUNTS_URL = os.environ.get("FUND_ACCOUNTS_URL")
 
 investor_account_service: AbstractInvestorAccountsService = (
-    MockInvestorAccountsService()
+    RateLimitedInvestorAccountsService(
+        HttpInvestorAccountsService(INVESTOR_ACCOUNTS_URL)
+        if INVESTOR_ACCOUNTS_URL
+        else MockInvestorAccountsService(settlement_delay=STATUS_POLL_COUNTDOWN),
+        ProviderLimiter("investor_accounts"),
+    )
 )
 
-fund_account_service: AbstractFundAccountsService = MockFundAccountsService()
+fund_account_service: AbstractFundAccountsService = RateLimitedFundAccountsService(
+    HttpFundAccountsService(FUND_ACCOUNTS_URL)
+    if FUND_ACCOUNTS_URL
+    else MockFundAccountsService(settlement_delay=STATUS_POLL_COUNTDOWN),
+    ProviderLimiter("fund_accounts"),
+)
 
-notification_service: AbstractNotificationService = LoggingNotificationService()
 
+@worker_init.connect
+def _init_db(**kwargs):
+    init_db()
+
+
+def poll_countdown(attempt: int) -> int:
+    """
+    Seconds to wait before re-checking a pending operation for the given attempt.
+    """
+    return min(STATUS_POLL_COUNTDOWN * 2**attempt, STATUS_POLL_MAX_COUNTDOWN)
+
+
+def _fail(
+    session,
+    transaction_id: int,
+    expected_state: TransactionState,
+    expected_version: int,
+):
+    """
+    Fail a transaction from the state and version the task found it in. If
+    it has moved on since, another worker owns it and it is left alone.
+    """
+    session.rollback()
+    if FundingTransaction.compare_and_set_state(
+        session,
+        transaction_id,
+        expected_state,
+        TransactionState.FAILED,
+        expected_version,
+    ):
+        session.commit()
 
-@app.task
-def process_withdrawal(transaction_id):
+
+def _retry_or_fail(task, session, error: Exception, criteria, fail, args=None):
+    """
+    The exception for `task` to raise after `error`. A transient error retries
+    the task after a backoff, with `args` if given, while the funding
+    transactions matching `criteria` have retry budget left. Otherwise `fail`
+    is called and the error is raised as it was.
+    """
+    if is_transient(error):
+        retries = spend_retry(session, criteria)
+        if retries is not None:
+            countdown = retry_countdown(retries - 1, error)
+            logger.warning(
+                f"{task.name} failed transiently, retrying in {countdown:.1f}s: "
+                f"{error!r}"
+            )
+            return task.retry(args=args, exc=error, countdown=countdown, throw=False)
+        logger.warning(f"{task.name} is out of retries: {error!r}")
+    else:
+        retry_stats["terminal"] += 1
+    fail()
+    return error
+
+
+@app.task(bind=True, max_retries=None)
+def process_withdrawal(self, transaction_id):
     session = Session()
     transaction: FundingTransaction = (
         session.query(FundingTransaction).filter_by(id=transaction_id).one()
     )
+    # Failures are only ever applied from what this delivery saw
+    found = (transaction.state, transaction.version)
     try:
+        if not transaction.state == TransactionState.INITIATED:
+            logger.info(f"Transaction {transaction_id} is not ready for withdrawal")
+            return
+
+        fund_account = transaction.fund_account
+        if (
+            fund_account.min_investment_minor is not None
+            and transaction.amount_minor < fund_account.min_investment_minor
+        ):
+            raise ValueError("Amount is below the fund's minimum investment")
+
+        def claim() -> bool:
+            return FundingTransaction.compare_and_set_state(
+                session,
+                transaction_id,
+                TransactionState.INITIATED,
+                TransactionState.WITHDRAWAL_PENDING,
+                found[1],
+            )
+
+        # Balance check against the local holds ledger, which only calls the
+        # provider when its cached balance is stale or the margin is thin. The
+        # transaction is claimed first so a duplicate delivery can't withdraw
+        # twice, or touch the holds and seats of the delivery that won.
+        held = place_hold(session, investor_account_service, transaction, claim)
+        if held is None:
+            logger.info(f"Withdrawal for {transaction_id} already claimed")
+            session.rollback()
+            return
+        if not held:
+            raise ValueError("Insufficient funds")
+
+        # Hold a seat in the fund before any money moves. A failed transaction
+        # gives its seat back when the failure is committed.
+        if not reserve_seat(session, fund_account, transaction.id):
+            raise ValueError("No seats available in fund")
+        investor_account_id = transaction.investor_account_id
+        session.commit()
+    except Exception as e:
+        raise _retry_or_fail(
+            self,
+            session,
+            e,
+            FundingTransaction.id == transaction_id,
+            lambda: _fail(session, transaction_id, *found),
+        )
+    finally:
+        session.close()
 
-        # Implement withdrawal logic here
-        # Simulate long-running task with sleep
-        import time
+    # Everything the investor claims within the window shares one withdrawal
+    withdraw_investor_batch.apply_async(
+        (investor_account_id,), countdown=WITHDRAWAL_BATCH_WINDOW
+    )
 
-        time.sleep(10)
 
-        # Balance check
-        logger.log(
-            f"Checking balance for {transaction.investor_account.external_account_uid}"
-        )
-        balance: Money = investor_account_service.check_balance(
-            transaction.investor_account.external_account_uid
-        )
-        if balance < transaction.amount_money():
-            transaction.transition(TransactionState.FAILED)
-            session.commit()
-            raise ValueError("Insufficient funds")
+def _fail_withdrawal_batch(
+    session, withdrawal: WithdrawalTransaction, transactions: List[FundingTransaction]
+):
+    session.rollback()
+    settle(session, withdrawal, SingleTransferState.FAILED)
+    FundingTransaction.transition_all_cas(
+        session,
+        [t for t in transactions if t.can_transition(TransactionState.FAILED)],
+        TransactionState.FAILED,
+    )
+    session.commit()
+
 
-        # Withdraw funds
-        withdrawal = investor_account_service.withdraw_funds(
-            account_id=transaction.investor_account.external_account_uid,
-            amount=transaction.amount_money(),
+def _leave_for_sweep(batch, batch_id):
+    # The provider has the money under the batch's idempotency key, so the
+    # batch is never failed; the sweep resumes it and records the transfer
+    logger.error(
+        f"{batch} {batch_id} was accepted by the provider but not recorded, "
+        "leaving it for the sweep"
+    )
+
+
+def _link_withdrawal_batch(session, investor_account_id):
+    transactions: List[FundingTransaction] = session.scalars(
+        select(FundingTransaction)
+        .where(
+            FundingTransaction.investor_account_id == investor_account_id,
+            FundingTransaction.state == TransactionState.WITHDRAWAL_PENDING,
+            FundingTransaction.withdrawal_transaction_id.is_(None),
         )
-        if withdrawal is None or withdrawal.state == WithdrawalState.FAILED:
-            transaction.transition(TransactionState.FAILED)
-            session.commit()
-            raise ValueError("Withdrawal failed")
-        if withdrawal.state == WithdrawalState.IN_PROGRESS:
-            transaction.transition(TransactionState.WITHDRAWAL_PENDING)
+        .order_by(FundingTransaction.id)
+    ).all()
+    if not transactions:
+        return None
+    # A withdrawal is in one currency, any others go in a later batch
+    currency = transactions[0].currency
+    transactions = [t for t in transactions if t.currency == currency]
+
+    withdrawal = WithdrawalTransaction(
+        investor_account_id=investor_account_id,
+        amount_minor=sum(t.amount_minor for t in transactions),
+        currency=currency,
+        state=SingleTransferState.INITIATED,
+    )
+    session.add(withdrawal)
+    session.flush()
+    # Guarded so an overlapping batch can't take the same transactions
+    linked = set(
+        session.scalars(
+            update(FundingTransaction)
+            .where(
+                FundingTransaction.id.in_([t.id for t in transactions]),
+                FundingTransaction.withdrawal_transaction_id.is_(None),
+            )
+            .values(withdrawal_transaction_id=withdrawal.id)
+            .returning(FundingTransaction.id)
+            .execution_options(synchronize_session=False)
+        )
+    )
+    transactions = [t for t in transactions if t.id in linked]
+    if not transactions:
+        session.rollback()
+        return None
+    withdrawal.amount_minor = sum(t.amount_minor for t in transactions)
+    session.commit()
+    return withdrawal, transactions
+
+
+def _resume_withdrawal_batch(session, withdrawal_transaction_id):
+    withdrawal = session.get(WithdrawalTransaction, withdrawal_transaction_id)
+    if withdrawal is None or withdrawal.state != SingleTransferState.INITIATED:
+        return None
+    transactions = still_pending(
+        withdrawal.funding_transactions, TransactionState.WITHDRAWAL_PENDING
+    )
+    if not transactions:
+        return None
+    return withdrawal, transactions
+
+
+@app.task(bind=True, max_retries=None)
+def withdraw_investor_batch(self, investor_account_id, withdrawal_transaction_id=None):
+    """
+    Make one provider withdrawal for every funding transaction the investor
+    has claimed since the last batch. Batches scheduled for transfers already
+    taken by an earlier batch find nothing to do. A retry after a transient
+    failure makes the same batch's withdrawal again, under the same
+    idempotency key. A withdrawal the provider accepted is never failed here;
+    if it can't be recorded the sweep resumes the batch.
+    """
+    session = Session()
+    try:
+        if withdrawal_transaction_id is None:
+            batch = _link_withdrawal_batch(session, investor_account_id)
+        else:
+            batch = _resume_withdrawal_batch(session, withdrawal_transaction_id)
+        if batch is None:
+            return
+        withdrawal, transactions = batch
+        withdrawal_transaction_id = withdrawal.id
+
+        accepted = False
+        try:
+            provider_withdrawal = investor_account_service.withdraw_funds(
+                account_id=transactions[0].investor_account.external_account_uid,
+                amount=withdrawal.amount_money(),
+                idempotency_key=f"withdrawal-{withdrawal_transaction_id}",
+            )
+            if (
+                provider_withdrawal is None
+                or provider_withdrawal.state == WithdrawalState.FAILED
+            ):
+                raise ValueError("Withdrawal failed")
+            accepted = True
+
+            # Record the provider withdrawal so the sweeper can check on it
+            withdrawal.external_transaction_uid = (
+                provider_withdrawal.get_withdrawal_id()
+            )
+            withdrawal.transition_cas(session, SingleTransferState.TRANSFER_PENDING)
+            for transaction in transactions:
+                consume_hold(session, transaction.id)
             session.commit()
-
-        # Queue the deposit task
-        complete_withdrawal.delay(transaction_id, withdrawal.get_withdrawal_id())
-    except Exception as e:
-        transaction.transition(TransactionState.FAILED)
-        session.commit()
-        raise e
+        except Exception as e:
+            raise _retry_or_fail(
+                self,
+                session,
+                e,
+                FundingTransaction.withdrawal_transaction_id
+                == withdrawal_transaction_id,
+                (
+                    partial(
+                        _leave_for_sweep, "Withdrawal batch", withdrawal_transaction_id
+                    )
+                    if accepted
+                    else lambda: _fail_withdrawal_batch(
+                        session, withdrawal, transactions
+                    )
+                ),
+                args=(investor_account_id, withdrawal_transaction_id),
+            )
     finally:
         session.close()
 
 
-@app.task
-def complete_withdrawal(transaction_id, withdrawal_id: str = None):
+@app.task(bind=True, max_retries=None)
+def complete_withdrawal(
+    self, transaction_id, withdrawal_id: str = None, attempt: int = 0
+):
+    """
+    Check a single pending withdrawal now, rescheduling until it settles.
+    Every funding transaction in the withdrawal's batch advances with it.
+    Pending withdrawals are otherwise picked up by sweep_pending_transactions.
+    """
     session = Session()
     transaction: FundingTransaction = (
         session.query(FundingTransaction).filter_by(id=transaction_id).one()
     )
+    found = (transaction.state, transaction.version)
+    state = None
     try:
-        # Implement withdrawal logic here
-        # Simulate long-running task with sleep
-        import time
-
-        time.sleep(10)
-
-        logger.debug(f"Completing withdrawal for {transaction_id}")
-        investor_account_service._complete_withdrawal(withdrawal_id=withdrawal_id)
-
-        state: WithdrawalState = investor_account_service.withdrawal_status(
-            withdrawal_id=withdrawal_id
-        )
+        if not transaction.state == TransactionState.WITHDRAWAL_PENDING:
+            logger.info(f"Transaction {transaction_id} is no longer pending withdrawal")
+            return
+
+        withdrawal = transaction.withdrawal_transaction
+        if withdrawal is None and withdrawal_id is not None:
+            logger.warning(
+                f"Transaction {transaction_id} has no withdrawal batch for "
+                f"{withdrawal_id}"
+            )
+            return
+        if withdrawal_id is None and withdrawal is not None:
+            withdrawal_id = withdrawal.external_transaction_uid
+
+        if withdrawal_id is not None:
+            logger.debug(f"Completing withdrawal for {transaction_id}")
+            state = investor_account_service.withdrawal_status(
+                withdrawal_id=withdrawal_id,
+                account_id=transaction.investor_account.external_account_uid,
+            )
 
         if state == WithdrawalState.COMPLETED:
-            transaction.transition(TransactionState.WITHDRAWAL_COMPLETED)
-            session.commit()
-        else:
-            transaction.transition(TransactionState.FAILED)
+            settle(session, withdrawal, SingleTransferState.TRANSFER_COMPLETED)
+            completed = FundingTransaction.transition_all_cas(
+                session,
+                still_pending(
+                    withdrawal.funding_transactions, TransactionState.WITHDRAWAL_PENDING
+                ),
+                TransactionState.WITHDRAWAL_COMPLETED,
+            )
+            if not completed:
+                # Already settled by the sweeper or another worker
+                session.rollback()
+                return
             session.commit()
+        elif state == WithdrawalState.FAILED:
+            _fail_withdrawal_batch(
+                session,
+                withdrawal,
+                still_pending(
+                    withdrawal.funding_transactions, TransactionState.WITHDRAWAL_PENDING
+                ),
+            )
             raise ValueError("Withdrawal failed")
+    except Exception as e:
+        raise _retry_or_fail(
+            self,
+            session,
+            e,
+            FundingTransaction.id == transaction_id,
+            lambda: _fail(session, transaction_id, *found),
+        )
+    finally:
+        session.close()
 
-        # Queue the deposit task
-        process_deposit.delay(transaction_id)
+    # Completed transactions are deposited with the rest of their fund's batch
+    # by the next sweep
+    if state != WithdrawalState.COMPLETED:
+        complete_withdrawal.apply_async(
+            (transaction_id, withdrawal_id, attempt + 1),
+            countdown=poll_countdown(attempt + 1),
+        )
 
-    except Exception as e:
-        transaction.transition(TransactionState.FAILED)
-        session.commit()
-        raise e
+
+def _fail_deposit_batch(session, deposit: FundDepositTransaction):
+    session.rollback()
+    settle(session, deposit, SingleTransferState.FAILED)
+    FundingTransaction.transition_where(
+        session,
+        TransactionState.DEPOSIT_PENDING,
+        TransactionState.FAILED,
+        FundingTransaction.deposit_transaction_id == deposit.id,
+    )
+    session.commit()
+
+
+def _claim_deposit_batch(session, fund_account_id) -> FundDepositTransaction | None:
+    # A deposit is in one currency, any others go in a later batch
+    currency = session.scalar(
+        select(FundingTransaction.currency)
+        .where(
+            FundingTransaction.fund_account_id == fund_account_id,
+            FundingTransaction.state == TransactionState.WITHDRAWAL_COMPLETED,
+        )
+        .limit(1)
+    )
+    if currency is None:
+        return None
+
+    deposit = FundDepositTransaction(
+        fund_account_id=fund_account_id,
+        amount_minor=0,
+        currency=currency,
+        state=SingleTransferState.INITIATED,
+    )
+    session.add(deposit)
+    session.flush()
+    # One guarded UPDATE claims the fund's whole set, so an overlapping batch
+    # can't take the same transactions
+    claimed = FundingTransaction.transition_where(
+        session,
+        TransactionState.WITHDRAWAL_COMPLETED,
+        TransactionState.DEPOSIT_PENDING,
+        FundingTransaction.fund_account_id == fund_account_id,
+        FundingTransaction.currency == currency,
+        returning=(FundingTransaction.amount_minor,),
+        deposit_transaction_id=deposit.id,
+    )
+    if not claimed:
+        session.rollback()
+        return None
+    deposit.amount_minor = sum(row.amount_minor for row in claimed)
+    session.commit()
+    return deposit
+
+
+def _resume_deposit_batch(session, deposit_transaction_id):
+    deposit = session.get(FundDepositTransaction, deposit_transaction_id)
+    if deposit is None or deposit.state != SingleTransferState.INITIATED:
+        return None
+    return deposit
+
+
+@app.task(bind=True, max_retries=None)
+def deposit_fund_batch(self, fund_account_id, deposit_transaction_id=None):
+    """
+    Make one provider deposit into the fund for every funding transaction
+    whose withdrawal has completed since the last batch, so deposits scale
+    with the number of funds rather than transfers. A retry after a transient
+    failure makes the same batch's deposit again, under the same idempotency
+    key. A deposit the provider accepted is never failed here; if it can't be
+    recorded the sweep resumes the batch.
+    """
+    session = Session()
+    try:
+        if deposit_transaction_id is None:
+            deposit = _claim_deposit_batch(session, fund_account_id)
+        else:
+            deposit = _resume_deposit_batch(session, deposit_transaction_id)
+        if deposit is None:
+            return
+        deposit_transaction_id = deposit.id
+
+        accepted = False
+        try:
+            provider_deposit = fund_account_service.deposit_funds(
+                account_id=deposit.fund_account.external_account_uid,
+                amount=deposit.amount_money(),
+                idempotency_key=f"deposit-{deposit_transaction_id}",
+            )
+            if (
+                provider_deposit is None
+                or provider_deposit.get_state() == DepositState.FAILED
+            ):
+                raise ValueError("Deposit failed")
+            accepted = True
+
+            # Record the provider deposit so the sweeper can check on it
+            deposit.external_transaction_uid = provider_deposit.get_deposit_id()
+            deposit.transition_cas(session, SingleTransferState.TRANSFER_PENDING)
+            session.commit()
+        except Exception as e:
+            raise _retry_or_fail(
+                self,
+                session,
+                e,
+                FundingTransaction.deposit_transaction_id == deposit_transaction_id,
+                (
+                    partial(_leave_for_sweep, "Deposit batch", deposit_transaction_id)
+                    if accepted
+                    else lambda: _fail_deposit_batch(session, deposit)
+                ),
+                args=(fund_account_id, deposit_transaction_id),
+            )
     finally:
         session.close()
 
 
 @app.task
 def process_deposit(transaction_id):
+    """
+    Deposit a completed withdrawal now, along with the rest of its fund's
+    batch, instead of waiting for the next sweep.
+    """
+    session = Session()
+    try:
+        transaction: FundingTransaction = (
+            session.query(FundingTransaction).filter_by(id=transaction_id).one()
+        )
+        if not transaction.state == TransactionState.WITHDRAWAL_COMPLETED:
+            logger.info(f"Transaction {transaction_id} is not ready for deposit")
+            return
+        fund_account_id = transaction.fund_account_id
+    finally:
+        session.close()
+
+    # Queued rather than called, so a transient failure can be retried
+    deposit_fund_batch.delay(fund_account_id)
+
+
+@app.task(bind=True, max_retries=None)
+def complete_deposit(self, transaction_id, deposit_id: str = None, attempt: int = 0):
+    """
+    Check a single pending deposit now, rescheduling until it settles.
+    Every funding transaction in the deposit's batch advances with it.
+    Pending deposits are otherwise picked up by sweep_pending_transactions.
+    """
     session = Session()
     transaction: FundingTransaction = (
         session.query(FundingTransaction).filter_by(id=transaction_id).one()
     )
-
+    found = (transaction.state, transaction.version)
     try:
-        if not transaction.state == TransactionState.WITHDRAWAL_COMPLETED:
-            raise ValueError("Invalid state for deposit processing")
-        # Implement deposit logic here
-        # Simulate long-running task with sleep
-        import time
-
-        logger.debug("Simulating task. Sleep for 10 seconds")
-        time.sleep(10)
+        if not transaction.state == TransactionState.DEPOSIT_PENDING:
+            logger.info(f"Transaction {transaction_id} is no longer pending deposit")
+            return
+
+        deposit = transaction.deposit_transaction
+        if deposit is None:
+            logger.warning(f"Transaction {transaction_id} has no deposit batch")
+            return
+        if deposit_id is None:
+            deposit_id = deposit.external_transaction_uid
+
+        state: DepositState = fund_account_service.deposit_status(
+            deposit_id=deposit_id,
+            account_id=transaction.fund_account.external_account_uid,
+        )
 
-        # Update transaction state
-        transaction.transition(TransactionState.DEPOSIT_PENDING)
-        session.commit()
+        if state == DepositState.COMPLETED:
+            settle(session, deposit, SingleTransferState.TRANSFER_COMPLETED)
+            completed = FundingTransaction.transition_all_cas(
+                session,
+                still_pending(
+                    deposit.funding_transactions, TransactionState.DEPOSIT_PENDING
+                ),
+                TransactionState.DEPOSIT_COMPLETED,
+            )
+            if not completed:
+                # Already settled by the sweeper or another worker
+                session.rollback()
+                return
+            enqueue_funds_transferred(session, [t.id for t in completed])
+            session.commit()
+        elif state == DepositState.FAILED:
+            _fail_deposit_batch(session, deposit)
+            raise ValueError("Deposit failed")
     except Exception as e:
-        transaction.transition(TransactionState.FAILED)
-        session.commit()
-        raise e
+        raise _retry_or_fail(
+            self,
+            session,
+            e,
+            FundingTransaction.id == transaction_id,
+            lambda: _fail(session, transaction_id, *found),
+        )
     finally:
         session.close()
 
+    if state != DepositState.COMPLETED:
+        complete_deposit.apply_async(
+            (transaction_id, deposit_id, attempt + 1),
+            countdown=poll_countdown(attempt + 1),
+        )
+
 
 @app.task
-def complete_deposit(transaction_id):
+def sweep_pending_transactions():
+    """
+    Check all pending withdrawals and deposits in provider batches, instead of
+    one scheduled status check per transaction, then start one deposit batch
+    for every fund with completed withdrawals. Batches that stalled before
+    reaching the provider are started again; their idempotency keys keep a
+    batch whose task is still running from moving money twice.
+    """
     session = Session()
-    transaction: FundingTransaction = (
-        session.query(FundingTransaction).filter_by(id=transaction_id).one()
-    )
+    try:
+        sweep_withdrawals(session, investor_account_service)
+        sweep_deposits(session, fund_account_service)
+        fund_account_ids = funds_ready_for_deposit(session)
+        stalled_before = datetime.now() - timedelta(seconds=STALLED_BATCH_AFTER)
+        stalled_withdrawals = stalled_withdrawal_batches(session, stalled_before)
+        stalled_deposits = stalled_deposit_batches(session, stalled_before)
+    finally:
+        session.close()
+
+    if fund_account_ids:
+        group(deposit_fund_batch.s(fid) for fid in fund_account_ids).apply_async()
+    for investor_account_id, withdrawal_transaction_id in stalled_withdrawals:
+        logger.warning(
+            "Resuming stalled withdrawal batch %s for investor account %s",
+            withdrawal_transaction_id,
+            investor_account_id,
+        )
+        withdraw_investor_batch.delay(investor_account_id, withdrawal_transaction_id)
+    for fund_account_id, deposit_transaction_id in stalled_deposits:
+        logger.warning(
+            "Resuming stalled deposit batch %s for fund account %s",
+            deposit_transaction_id,
+            fund_account_id,
+        )
+        deposit_fund_batch.delay(fund_account_id, deposit_transaction_id)
+
+
+@app.task
+def dispatch_notifications():
+    """
+    Deliver the notifications waiting in the outbox, each sink in a task of its
+    own so a slow sink can't hold up the others.
+    """
+    group(
+        dispatch_sink_notifications.s(name) for name in notification_sinks
+    ).apply_async()
 
+
+@app.task
+def dispatch_sink_notifications(sink_name):
+    """
+    Deliver the notifications waiting in the outbox for one sink.
+    """
+    session = Session()
     try:
-        if not transaction.state == TransactionState.DEPOSIT_PENDING:
-            raise ValueError("Invalid state for deposit completion")
-        # Implement deposit logic here
-        # Simulate long-running task with sleep
-        import time
+        dispatch_outbox(session, {sink_name: notification_sinks[sink_name]})
+    finally:
+        session.close()
 
-        time.sleep(10)
 
-        # Update transaction state
-        transaction.transition(TransactionState.DEPOSIT_COMPLETED)
-        session.commit()
-        notification_service.funds_transfered(transaction)
-    except Exception as e:
-        transaction.transition(TransactionState.FAILED)
-        session.commit()
-        raise e
+@app.task
+def purge_idempotency_keys():
+    """
+    Delete idempotency keys older than the retention window.
+    """
+    session = Session()
+    try:
+        purge_expired_keys(session)
     finally:
         session.close()
+
+
+app.conf.beat_schedule = {
+    "sweep-pending-transactions": {
+        "task": sweep_pending_transactions.name,
+        "schedule": SWEEP_INTERVAL,
+    },
+    "dispatch-notifications": {
+        "task": dispatch_notifications.name,
+        "schedule": NOTIFICATION_DISPATCH_INTERVAL,
+    },
+    "purge-idempotency-keys": {
+        "task": purge_idempotency_keys.name,
+        "schedule": IDEMPOTENCY_PURGE_INTERVAL,
+    },
+}
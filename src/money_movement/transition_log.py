@@ -0,0 +1,88 @@
+"""
+Queries over the transition_event log.
+
+Every committed transition of a workflow model is appended to the log, so the
+time an entity spent in a state is the gap between the event that moved it
+into the state and the next event for the same entity. The gaps are paired up
+with a LEAD() window over each entity's events.
+"""
+
+from datetime import datetime
+from typing import Dict, List, NamedTuple
+
+from sqlalchemy import DateTime, func, select
+from sqlalchemy.orm import Session
+
+from money_movement.models import TransitionEvent
+from money_movement.util import percentile
+
+
+class DwellStats(NamedTuple):
+    """
+    Seconds spent in a state, over every entity that has left it.
+    """
+
+    count: int
+    mean: float
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+
+def entity_history(session: Session, model, entity_id: int) -> List[TransitionEvent]:
+    """
+    The transitions of one entity, oldest first.
+    """
+    return session.scalars(
+        select(TransitionEvent)
+        .where(
+            TransitionEvent.entity == model.__tablename__,
+            TransitionEvent.entity_id == entity_id,
+        )
+        .order_by(TransitionEvent.occurred_at, TransitionEvent.id)
+    ).all()
+
+
+def dwell_times(
+    session: Session, model, since: datetime | None = None
+) -> Dict[str, DwellStats]:
+    """
+    Distribution of the time entities of `model` spent in each state, by
+    state name, for stays that began at or after `since`. The initial state
+    is not logged on creation, so stays in it are not counted, and neither
+    are stays that haven't ended yet.
+    """
+    left_at = (
+        func.lead(TransitionEvent.occurred_at, type_=DateTime)
+        .over(
+            partition_by=TransitionEvent.entity_id,
+            order_by=(TransitionEvent.occurred_at, TransitionEvent.id),
+        )
+        .label("left_at")
+    )
+    stays = (
+        select(TransitionEvent.to_state, TransitionEvent.occurred_at, left_at)
+        .where(TransitionEvent.entity == model.__tablename__)
+        .subquery()
+    )
+    stmt = select(stays.c.to_state, stays.c.occurred_at, stays.c.left_at).where(
+        stays.c.left_at.is_not(None)
+    )
+    if since is not None:
+        stmt = stmt.where(stays.c.occurred_at >= since)
+
+    durations: Dict[str, List[float]] = {}
+    for state, entered_at, left_at in session.execute(stmt):
+        durations.setdefault(state, []).append((left_at - entered_at).total_seconds())
+    return {
+        state: DwellStats(
+            count=len(seconds),
+            mean=sum(seconds) / len(seconds),
+            p50=percentile(seconds, 50),
+            p90=percentile(seconds, 90),
+            p99=percentile(seconds, 99),
+            max=max(seconds),
+        )
+        for state, seconds in durations.items()
+    }
@@ -1,5 +1,7 @@
+import math
 import random
 import string
+from typing import List
 
 
 def generate_random_id(length: int = 8) -> str:
@@ -7,3 +9,12 @@ def generate_random_id(length: int = 8) -> str:
     Generate a random ID of a given length. Could expand with uuid.
     """
     return "".join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile of a non-empty list.
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
@@ -1,7 +1,9 @@
 import pytest
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, clear_mappers
+from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from money_movement.cache import status_cache
+from money_movement.idempotency import idempotency_cache
 from money_movement.models import (
     Base,
     FundingTransaction,
@@ -20,12 +22,12 @@ def engine():
     return create_engine(TEST_DATABASE_URL)
 
 
-@pytest.fixture(scope="session")
+@pytest.fixture(scope="function")
 def tables(engine):
     # Create all tables in the test database
     Base.metadata.create_all(engine)
     yield
-    # Drop all tables in the test database after the test session
+    # Drop all tables in the test database after each test
     Base.metadata.drop_all(engine)
 
 
@@ -36,4 +38,16 @@ def session(engine, tables):
     session = Session()
     yield session
     session.close()
-    clear_mappers()
+
+
+@pytest.fixture(scope="function")
+def session_factory(engine, tables):
+    """A sessionmaker bound to the test database, for patching module factories."""
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture(autouse=True)
+def clear_status_cache():
+    """Database ids are reused across tests, so cached states must not be."""
+    status_cache.clear()
+    idempotency_cache.clear()
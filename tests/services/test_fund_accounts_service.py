@@ -21,3 +21,24 @@ def test_withdrawal_status_invalid():
     deposit = subject.deposit_funds("12345", Money(100, "USD"))
     with pytest.raises(ValueError):
         subject.deposit_status(deposit_id="54321", account_id="12345")
+
+
+def test_deposit_status_settles_after_delay():
+    subject = MockFundAccountsService(accounts={"12345": 1000}, settlement_delay=0)
+    deposit = subject.deposit_funds("12345", Money(100, "USD"))
+    assert DepositState.COMPLETED == subject.deposit_status(
+        deposit_id=deposit.get_deposit_id(), account_id=deposit.get_account_id()
+    )
+
+
+def test_deposit_status_many():
+    subject = MockFundAccountsService(accounts={"12345": 1000})
+    first = subject.deposit_funds("12345", Money(100, "USD"))
+    second = subject.deposit_funds("67890", Money(100, "USD"))
+    subject._complete_deposit("67890", second.get_deposit_id())
+    assert subject.deposit_status_many(
+        [first.get_deposit_id(), second.get_deposit_id(), "54321"]
+    ) == {
+        first.get_deposit_id(): DepositState.CREATED,
+        second.get_deposit_id(): DepositState.COMPLETED,
+    }
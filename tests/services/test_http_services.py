@@ -0,0 +1,190 @@
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from moneyed import Money
+
+from money_movement.services.errors import (
+    ProviderThrottled,
+    TerminalProviderError,
+    TransientProviderError,
+)
+from money_movement.services.fund_accounts import (
+    DepositState,
+    HttpFundAccountsService,
+    MockFundAccountsService,
+)
+from money_movement.services.http import (
+    check_response,
+    provider_client,
+    retry_after,
+)
+from money_movement.services.investor_accounts import (
+    HttpInvestorAccountsService,
+    MockInvestorAccountsService,
+    WithdrawalState,
+)
+from money_movement.services.standin import create_standin_app, serve
+from money_movement.services.statements import read_statement
+
+
+@pytest.fixture
+def mocks():
+    return (
+        MockInvestorAccountsService(accounts={"1234": 1000}),
+        MockFundAccountsService(),
+    )
+
+
+@pytest.fixture
+def client():
+    with httpx.Client() as client:
+        yield client
+
+
+def test_investor_accounts_over_http(mocks, client):
+    investor_mock, _ = mocks
+    app = create_standin_app(*mocks)
+    with serve(app) as url:
+        service = HttpInvestorAccountsService(url, client=client, status_batch_size=2)
+
+        withdrawals = [
+            service.withdraw_funds("1234", Money(100, "USD")) for _ in range(3)
+        ]
+        investor_mock._complete_withdrawal(withdrawals[0].get_withdrawal_id())
+        ids = [w.get_withdrawal_id() for w in withdrawals]
+
+        assert withdrawals[1].get_state() == WithdrawalState.IN_PROGRESS
+        assert withdrawals[1].get_amount() == Money(100, "USD")
+        assert service.check_balance("1234") == Money(700, "USD")
+        assert (
+            service.withdrawal_status(ids[0], account_id="1234")
+            == WithdrawalState.COMPLETED
+        )
+        requests = app.state.stats["requests"]
+        assert service.withdrawal_status_many([*ids, "unknown"]) == {
+            ids[0]: WithdrawalState.COMPLETED,
+            ids[1]: WithdrawalState.IN_PROGRESS,
+            ids[2]: WithdrawalState.IN_PROGRESS,
+        }
+        # Four ids in batches of two
+        assert app.state.stats["requests"] - requests == 2
+        statement = io.StringIO()
+        service.write_statement(statement)
+        statement.seek(0)
+        assert [e.transaction_id for e in read_statement(statement)] == sorted(ids)
+        with pytest.raises(TerminalProviderError):
+            service.check_balance("unknown")
+
+
+def test_fund_accounts_over_http(mocks, client):
+    _, fund_mock = mocks
+    with serve(create_standin_app(*mocks)) as url:
+        service = HttpFundAccountsService(url, client=client)
+
+        deposit = service.deposit_funds("4321", Money(250, "USD"))
+        fund_mock._complete_deposit("4321", deposit.get_deposit_id())
+
+        assert deposit.get_state() == DepositState.CREATED
+        assert (
+            service.deposit_status(deposit.get_deposit_id(), account_id="4321")
+            == DepositState.COMPLETED
+        )
+        assert service.deposit_status_many([deposit.get_deposit_id()]) == {
+            deposit.get_deposit_id(): DepositState.COMPLETED
+        }
+        with pytest.raises(TerminalProviderError):
+            service.deposit_status("unknown", account_id="4321")
+
+
+def test_connections_are_reused(mocks, client):
+    app = create_standin_app(*mocks, latency=0.05)
+    with serve(app) as url:
+        service = HttpInvestorAccountsService(url, client=client)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda _: service.check_balance("1234"), range(20)))
+        elapsed = time.perf_counter() - started
+
+    assert app.state.stats["requests"] == 20
+    # No more connections than calls in flight at once
+    assert len(app.state.connections) <= 4
+    # Calls overlap rather than queuing behind each other's latency
+    assert elapsed < 20 * 0.05
+
+
+def test_throttled_calls_raise_provider_throttled(mocks, client):
+    app = create_standin_app(*mocks, rate_limit=1)
+    with serve(app) as url:
+        service = HttpInvestorAccountsService(url, client=client)
+        service.check_balance("1234")
+
+        with pytest.raises(ProviderThrottled) as throttled:
+            service.check_balance("1234")
+
+    assert throttled.value.retry_after == 1
+    assert app.state.stats["throttled"] == 1
+
+
+def test_repeated_idempotency_key_withdraws_once(mocks, client):
+    investor_mock, _ = mocks
+    with serve(create_standin_app(*mocks)) as url:
+        service = HttpInvestorAccountsService(url, client=client)
+        first, second = (
+            service.withdraw_funds("1234", Money(100, "USD"), idempotency_key="key")
+            for _ in range(2)
+        )
+
+    assert first.get_withdrawal_id() == second.get_withdrawal_id()
+    assert investor_mock.check_balance("1234") == Money(900, "USD")
+
+
+def test_check_response_classifies_errors():
+    def response(status_code, headers=None):
+        return httpx.Response(
+            status_code,
+            headers=headers,
+            request=httpx.Request("GET", "http://provider/balance"),
+        )
+
+    assert check_response(response(200)).status_code == 200
+    for status_code in (408, 500, 502, 503):
+        with pytest.raises(TransientProviderError):
+            check_response(response(status_code))
+    with pytest.raises(TransientProviderError) as unavailable:
+        check_response(response(503, {"Retry-After": "5"}))
+    assert unavailable.value.retry_after == 5
+    for status_code in (400, 404, 422):
+        with pytest.raises(TerminalProviderError):
+            check_response(response(status_code))
+
+
+def test_unreachable_provider_is_transient(client):
+    # Nothing listens on port 9 locally
+    service = HttpInvestorAccountsService("http://127.0.0.1:9", client=client)
+    with pytest.raises(TransientProviderError):
+        service.check_balance("1234")
+
+
+def test_opening_balance(client):
+    with serve(create_standin_app(opening_balance=500)) as url:
+        service = HttpInvestorAccountsService(url, client=client)
+        assert service.check_balance("new-account") == Money(500, "USD")
+
+
+def test_retry_after():
+    def response(value):
+        return httpx.Response(
+            429, headers={} if value is None else {"Retry-After": value}
+        )
+
+    assert retry_after(response("2")) == 2
+    assert retry_after(response(None)) is None
+    assert retry_after(response("Wed, 21 Oct 2015 07:28:00 GMT")) == 0
+    assert retry_after(response("soon")) is None
+
+
+def test_provider_client_is_shared():
+    assert provider_client() is provider_client()
@@ -39,3 +39,25 @@ def test_withdrawal_status_invalid():
     withdrawal = subject.withdraw_funds("12345", Money(100, "USD"))
     with pytest.raises(ValueError):
         subject.withdrawal_status(withdrawal_id="54321", account_id="12345")
+
+
+def test_withdrawal_status_settles_after_delay():
+    subject = MockInvestorAccountsService(accounts={"12345": 1000}, settlement_delay=0)
+    withdrawal = subject.withdraw_funds("12345", Money(100, "USD"))
+    assert WithdrawalState.COMPLETED == subject.withdrawal_status(
+        withdrawal_id=withdrawal.get_withdrawal_id(),
+        account_id=withdrawal.get_account_id(),
+    )
+
+
+def test_withdrawal_status_many():
+    subject = MockInvestorAccountsService(accounts={"12345": 1000})
+    first = subject.withdraw_funds("12345", Money(100, "USD"))
+    second = subject.withdraw_funds("12345", Money(100, "USD"))
+    subject._complete_withdrawal(second.get_withdrawal_id())
+    assert subject.withdrawal_status_many(
+        [first.get_withdrawal_id(), second.get_withdrawal_id(), "54321"]
+    ) == {
+        first.get_withdrawal_id(): WithdrawalState.IN_PROGRESS,
+        second.get_withdrawal_id(): WithdrawalState.COMPLETED,
+    }
@@ -0,0 +1,34 @@
+from decimal import Decimal
+
+import pytest
+from moneyed import Money
+
+from money_movement.amounts import to_decimal, to_minor, to_money
+
+
+def test_to_minor_is_exact():
+    assert to_minor(Decimal("123.45")) == 123_45
+    assert to_minor("0.1") == 10
+    assert to_minor(100) == 100_00
+    assert to_minor(Money("1.50", "USD")) == 150
+    assert to_minor(Decimal(500), "JPY") == 500
+
+
+@pytest.mark.parametrize(
+    "amount, currency", [(Decimal("0.001"), "USD"), (Decimal("0.5"), "JPY")]
+)
+def test_to_minor_rejects_fractions_of_a_minor_unit(amount, currency):
+    with pytest.raises(ValueError, match="finer than"):
+        to_minor(amount, currency)
+
+
+def test_to_minor_rejects_floats():
+    with pytest.raises(ValueError, match="not a float"):
+        to_minor(0.1)
+
+
+def test_back_to_major_units():
+    assert str(to_decimal(123_45)) == "123.45"
+    assert str(to_decimal(100_00)) == "100.00"
+    assert str(to_decimal(500, "JPY")) == "500"
+    assert to_money(10) == Money("0.10", "USD")
@@ -0,0 +1,278 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from money_movement import async_controller
+from money_movement.cache import status_cache
+from money_movement.idempotency import idempotency_cache, idempotency_stats
+from money_movement.main import app
+from money_movement.models import (
+    Base,
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    ProviderLimit,
+    TransactionState,
+)
+
+
+@pytest.fixture
+def async_session_factory(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+
+    async def create_tables():
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create_tables())
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+    monkeypatch.setattr(async_controller, "AsyncSession", factory)
+    yield factory
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    calls = []
+    monkeypatch.setattr(async_controller.process_withdrawal, "delay", calls.append)
+    return calls
+
+
+async def _accounts(factory):
+    async with factory() as session:
+        investor_account = InvestorAccount(external_account_uid="12345")
+        fund_account = FundAccount(external_account_uid="4321")
+        session.add_all([investor_account, fund_account])
+        await session.commit()
+        return investor_account.id, fund_account.id
+
+
+def test_process_new_transaction(async_session_factory, enqueued):
+    async def scenario():
+        investor_id, fund_id = await _accounts(async_session_factory)
+        result = await async_controller.process_new_transaction(
+            investor_id, fund_id, 100
+        )
+        return result, await async_controller.transaction_status(enqueued[0])
+
+    (status, message), state = asyncio.run(scenario())
+
+    assert status == "success"
+    assert message == f"Transfer {enqueued[0]} initiated"
+    assert state == TransactionState.INITIATED
+
+
+def test_process_new_transaction_unknown_account(async_session_factory, enqueued):
+    status, _ = asyncio.run(async_controller.process_new_transaction(-1, -1, 100))
+    assert status == "failure"
+    assert enqueued == []
+
+
+def test_idempotent_retries_return_the_first_transfer(async_session_factory, enqueued):
+    async def scenario():
+        investor_id, fund_id = await _accounts(async_session_factory)
+        first = await async_controller.process_new_transaction(
+            investor_id, fund_id, 100_00, idempotency_key="retry-me"
+        )
+        cached = await async_controller.process_new_transaction(
+            investor_id, fund_id, 100_00, idempotency_key="retry-me"
+        )
+        # As if the retry reached another API process
+        idempotency_cache.clear()
+        stored = await async_controller.process_new_transaction(
+            investor_id, fund_id, 100_00, idempotency_key="retry-me"
+        )
+        async with async_session_factory() as session:
+            count = await session.scalar(select(func.count(FundingTransaction.id)))
+        return first, cached, stored, count
+
+    stats = dict(idempotency_stats)
+    first, cached, stored, count = asyncio.run(scenario())
+
+    assert first == cached == stored == ("success", f"Transfer {enqueued[0]} initiated")
+    assert count == 1
+    assert len(enqueued) == 1
+    assert idempotency_stats["cache_replays"] == stats.get("cache_replays", 0) + 1
+    assert idempotency_stats["stored_replays"] == stats.get("stored_replays", 0) + 1
+
+
+def test_transfer_amount_must_be_positive(async_session_factory, enqueued):
+    investor_id, fund_id = asyncio.run(_accounts(async_session_factory))
+    client = TestClient(app)
+
+    for amount in ("0", "0.00", "-5"):
+        response = client.post(
+            "/transfer",
+            json={"investor_id": investor_id, "fund_id": fund_id, "amount": amount},
+        )
+        assert response.status_code == 422
+        assert response.json()["detail"] == "Amount must be positive"
+    assert enqueued == []
+
+
+def test_idempotency_key_reused_for_another_transfer(async_session_factory, enqueued):
+    async def scenario():
+        return await _accounts(async_session_factory)
+
+    investor_id, fund_id = asyncio.run(scenario())
+    client = TestClient(app)
+
+    def post(amount):
+        return client.post(
+            "/transfer",
+            json={"investor_id": investor_id, "fund_id": fund_id, "amount": amount},
+            headers={"Idempotency-Key": "reused"},
+        )
+
+    assert post("100.00").status_code == 200
+    assert post("100").json() == post("100.00").json()
+    response = post("250")
+    assert response.status_code == 422
+    assert "was used for another transfer" in response.json()["detail"]
+    assert len(enqueued) == 1
+
+
+def test_transaction_status_not_found(async_session_factory):
+    assert asyncio.run(async_controller.transaction_status(-1)) is None
+
+
+def test_transaction_status_is_cached(async_session_factory, enqueued):
+    async def scenario():
+        investor_id, fund_id = await _accounts(async_session_factory)
+        await async_controller.process_new_transaction(investor_id, fund_id, 100)
+        first = await async_controller.transaction_status(enqueued[0])
+        hits = status_cache.hits
+        second = await async_controller.transaction_status(enqueued[0])
+        return first, second, status_cache.hits - hits
+
+    first, second, hits = asyncio.run(scenario())
+
+    assert first == second == TransactionState.INITIATED
+    assert hits == 1
+
+
+async def _transfers(factory, count):
+    investor_id, fund_id = await _accounts(factory)
+    async with factory() as session:
+        transactions = [
+            FundingTransaction(
+                investor_account_id=investor_id,
+                fund_account_id=fund_id,
+                amount_minor=100_00,
+                state=(
+                    TransactionState.FAILED
+                    if i % 3 == 0
+                    else TransactionState.INITIATED
+                ),
+                # Pairs share a timestamp, so pages must break ties on id
+                created=datetime(2024, 1, 1 + i // 2),
+            )
+            for i in range(count)
+        ]
+        session.add_all(transactions)
+        await session.commit()
+        return investor_id, fund_id, [t.id for t in transactions]
+
+
+def test_list_transfers_pages_newest_first(async_session_factory):
+    async def scenario():
+        investor_id, fund_id, ids = await _transfers(async_session_factory, 7)
+        pages = {}
+        for model, owner_id in [(InvestorAccount, investor_id), (FundAccount, fund_id)]:
+            pages[model], cursor = [], None
+            while True:
+                page = await async_controller.list_transfers(
+                    model, owner_id, 3, cursor=cursor
+                )
+                pages[model].append([t.id for t in page.transfers])
+                cursor = page.next_cursor
+                if cursor is None:
+                    break
+        return ids, pages
+
+    ids, pages = asyncio.run(scenario())
+
+    newest_first = sorted(ids, reverse=True)
+    for model in (InvestorAccount, FundAccount):
+        assert pages[model] == [newest_first[:3], newest_first[3:6], newest_first[6:]]
+
+
+def test_list_transfers_by_state(async_session_factory):
+    async def scenario():
+        investor_id, _, ids = await _transfers(async_session_factory, 7)
+        page = await async_controller.list_transfers(
+            InvestorAccount, investor_id, 10, state=TransactionState.FAILED
+        )
+        return ids, page
+
+    ids, page = asyncio.run(scenario())
+
+    assert [t.id for t in page.transfers] == [ids[6], ids[3], ids[0]]
+    assert all(t.state == TransactionState.FAILED.value for t in page.transfers)
+    assert page.transfers[0].model_dump(mode="json")["amount"] == "100.00"
+    assert page.transfers[0].currency == "USD"
+    assert page.next_cursor is None
+
+
+def test_list_transfers_unknown_account(async_session_factory):
+    page = asyncio.run(async_controller.list_transfers(FundAccount, -1, 10))
+    assert page is None
+
+
+def test_list_transfers_rejects_invalid_cursors():
+    client = TestClient(app)
+
+    for cursor in ["not-a-cursor", "W10", "WyJ4IiwxXQ"]:
+        response = client.get("/investors/1/transfers", params={"cursor": cursor})
+        assert response.status_code == 400
+    assert client.get("/funds/1/transfers", params={"limit": 0}).status_code == 422
+
+
+def test_fund_summary_endpoint(async_session_factory):
+    async def scenario():
+        return await _transfers(async_session_factory, 7)
+
+    _, fund_id, _ = asyncio.run(scenario())
+    client = TestClient(app)
+
+    response = client.get(f"/funds/{fund_id}/summary")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "fund_id": fund_id,
+        "states": [
+            {"state": "Initiated", "currency": "USD", "count": 4, "amount": "400.00"},
+            {"state": "Failed", "currency": "USD", "count": 3, "amount": "300.00"},
+        ],
+        "in_flight": {"USD": "400.00"},
+    }
+    assert client.get(f"/funds/{fund_id + 1}/summary").status_code == 404
+
+
+def test_metrics_report_provider_limits(async_session_factory):
+    async def scenario():
+        async with async_session_factory() as session:
+            session.add(
+                ProviderLimit(
+                    provider="bank",
+                    tokens=5,
+                    refilled_at=datetime(2024, 1, 1),
+                    concurrency_limit=4.5,
+                )
+            )
+            await session.commit()
+
+    asyncio.run(scenario())
+
+    response = TestClient(app).get("/metrics")
+
+    assert response.status_code == 200
+    [provider] = response.json()["rate_limits"]["providers"]
+    assert provider["provider"] == "bank"
+    assert provider["concurrency_limit"] == 4.5
+    assert provider["in_flight"] == 0
@@ -0,0 +1,70 @@
+from money_movement import controller, tasks
+from money_movement.benchmark import FUND_COUNT, StepTimer, percentile, run_benchmark
+from money_movement.db import create_engine_from_url
+
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3
+    # Odd and even lengths round the rank up, never to the nearest even
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile(list(range(1, 22)), 50) == 11
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 75) == 3
+    assert percentile([1, 2, 3, 4], 0) == 1
+    assert percentile([1, 2, 3, 4], 100) == 4
+
+
+def test_step_timer_excludes_nested_steps():
+    now = iter([0.0, 1.0, 3.0, 4.0])
+    timer = StepTimer(clock=lambda: next(now))
+    timer.start("outer")
+    timer.start("inner")
+    timer.count_query()
+    timer.stop()
+    timer.stop()
+    assert timer.durations == {"inner": [2.0], "outer": [2.0]}
+    assert timer.queries == {"inner": 1}
+
+
+def test_run_benchmark():
+    engine = create_engine_from_url("sqlite://")
+    session, always_eager = tasks.Session, tasks.app.conf.task_always_eager
+
+    result = run_benchmark(20, engine)
+
+    assert result["transfers"] == 20
+    assert result["completed"] == 20
+    assert result["transactions_per_second"] > 0
+    assert result["queries_per_transaction"] > 0
+    assert set(result["steps"]) == {
+        "process_new_transaction",
+        "process_withdrawal",
+        "withdraw_investor_batch",
+        "complete_withdrawal",
+        "sweep_pending_transactions",
+        "deposit_fund_batch",
+        "complete_deposit",
+        "dispatch_notifications",
+        "dispatch_sink_notifications",
+    }
+    assert result["steps"]["complete_deposit"]["count"] == 20
+    # One deposit per fund
+    assert result["steps"]["deposit_fund_batch"]["count"] == FUND_COUNT
+    # Module state is restored afterwards
+    assert tasks.Session is session
+    assert controller.Session is session
+    assert tasks.app.conf.task_always_eager == always_eager
+
+
+def test_run_benchmark_over_http():
+    engine = create_engine_from_url("sqlite://")
+
+    result = run_benchmark(20, engine, provider_latency=0)
+
+    assert result["completed"] == 20
+    # Every provider call goes over one keep-alive connection
+    assert result["provider_requests"] > 20
+    assert result["provider_connections"] == 1
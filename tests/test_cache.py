@@ -0,0 +1,100 @@
+from money_movement.cache import TTLCache, status_cache
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    TransactionState,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_hits_and_misses():
+    cache = TTLCache(maxsize=10, ttl=5)
+    assert cache.get(1) is None
+    cache.set(1, TransactionState.INITIATED)
+    assert cache.get(1) == TransactionState.INITIATED
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_ttl_cache_expires_entries():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set(1, TransactionState.INITIATED)
+    clock.now = 4.9
+    assert cache.get(1) == TransactionState.INITIATED
+    clock.now = 5
+    assert cache.get(1) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=5)
+    cache.set(1, TransactionState.INITIATED)
+    cache.set(2, TransactionState.INITIATED)
+    cache.get(1)
+    cache.set(3, TransactionState.INITIATED)
+    assert cache.get(2) is None
+    assert cache.get(1) == TransactionState.INITIATED
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_skips_values_loaded_before_invalidation():
+    cache = TTLCache(maxsize=10, ttl=5)
+    generation = cache.generation
+    cache.invalidate(1)
+    cache.set(1, TransactionState.INITIATED, generation)
+    assert cache.get(1) is None
+
+
+def _funding_transaction(session):
+    funding_transaction = FundingTransaction(
+        amount_minor=100_00,
+        investor_account=InvestorAccount(external_account_uid="12345"),
+        fund_account=FundAccount(external_account_uid="4321"),
+        state=TransactionState.INITIATED,
+    )
+    session.add(funding_transaction)
+    session.commit()
+    return funding_transaction
+
+
+def test_status_cache_invalidated_on_commit(session):
+    funding_transaction = _funding_transaction(session)
+    status_cache.set(funding_transaction.id, TransactionState.INITIATED)
+
+    funding_transaction.transition_cas(session, TransactionState.WITHDRAWAL_PENDING)
+    assert status_cache.get(funding_transaction.id) == TransactionState.INITIATED
+    session.commit()
+
+    assert status_cache.get(funding_transaction.id) is None
+
+
+def test_status_cache_kept_on_rollback(session):
+    funding_transaction = _funding_transaction(session)
+    status_cache.set(funding_transaction.id, TransactionState.INITIATED)
+
+    funding_transaction.transition_cas(session, TransactionState.WITHDRAWAL_PENDING)
+    session.rollback()
+    session.commit()
+
+    assert status_cache.get(funding_transaction.id) == TransactionState.INITIATED
+    status_cache.invalidate(funding_transaction.id)
+
+
+def test_status_cache_invalidated_by_in_memory_transition(session):
+    funding_transaction = _funding_transaction(session)
+    status_cache.set(funding_transaction.id, TransactionState.INITIATED)
+
+    funding_transaction.transition(TransactionState.WITHDRAWAL_PENDING)
+    session.commit()
+
+    assert status_cache.get(funding_transaction.id) is None
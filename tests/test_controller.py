@@ -0,0 +1,107 @@
+import pytest
+from money_movement import controller
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    TransactionState,
+)
+from money_movement.schemas import TransferRequest
+
+
+class RecordingGroup:
+    calls = []
+
+    def __init__(self, signatures):
+        self.signatures = list(signatures)
+
+    def apply_async(self):
+        RecordingGroup.calls.append(self.signatures)
+
+
+@pytest.fixture
+def patched_controller(monkeypatch, session_factory):
+    RecordingGroup.calls = []
+    monkeypatch.setattr(controller, "Session", session_factory)
+    monkeypatch.setattr(controller, "group", RecordingGroup)
+    return controller
+
+
+def _accounts(session):
+    investor_account = InvestorAccount(external_account_uid="12345")
+    fund_account = FundAccount(external_account_uid="4321")
+    session.add_all([investor_account, fund_account])
+    session.commit()
+    return investor_account, fund_account
+
+
+def test_process_new_transactions(session, patched_controller):
+    investor_account, fund_account = _accounts(session)
+    transfers = [
+        TransferRequest(
+            investor_id=investor_account.id, fund_id=fund_account.id, amount=100
+        ),
+        TransferRequest(
+            investor_id=investor_account.id, fund_id=fund_account.id, amount=250
+        ),
+    ]
+
+    results = patched_controller.process_new_transactions(transfers)
+
+    assert [r.status for r in results] == ["success", "success"]
+    created = {
+        t.id: t
+        for t in session.query(FundingTransaction).filter(
+            FundingTransaction.id.in_([r.transfer_id for r in results])
+        )
+    }
+    assert created[results[0].transfer_id].amount_minor == 100_00
+    assert created[results[1].transfer_id].amount_minor == 250_00
+    assert all(t.state == TransactionState.INITIATED for t in created.values())
+
+    assert len(RecordingGroup.calls) == 1
+    assert [sig.args for sig in RecordingGroup.calls[0]] == [
+        (results[0].transfer_id,),
+        (results[1].transfer_id,),
+    ]
+
+
+def test_process_new_transactions_rejects_items(session, patched_controller):
+    investor_account, fund_account = _accounts(session)
+    transfers = [
+        TransferRequest(
+            investor_id=investor_account.id, fund_id=fund_account.id, amount=100
+        ),
+        TransferRequest(investor_id=-1, fund_id=fund_account.id, amount=100),
+        TransferRequest(investor_id=investor_account.id, fund_id=-1, amount=100),
+        TransferRequest(
+            investor_id=investor_account.id, fund_id=fund_account.id, amount=0
+        ),
+        TransferRequest(
+            investor_id=investor_account.id, fund_id=fund_account.id, amount="0.001"
+        ),
+    ]
+
+    results = patched_controller.process_new_transactions(transfers)
+
+    assert [r.index for r in results] == [0, 1, 2, 3, 4]
+    assert [r.status for r in results] == [
+        "success",
+        "rejected",
+        "rejected",
+        "rejected",
+        "rejected",
+    ]
+    assert "Investor account -1" in results[1].message
+    assert "Fund account -1" in results[2].message
+    assert results[3].transfer_id is None
+    assert "finer than a USD minor unit" in results[4].message
+    assert len(RecordingGroup.calls[0]) == 1
+
+
+def test_process_new_transactions_all_rejected(session, patched_controller):
+    results = patched_controller.process_new_transactions(
+        [TransferRequest(investor_id=-1, fund_id=-1, amount=100)]
+    )
+    assert results[0].status == "rejected"
+    assert RecordingGroup.calls == []
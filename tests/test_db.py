@@ -0,0 +1,37 @@
+from sqlalchemy import text
+
+from money_movement.db import (
+    SQLITE_BUSY_TIMEOUT_MS,
+    async_url,
+    create_engine_from_url,
+    engine_options,
+)
+
+
+def test_async_url():
+    assert async_url("sqlite:///money_movement.db").drivername == "sqlite+aiosqlite"
+    assert (
+        async_url("postgresql://user@localhost/bridge").drivername
+        == "postgresql+asyncpg"
+    )
+
+
+def test_engine_options_pool_sizing():
+    assert "pool_size" in engine_options("sqlite:///money_movement.db")
+    assert "pool_size" in engine_options("postgresql://user@localhost/bridge")
+    # Single-connection and null pools don't take sizing options
+    assert "pool_size" not in engine_options("sqlite:///:memory:")
+    assert "pool_size" not in engine_options("sqlite+aiosqlite:///money_movement.db")
+
+
+def test_sqlite_pragmas(tmp_path):
+    engine = create_engine_from_url(f"sqlite:///{tmp_path / 'test.db'}")
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # NORMAL
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert (
+            connection.execute(text("PRAGMA busy_timeout")).scalar()
+            == SQLITE_BUSY_TIMEOUT_MS
+        )
+    engine.dispose()
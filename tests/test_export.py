@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from money_movement import export
+from money_movement.main import app
+from money_movement.models import (
+    Base,
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    TransactionState,
+)
+
+
+@pytest.fixture
+def export_session(monkeypatch, tmp_path):
+    # Streaming responses read from a worker thread, so use a file database
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(export, "Session", factory)
+    with factory() as session:
+        yield session
+    engine.dispose()
+
+
+def _transfers(session):
+    investor_account = InvestorAccount(external_account_uid="1234")
+    funds = [FundAccount(external_account_uid=f"fund-{i}") for i in range(2)]
+    transactions = [
+        FundingTransaction(
+            investor_account=investor_account,
+            fund_account=funds[i % 2],
+            amount_minor=100_00 + i,
+            state=(
+                TransactionState.DEPOSIT_COMPLETED
+                if i < 3
+                else TransactionState.WITHDRAWAL_PENDING
+            ),
+            created=datetime(2024, 1, 1 + i),
+        )
+        for i in range(5)
+    ]
+    session.add_all(transactions)
+    session.commit()
+    return transactions, funds
+
+
+def test_export_ndjson_streams_in_partitions(export_session):
+    transactions, _ = _transfers(export_session)
+
+    chunks = list(export.export_transfers("ndjson", batch_size=2))
+
+    assert len(chunks) == 3
+    rows = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+    assert [r["id"] for r in rows] == [t.id for t in transactions]
+    assert rows[0]["investor_account_uid"] == "1234"
+    assert rows[0]["fund_account_uid"] == "fund-0"
+    assert rows[0]["state"] == TransactionState.DEPOSIT_COMPLETED.value
+    assert rows[0]["created"] == "2024-01-01T00:00:00"
+    assert rows[1]["amount_minor"] == 100_01
+    assert rows[1]["currency"] == "USD"
+
+
+def test_export_filters(export_session):
+    transactions, funds = _transfers(export_session)
+
+    def ids(**filters):
+        return [
+            json.loads(line)["id"]
+            for chunk in export.export_transfers("ndjson", **filters)
+            for line in chunk.splitlines()
+        ]
+
+    assert ids(state=TransactionState.WITHDRAWAL_PENDING) == [
+        t.id for t in transactions[3:]
+    ]
+    assert ids(fund_id=funds[1].id) == [transactions[1].id, transactions[3].id]
+    assert ids(investor_id=transactions[0].investor_account_id + 1) == []
+    assert ids(created_from=datetime(2024, 1, 2), created_to=datetime(2024, 1, 4)) == [
+        transactions[1].id,
+        transactions[2].id,
+    ]
+
+
+def test_export_csv_endpoint(export_session):
+    transactions, funds = _transfers(export_session)
+    client = TestClient(app)
+
+    response = client.get(
+        "/transfers/export",
+        params={"format": "csv", "fund_id": funds[0].id, "state": "Deposit Completed"},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(r["id"]) for r in rows] == [transactions[0].id, transactions[2].id]
+    assert list(rows[0]) == export.EXPORT_FIELDS
+
+
+def test_export_empty_csv_has_header(export_session):
+    assert list(export.export_transfers("csv")) == [
+        ",".join(export.EXPORT_FIELDS) + "\r\n"
+    ]
+
+
+def test_export_rejects_unknown_format(export_session):
+    response = TestClient(app).get("/transfers/export", params={"format": "xml"})
+
+    assert response.status_code == 422
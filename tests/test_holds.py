@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from money_movement import holds
+from money_movement.db import create_engine_from_url, init_db
+from money_movement.holds import consume_hold, place_hold, release_hold
+from money_movement.models import (
+    BalanceHold,
+    FundAccount,
+    FundingTransaction,
+    HoldState,
+    InvestorAccount,
+    InvestorBalance,
+    TransactionState,
+)
+from money_movement.services.investor_accounts import MockInvestorAccountsService
+
+
+class CountingInvestorAccountsService(MockInvestorAccountsService):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.balance_checks = 0
+
+    def check_balance(self, account_id):
+        self.balance_checks += 1
+        return super().check_balance(account_id)
+
+
+def _transactions(session, *amounts):
+    investor_account = InvestorAccount(external_account_uid="1234")
+    fund_account = FundAccount(external_account_uid="4321")
+    transactions = [
+        FundingTransaction(
+            investor_account=investor_account,
+            fund_account=fund_account,
+            amount_minor=amount_minor,
+            state=TransactionState.INITIATED,
+        )
+        for amount_minor in amounts
+    ]
+    session.add_all(transactions)
+    session.commit()
+    return transactions
+
+
+def _ledger(session, transaction):
+    session.expire_all()
+    return session.get(InvestorBalance, transaction.investor_account_id)
+
+
+def test_holds_are_admitted_locally_while_fresh(session):
+    service = CountingInvestorAccountsService(accounts={"1234": 1000})
+    first, second, third = _transactions(session, 100_00, 100_00, 100_00)
+
+    assert place_hold(session, service, first)
+    assert place_hold(session, service, second)
+    assert place_hold(session, service, third)
+    session.commit()
+
+    assert service.balance_checks == 1
+    ledger = _ledger(session, first)
+    assert ledger.balance_minor == 1000_00
+    assert ledger.held_minor == 300_00
+
+
+def test_thin_margin_refreshes_before_admitting(session):
+    service = CountingInvestorAccountsService(accounts={"1234": 1000})
+    first, second = _transactions(session, 500_00, 450_00)
+
+    assert place_hold(session, service, first)
+    session.commit()
+    # 1000 - 500 - 450 leaves less than the 10% headroom
+    assert place_hold(session, service, second)
+    assert service.balance_checks == 2
+    assert _ledger(session, first).held_minor == 950_00
+
+
+def test_stale_balance_is_refreshed(session):
+    service = CountingInvestorAccountsService(accounts={"1234": 1000})
+    first, second = _transactions(session, 100_00, 100_00)
+    place_hold(session, service, first)
+    session.execute(
+        update(InvestorBalance).values(
+            refreshed_at=datetime.now() - timedelta(seconds=holds.BALANCE_CACHE_TTL + 1)
+        )
+    )
+
+    assert place_hold(session, service, second)
+    assert service.balance_checks == 2
+
+
+def test_insufficient_funds_are_rejected_against_the_provider(session):
+    service = CountingInvestorAccountsService(accounts={"1234": 1000})
+    first, second = _transactions(session, 800_00, 300_00)
+
+    assert place_hold(session, service, first)
+    session.commit()
+    assert not place_hold(session, service, second)
+    assert service.balance_checks == 2
+    assert _ledger(session, first).held_minor == 800_00
+
+
+def test_consume_and_release_holds(session):
+    service = MockInvestorAccountsService(accounts={"1234": 1000})
+    first, second = _transactions(session, 100_00, 200_00)
+    place_hold(session, service, first)
+    place_hold(session, service, second)
+    session.commit()
+
+    assert consume_hold(session, first.id)
+    assert release_hold(session, second.id)
+    assert not release_hold(session, second.id)
+    session.commit()
+
+    ledger = _ledger(session, first)
+    assert ledger.balance_minor == 900_00
+    assert ledger.held_minor == 0
+    states = {h.funding_transaction_id: h.state for h in session.query(BalanceHold)}
+    assert states == {first.id: HoldState.WITHDRAWN, second.id: HoldState.RELEASED}
+
+
+def test_failed_transaction_releases_hold(session):
+    service = MockInvestorAccountsService(accounts={"1234": 1000})
+    [transaction] = _transactions(session, 100_00)
+    place_hold(session, service, transaction)
+    session.commit()
+
+    transaction.transition_cas(session, TransactionState.FAILED)
+    session.commit()
+
+    assert _ledger(session, transaction).held_minor == 0
+
+
+@pytest.fixture
+def file_session_factory(tmp_path):
+    engine = create_engine_from_url(f"sqlite:///{tmp_path}/holds.db")
+    init_db(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def test_concurrent_holds_never_overdraw(file_session_factory):
+    service = MockInvestorAccountsService(accounts={"1234": 1000})
+    with file_session_factory() as session:
+        transaction_ids = [t.id for t in _transactions(session, *[100_00] * 30)]
+
+    def hold(transaction_id):
+        # SQLite rejects a read transaction that tries to write after another
+        # writer committed; a worker would retry the task
+        while True:
+            with file_session_factory() as session:
+                try:
+                    transaction = session.get(FundingTransaction, transaction_id)
+                    placed = place_hold(session, service, transaction)
+                    session.commit()
+                    return placed
+                except OperationalError:
+                    session.rollback()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        placed = list(pool.map(hold, transaction_ids))
+
+    assert placed.count(True) == 10
+    with file_session_factory() as session:
+        ledger = session.get(InvestorBalance, 1)
+        assert ledger.held_minor == 1000_00
+        assert session.query(BalanceHold).count() == 10
+
+
+def test_provider_is_not_called_inside_a_write_transaction(session):
+    first, second = _transactions(session, 500_00, 450_00)
+    service = MockInvestorAccountsService(accounts={"1234": 1000})
+    place_hold(session, service, first)
+    session.commit()
+    writing = []
+    check_balance = service.check_balance
+
+    def checking_balance(account_id):
+        dbapi_connection = session.connection().connection.dbapi_connection
+        writing.append(dbapi_connection.in_transaction)
+        return check_balance(account_id)
+
+    service.check_balance = checking_balance
+    claims = []
+
+    # The thin margin sends the admission to the provider
+    assert place_hold(session, service, second, lambda: claims.append(1) or True)
+
+    assert writing == [False]
+    # The claim is made again with the admission after the refresh
+    assert len(claims) == 2
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from money_movement.idempotency import purge_expired_keys, replay, request_hash
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    IdempotencyKey,
+    InvestorAccount,
+)
+
+
+def test_replay():
+    request = request_hash(1, 2, 100_00)
+
+    assert replay("key", (request, 7), request) == ("success", "Transfer 7 initiated")
+    assert replay("key", (request_hash(1, 2, 1), 7), request)[0] == "conflict"
+
+
+def test_purge_expired_keys(session):
+    transaction = FundingTransaction(
+        investor_account=InvestorAccount(external_account_uid="1234"),
+        fund_account=FundAccount(external_account_uid="4321"),
+        amount_minor=100_00,
+    )
+    now = datetime.now()
+    session.add_all(
+        IdempotencyKey(
+            key=f"key-{age}",
+            request_hash="hash",
+            funding_transaction=transaction,
+            created=now - timedelta(hours=age),
+        )
+        for age in (1, 25, 26, 48, 72)
+    )
+    session.commit()
+
+    assert purge_expired_keys(session, retention=24 * 3600, batch_size=2) == 4
+
+    assert session.scalars(select(IdempotencyKey.key)).all() == ["key-1"]
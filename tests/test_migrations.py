@@ -0,0 +1,120 @@
+from sqlalchemy import create_engine, inspect, text
+
+from money_movement.migrations import HEAD, current_version, migrate
+from money_movement.models import Base
+
+
+def test_migrate_new_database():
+    engine = create_engine("sqlite://")
+
+    assert migrate(engine) == []
+
+    with engine.connect() as connection:
+        assert current_version(connection) == HEAD
+    assert "ix_funding_transaction_state_modified" in {
+        index["name"] for index in inspect(engine).get_indexes("funding_transaction")
+    }
+
+
+def test_migrate_existing_database():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    # Roll the tables back to the schema from before the migrations
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(text(f"DROP INDEX {index.name}"))
+        for table in ("withdrawal_transaction", "deposit_transaction"):
+            connection.execute(
+                text(f"ALTER TABLE {table} DROP COLUMN external_transaction_uid")
+            )
+
+    assert migrate(engine) == [1, 2, 3, 4, 5, 6]
+    assert migrate(engine) == []
+
+    columns = {c["name"] for c in inspect(engine).get_columns("deposit_transaction")}
+    assert "external_transaction_uid" in columns
+    assert {
+        index["name"] for index in inspect(engine).get_indexes("withdrawal_transaction")
+    } == {
+        "ix_withdrawal_transaction_state_modified",
+        "ix_withdrawal_transaction_investor_created",
+    }
+
+
+def test_migrate_listing_indexes():
+    engine = create_engine("sqlite://")
+    migrate(engine)
+    # A database at version 2, with the investor index before it gained id
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM schema_version"))
+        connection.execute(text("INSERT INTO schema_version VALUES (2)"))
+        connection.execute(text("DROP INDEX ix_funding_transaction_investor_created"))
+        connection.execute(text("DROP INDEX ix_funding_transaction_fund_created"))
+        connection.execute(
+            text(
+                "CREATE INDEX ix_funding_transaction_investor_created "
+                "ON funding_transaction (investor_account_id, created)"
+            )
+        )
+
+    assert migrate(engine) == [3, 4, 5, 6]
+
+    indexes = {
+        index["name"]: index["column_names"]
+        for index in inspect(engine).get_indexes("funding_transaction")
+    }
+    assert indexes["ix_funding_transaction_investor_created"] == [
+        "investor_account_id",
+        "created",
+        "id",
+    ]
+    assert indexes["ix_funding_transaction_fund_created"] == [
+        "fund_account_id",
+        "created",
+        "id",
+    ]
+
+
+def test_migrate_minor_units():
+    engine = create_engine("sqlite://")
+    migrate(engine)
+    # A database at version 3, with decimal amounts and no currencies
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM schema_version"))
+        connection.execute(text("INSERT INTO schema_version VALUES (3)"))
+        for table, old, new in [
+            ("funding_transaction", "amount", "amount_minor"),
+            ("investor_balance", "balance", "balance_minor"),
+            ("investor_balance", "held", "held_minor"),
+        ]:
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {new}"))
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {old} NUMERIC"))
+        for table in ("funding_transaction", "investor_balance"):
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN currency"))
+        connection.execute(text("ALTER TABLE funding_transaction DROP COLUMN retries"))
+        connection.execute(
+            text(
+                "INSERT INTO funding_transaction (investor_account_id, "
+                "fund_account_id, amount, state, version, created, modified) "
+                "VALUES (1, 1, 12.34, 'INITIATED', 1, '2024-01-01', '2024-01-01')"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO investor_balance (investor_account_id, balance, held, "
+                "refreshed_at) VALUES (1, 1000, 0.1, '2024-01-01')"
+            )
+        )
+
+    assert migrate(engine) == [4, 5, 6]
+
+    with engine.connect() as connection:
+        assert connection.execute(
+            text("SELECT amount_minor, currency, retries FROM funding_transaction")
+        ).one() == (1234, "USD", 0)
+        assert connection.execute(
+            text("SELECT balance_minor, held_minor, currency FROM investor_balance")
+        ).one() == (1000_00, 10, "USD")
+    columns = {c["name"] for c in inspect(engine).get_columns("funding_transaction")}
+    assert "amount" not in columns
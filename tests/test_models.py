@@ -4,6 +4,8 @@ from money_movement.models import (
     FundingTransaction,
     InvestorAccount,
     TransactionState,
+    TransitionRecord,
+    session_transitions,
 )
 from moneyed import Money
 
@@ -11,7 +13,7 @@ from moneyed import Money
 def test_funding_transaction(session):
     fund_account = FundAccount()
     fund_account.external_account_uid = "4321"
-    fund_account.min_investment_threshold = 100
+    fund_account.min_investment_minor = 100_00
     fund_account.seat_availability = 10
 
     investor_account = InvestorAccount()
@@ -21,12 +23,14 @@ def test_funding_transaction(session):
 
     session.commit()
     funding_transaction = FundingTransaction(
-        amount=100, investor_account=investor_account, fund_account=fund_account
+        amount_minor=100_00,
+        investor_account=investor_account,
+        fund_account=fund_account,
     )
     session.add(funding_transaction)
     session.commit()
     retrieved_transaction = session.query(FundingTransaction).first()
-    assert retrieved_transaction.amount == 100
+    assert retrieved_transaction.amount_minor == 100_00
     assert retrieved_transaction.amount_money() == Money(100, "USD")
     assert retrieved_transaction.state == TransactionState.INITIATED
     assert retrieved_transaction.investor_account.external_account_uid == "12345"
@@ -35,10 +39,9 @@ def test_funding_transaction(session):
 
 @pytest.mark.skip(reason="Having trouble getting this working")
 def test_funding_transaction_transition_state(session):
-
     fund_account = FundAccount()
     fund_account.external_account_uid = "4321"
-    fund_account.min_investment_threshold = 100
+    fund_account.min_investment_minor = 100_00
     fund_account.seat_availability = 10
 
     investor_account = InvestorAccount()
@@ -48,7 +51,7 @@ def test_funding_transaction_transition_state(session):
     session.commit()
 
     funding_transaction = FundingTransaction(
-        amount=100,
+        amount_minor=100_00,
         investor_account=investor_account,
         fund_account=fund_account,
         state=TransactionState.INITIATED,
@@ -77,7 +80,7 @@ def test_funding_transaction_transition_state(session):
 def test_funding_transaction_invalid_transition(session):
     fund_account = FundAccount()
     fund_account.external_account_uid = "4321"
-    fund_account.min_investment_threshold = 100
+    fund_account.min_investment_minor = 100_00
     fund_account.seat_availability = 10
 
     session.add(fund_account)
@@ -88,7 +91,7 @@ def test_funding_transaction_invalid_transition(session):
     session.add(investor_account)
     session.commit()
     funding_transaction = FundingTransaction(
-        amount=100,
+        amount_minor=100_00,
         investor_account=investor_account,
         fund_account=fund_account,
         state=TransactionState.INITIATED,
@@ -97,3 +100,96 @@ def test_funding_transaction_invalid_transition(session):
     with pytest.raises(ValueError):
         funding_transaction.transition(TransactionState.DEPOSIT_COMPLETED)
         session.commit()
+
+
+def _initiated_transaction(session):
+    funding_transaction = FundingTransaction(
+        amount_minor=100_00,
+        investor_account=InvestorAccount(external_account_uid="12345"),
+        fund_account=FundAccount(external_account_uid="4321"),
+        state=TransactionState.INITIATED,
+    )
+    session.add(funding_transaction)
+    session.commit()
+    return funding_transaction
+
+
+def test_funding_transaction_transition_cas(session):
+    funding_transaction = _initiated_transaction(session)
+
+    assert funding_transaction.transition_cas(
+        session, TransactionState.WITHDRAWAL_PENDING
+    )
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+    assert funding_transaction.version == 2
+    session.commit()
+
+    session.refresh(funding_transaction)
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+    assert funding_transaction.version == 2
+
+
+def test_funding_transaction_transition_cas_loses_race(session, session_factory):
+    funding_transaction = _initiated_transaction(session)
+    first, second = session_factory(), session_factory()
+    first_copy = first.get(FundingTransaction, funding_transaction.id)
+    second_copy = second.get(FundingTransaction, funding_transaction.id)
+
+    assert first_copy.transition_cas(first, TransactionState.WITHDRAWAL_PENDING)
+    first.commit()
+    assert not second_copy.transition_cas(second, TransactionState.FAILED)
+    assert second_copy.state == TransactionState.INITIATED
+    second.commit()
+
+    session.refresh(funding_transaction)
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+    assert funding_transaction.version == 2
+    first.close()
+    second.close()
+
+
+def test_compare_and_set_state(session):
+    funding_transaction = _initiated_transaction(session)
+
+    assert not FundingTransaction.compare_and_set_state(
+        session,
+        funding_transaction.id,
+        TransactionState.INITIATED,
+        TransactionState.WITHDRAWAL_PENDING,
+        expected_version=5,
+    )
+    assert FundingTransaction.compare_and_set_state(
+        session,
+        funding_transaction.id,
+        TransactionState.INITIATED,
+        TransactionState.WITHDRAWAL_PENDING,
+    )
+    session.commit()
+    session.refresh(funding_transaction)
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+
+
+def test_compare_and_set_state_invalid_transition(session):
+    funding_transaction = _initiated_transaction(session)
+    with pytest.raises(ValueError):
+        FundingTransaction.compare_and_set_state(
+            session,
+            funding_transaction.id,
+            TransactionState.INITIATED,
+            TransactionState.DEPOSIT_COMPLETED,
+        )
+
+
+def test_transition_cas_records_transition_once(session):
+    funding_transaction = _initiated_transaction(session)
+
+    funding_transaction.transition_cas(session, TransactionState.WITHDRAWAL_PENDING)
+    assert [r._replace(occurred_at=None) for r in session_transitions(session)] == [
+        TransitionRecord(
+            FundingTransaction,
+            funding_transaction.id,
+            TransactionState.INITIATED,
+            TransactionState.WITHDRAWAL_PENDING,
+            2,
+        )
+    ]
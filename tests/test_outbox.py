@@ -0,0 +1,281 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from sqlalchemy import event, update
+
+from money_movement import outbox
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    NotificationOutbox,
+    TransactionState,
+)
+from money_movement.outbox import dispatch_outbox, enqueue_funds_transferred
+from money_movement.services.notification import (
+    AbstractNotificationService,
+    WebhookNotificationService,
+)
+
+
+class RecordingSink(AbstractNotificationService):
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def funds_transfered(self, notification):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("sink unavailable")
+            self.delivered.append(notification.funding_transaction_id)
+
+
+@pytest.fixture
+def sinks(monkeypatch):
+    sinks = {"first": RecordingSink(), "second": RecordingSink()}
+    monkeypatch.setattr(outbox, "notification_sinks", sinks)
+    return sinks
+
+
+def _completed_transactions(session, count):
+    investor_account = InvestorAccount(external_account_uid="1234")
+    fund_account = FundAccount(external_account_uid="4321")
+    transactions = [
+        FundingTransaction(
+            investor_account=investor_account,
+            fund_account=fund_account,
+            amount_minor=100_00,
+            state=TransactionState.DEPOSIT_COMPLETED,
+        )
+        for _ in range(count)
+    ]
+    session.add_all(transactions)
+    session.commit()
+    return transactions
+
+
+def test_enqueue_writes_one_row_per_sink(session, sinks):
+    transactions = _completed_transactions(session, 2)
+
+    enqueue_funds_transferred(session, [t.id for t in transactions])
+    session.rollback()
+    assert session.query(NotificationOutbox).count() == 0
+
+    enqueue_funds_transferred(session, [t.id for t in transactions])
+    session.commit()
+    rows = session.query(NotificationOutbox).all()
+    assert sorted((r.sink, r.funding_transaction_id) for r in rows) == sorted(
+        (sink, t.id) for sink in sinks for t in transactions
+    )
+    assert all(r.investor_account_uid == "1234" for r in rows)
+    assert all(r.fund_account_uid == "4321" for r in rows)
+    assert all(r.amount_minor == 100_00 for r in rows)
+
+
+def test_dispatch_delivers_in_batches(session, sinks):
+    transactions = _completed_transactions(session, 5)
+    enqueue_funds_transferred(session, [t.id for t in transactions])
+    session.commit()
+
+    assert dispatch_outbox(session, batch_size=3) == 10
+    assert dispatch_outbox(session, batch_size=3) == 0
+
+    for sink in sinks.values():
+        assert sorted(sink.delivered) == [t.id for t in transactions]
+    assert all(r.delivered_at is not None for r in session.query(NotificationOutbox))
+
+
+def test_failed_sink_is_retried_on_its_own(session, sinks):
+    [transaction] = _completed_transactions(session, 1)
+    sinks["second"].failures = 1
+    enqueue_funds_transferred(session, [transaction.id])
+    session.commit()
+
+    assert dispatch_outbox(session) == 1
+    failed = session.query(NotificationOutbox).filter_by(sink="second").one()
+    assert failed.delivered_at is None
+    assert failed.attempts == 1
+    assert "sink unavailable" in failed.last_error
+    assert failed.next_attempt_at > datetime.now()
+
+    # Not due yet
+    assert dispatch_outbox(session) == 0
+    session.execute(
+        update(NotificationOutbox).values(
+            next_attempt_at=datetime.now() - timedelta(seconds=1)
+        )
+    )
+    session.commit()
+    assert dispatch_outbox(session) == 1
+    assert sinks["first"].delivered == [transaction.id]
+    assert sinks["second"].delivered == [transaction.id]
+
+
+class BlockedSink(RecordingSink):
+    """Delivers only once `released` is set, or gives up after a while."""
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def funds_transfered(self, notification):
+        if not self.released.wait(timeout=5):
+            raise TimeoutError("never released")
+        super().funds_transfered(notification)
+
+
+def test_each_sink_is_committed_when_it_finishes(session, sinks):
+    sinks["second"] = BlockedSink()
+    [transaction] = _completed_transactions(session, 1)
+    enqueue_funds_transferred(session, [transaction.id])
+    session.commit()
+    # The slow sink is held until the fast sink's delivery is committed
+    released = sinks["second"].released
+
+    def committed(session):
+        if sinks["first"].delivered:
+            released.set()
+
+    event.listen(session, "after_commit", committed)
+
+    assert dispatch_outbox(session) == 2
+    assert sinks["second"].delivered == [transaction.id]
+    assert all(r.delivered_at is not None for r in session.query(NotificationOutbox))
+
+
+class SlowSink(RecordingSink):
+    def funds_transfered(self, notification):
+        time.sleep(0.2)
+        super().funds_transfered(notification)
+
+
+def test_rows_the_lease_cannot_cover_are_left_for_the_next_claim(
+    session, sinks, monkeypatch
+):
+    monkeypatch.setattr(outbox, "OUTBOX_SINK_CONCURRENCY", 1)
+    monkeypatch.setattr(outbox, "OUTBOX_DELIVERY_TIMEOUT", 0.3)
+    monkeypatch.setattr(outbox, "OUTBOX_LEASE", 0.4)
+    slow = SlowSink()
+    transactions = _completed_transactions(session, 3)
+    enqueue_funds_transferred(session, [t.id for t in transactions])
+    session.commit()
+    expired = outbox.outbox_stats["lease_expired"]
+
+    assert dispatch_outbox(session, {"first": slow}) == 1
+
+    rows = session.query(NotificationOutbox).filter_by(sink="first").all()
+    [delivered] = [r for r in rows if r.delivered_at is not None]
+    assert slow.delivered == [delivered.funding_transaction_id]
+    # Never attempted, so due again once the lease is up
+    left = [r for r in rows if r.delivered_at is None]
+    assert len(left) == 2
+    assert all(r.attempts == 0 and r.last_error is None for r in left)
+    assert outbox.outbox_stats["lease_expired"] == expired + 2
+
+
+def test_results_are_not_recorded_over_another_claim(session, sinks):
+    [transaction] = _completed_transactions(session, 1)
+    enqueue_funds_transferred(session, [transaction.id])
+    session.commit()
+    [first, second] = outbox.claim_batch(session, ["first", "second"])
+    lease_until = first.next_attempt_at
+    # The lease ran out and another dispatcher claimed the second row
+    session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id == second.id)
+        .values(next_attempt_at=lease_until + timedelta(seconds=60))
+    )
+
+    outbox._record(
+        session,
+        {first.id: None, second.id: "timed out"},
+        {first.id: 1, second.id: 1},
+        lease_until,
+    )
+    session.commit()
+
+    session.expire_all()
+    assert first.delivered_at is not None
+    assert second.attempts == 0
+    assert second.last_error is None
+
+
+def test_dispatch_gives_up_after_max_attempts(session, sinks, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_DELAY", 0)
+    [transaction] = _completed_transactions(session, 1)
+    sinks["first"].failures = 5
+    enqueue_funds_transferred(session, [transaction.id])
+    session.commit()
+
+    dispatch_outbox(session)
+    dispatch_outbox(session)
+    dispatch_outbox(session)
+
+    row = session.query(NotificationOutbox).filter_by(sink="first").one()
+    assert row.attempts == 2
+    assert row.delivered_at is None
+    assert sinks["first"].failures == 3
+
+
+class WebhookStandIn(BaseHTTPRequestHandler):
+    received = []
+    status = 200
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        type(self).received.append(json.loads(body))
+        self.send_response(type(self).status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def webhook_url():
+    WebhookStandIn.received = []
+    WebhookStandIn.status = 200
+    server = HTTPServer(("127.0.0.1", 0), WebhookStandIn)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/hooks/transfers"
+    server.shutdown()
+    server.server_close()
+
+
+def test_webhook_sink(session, monkeypatch, webhook_url):
+    monkeypatch.setattr(
+        outbox,
+        "notification_sinks",
+        {"webhook": WebhookNotificationService(webhook_url)},
+    )
+    [transaction] = _completed_transactions(session, 1)
+    enqueue_funds_transferred(session, [transaction.id])
+    session.commit()
+
+    WebhookStandIn.status = 503
+    assert dispatch_outbox(session) == 0
+    assert session.query(NotificationOutbox).one().attempts == 1
+
+    WebhookStandIn.status = 204
+    session.execute(update(NotificationOutbox).values(next_attempt_at=datetime.now()))
+    session.commit()
+    assert dispatch_outbox(session) == 1
+
+    assert len(WebhookStandIn.received) == 2
+    assert WebhookStandIn.received[-1] == {
+        "event": "funds_transferred",
+        "notification_id": session.query(NotificationOutbox).one().id,
+        "funding_transaction_id": transaction.id,
+        "amount": "100.00",
+        "currency": "USD",
+        "investor_account": "1234",
+        "fund_account": "4321",
+    }
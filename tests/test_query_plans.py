@@ -0,0 +1,95 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+from money_movement.models import (
+    FundDepositTransaction,
+    FundingTransaction,
+    SingleTransferState,
+    TransactionState,
+    WithdrawalTransaction,
+)
+from money_movement.listing import encode_cursor, transfers_page_query
+from money_movement.sweeper import pending_transfers_query
+
+
+def query_plan(engine, stmt) -> str:
+    compiled = stmt.compile(
+        dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+    )
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+    return "\n".join(row[-1] for row in rows)
+
+
+def test_deposit_sweeper_query_uses_state_index(engine, tables):
+    plan = query_plan(
+        engine,
+        pending_transfers_query(
+            FundDepositTransaction, after=(datetime.now(), 1), limit=500
+        ),
+    )
+    assert "ix_deposit_transaction_state_modified" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_withdrawal_sweeper_query_uses_state_index(engine, tables):
+    plan = query_plan(
+        engine,
+        pending_transfers_query(
+            WithdrawalTransaction, after=(datetime.now(), 1), limit=500
+        ),
+    )
+    assert "ix_withdrawal_transaction_state_modified" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_investor_transfers_query_uses_index(engine, tables):
+    plan = query_plan(
+        engine,
+        select(FundingTransaction.id)
+        .where(FundingTransaction.investor_account_id == 1)
+        .order_by(FundingTransaction.created.desc())
+        .limit(50),
+    )
+    assert "ix_funding_transaction_investor_created" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_transfer_pages_use_keyset_indexes(engine, tables):
+    for owner_column, index in [
+        (
+            FundingTransaction.investor_account_id,
+            "ix_funding_transaction_investor_created",
+        ),
+        (FundingTransaction.fund_account_id, "ix_funding_transaction_fund_created"),
+    ]:
+        plan = query_plan(
+            engine,
+            transfers_page_query(
+                owner_column, 1, limit=50, cursor=encode_cursor(datetime.now(), 10)
+            ),
+        )
+        assert index in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_fund_transfers_by_state_query_uses_index(engine, tables):
+    plan = query_plan(
+        engine,
+        select(FundingTransaction.id).where(
+            FundingTransaction.fund_account_id == 1,
+            FundingTransaction.state == TransactionState.WITHDRAWAL_COMPLETED,
+        ),
+    )
+    assert "ix_funding_transaction_fund_state" in plan
+
+
+def test_pending_withdrawals_query_uses_index(engine, tables):
+    plan = query_plan(
+        engine,
+        select(WithdrawalTransaction.id)
+        .where(WithdrawalTransaction.state == SingleTransferState.TRANSFER_PENDING)
+        .order_by(WithdrawalTransaction.modified),
+    )
+    assert "ix_withdrawal_transaction_state_modified" in plan
@@ -0,0 +1,312 @@
+from datetime import datetime, timedelta
+
+import pytest
+from moneyed import Money
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from money_movement import db, tasks
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    ProviderLimit,
+    ProviderPermit,
+    TransactionState,
+)
+from money_movement.ratelimit import (
+    ProviderLimiter,
+    RateLimitedFundAccountsService,
+    RateLimitedInvestorAccountsService,
+    provider_limits_query,
+    rate_limit_stats,
+)
+from money_movement.services.errors import ProviderThrottled
+from money_movement.services.fund_accounts import (
+    DepositState,
+    MockFundAccountsService,
+)
+from money_movement.services.investor_accounts import MockInvestorAccountsService
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2024, 1, 1)
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(autouse=True)
+def clear_rate_limit_stats():
+    rate_limit_stats.clear()
+
+
+def _limiter(session_factory, clock, **options):
+    return ProviderLimiter(
+        "bank",
+        session_factory=session_factory,
+        clock=clock,
+        sleep=clock.sleep,
+        **options,
+    )
+
+
+def _limit(session, provider="bank") -> ProviderLimit:
+    return session.get(ProviderLimit, provider, populate_existing=True)
+
+
+def test_token_bucket_spaces_out_calls(session_factory, clock):
+    limiter = _limiter(session_factory, clock, rate=2, burst=2)
+
+    for _ in range(3):
+        limiter.release(limiter.acquire())
+
+    # The burst goes out at once, then calls wait for the bucket to refill
+    assert clock.sleeps == [0.5]
+    assert rate_limit_stats["permits"] == 3
+    assert rate_limit_stats["waits"] == 1
+
+
+def test_concurrency_limit_is_shared(session_factory, clock, session):
+    # Two limiters for the same provider, as in two worker processes
+    first = _limiter(session_factory, clock, initial_concurrency=2)
+    second = _limiter(session_factory, clock, initial_concurrency=2, permit_timeout=1)
+    held = [first.acquire(), first.acquire()]
+
+    with pytest.raises(ProviderThrottled, match="No bank permit"):
+        second.acquire()
+
+    first.release(held[0])
+    assert second.acquire() not in held
+    assert rate_limit_stats["timeouts"] == 1
+
+
+def test_concurrency_limit_adapts(session_factory, clock, session):
+    limiter = _limiter(session_factory, clock, initial_concurrency=4, target_latency=1)
+
+    limiter.release(limiter.acquire(), latency=0.1)
+    assert _limit(session).concurrency_limit == 4.25
+
+    limiter.release(limiter.acquire(), latency=2)
+    assert _limit(session).concurrency_limit == pytest.approx(4.25 * 0.9)
+
+    limiter.release(limiter.acquire(), throttled=True, retry_after=3)
+    limit = _limit(session)
+    assert limit.concurrency_limit == pytest.approx(4.25 * 0.9 * 0.5)
+    # Nobody calls the provider again until its delay has passed
+    assert limit.tokens == -30
+
+    limiter.release(limiter.acquire(), latency=None)
+    assert clock.sleeps == [pytest.approx(3.1)]
+    assert rate_limit_stats["slow_calls"] == 1
+    assert rate_limit_stats["throttled"] == 1
+
+
+def test_lost_updates_count_a_call_once(session_factory, clock, session):
+    limiter = _limiter(session_factory, clock, initial_concurrency=4)
+    permit_id = limiter.acquire()
+    cas = limiter._cas
+    lost = []
+
+    def contended(session, limit, **values):
+        # Another worker changes the row before the first update lands
+        if not lost:
+            lost.append(True)
+            return False
+        return cas(session, limit, **values)
+
+    limiter._cas = contended
+    limiter.release(permit_id, throttled=True)
+
+    assert lost
+    assert rate_limit_stats["throttled"] == 1
+    assert _limit(session).concurrency_limit == 2
+
+
+def test_concurrency_limit_stays_within_bounds(session_factory, clock, session):
+    limiter = _limiter(
+        session_factory,
+        clock,
+        min_concurrency=2,
+        initial_concurrency=2,
+        max_concurrency=2.5,
+    )
+
+    limiter.release(limiter.acquire(), throttled=True)
+    assert _limit(session).concurrency_limit == 2
+
+    for _ in range(3):
+        limiter.release(limiter.acquire(), latency=0)
+    assert _limit(session).concurrency_limit == 2.5
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        ProviderLimiter("bank", rate=0)
+    with pytest.raises(ValueError):
+        ProviderLimiter("bank", min_concurrency=8, initial_concurrency=4)
+
+
+def test_throttled_calls_are_retried(session_factory, clock, session):
+    limiter = _limiter(session_factory, clock, throttle_retries=1)
+    responses = [ProviderThrottled(retry_after=2), "ok"]
+
+    def call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert limiter.call(call) == "ok"
+    assert clock.sleeps == [pytest.approx(2.1)]
+
+    responses = [ProviderThrottled(), ProviderThrottled()]
+    with pytest.raises(ProviderThrottled):
+        limiter.call(call)
+    assert session.scalar(select(func.count()).select_from(ProviderPermit)) == 0
+
+
+def test_errors_give_back_the_permit(session_factory, clock, session):
+    limiter = _limiter(session_factory, clock)
+
+    def call():
+        raise ValueError("Account not found")
+
+    with pytest.raises(ValueError):
+        limiter.call(call)
+
+    assert session.scalar(select(func.count()).select_from(ProviderPermit)) == 0
+    assert _limit(session).concurrency_limit == limiter.initial_concurrency
+
+
+def test_failed_release_keeps_the_result(session_factory, clock, session, monkeypatch):
+    limiter = _limiter(session_factory, clock)
+
+    def locked(*args, **kwargs):
+        raise OperationalError("DELETE", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(limiter, "release", locked)
+
+    assert limiter.call(lambda: "withdrawal-1") == "withdrawal-1"
+    assert rate_limit_stats["release_errors"] == 1
+
+
+def test_expired_permits_are_reclaimed(session_factory, clock, session):
+    limiter = _limiter(
+        session_factory,
+        clock,
+        initial_concurrency=1,
+        permit_lease=10,
+        permit_timeout=1,
+    )
+    # Never released, as if the worker died mid-call
+    limiter.acquire()
+    with pytest.raises(ProviderThrottled):
+        limiter.acquire()
+
+    clock.now += timedelta(seconds=10)
+    limiter.acquire()
+
+    assert rate_limit_stats["reclaimed"] == 1
+
+
+def test_rate_limited_service(session_factory, clock, session):
+    service = RateLimitedInvestorAccountsService(
+        MockInvestorAccountsService(accounts={"1234": 1000}),
+        _limiter(session_factory, clock),
+    )
+
+    withdrawal = service.withdraw_funds("1234", Money(100, "USD"))
+
+    assert service.check_balance("1234") == Money(900, "USD")
+    assert service.withdrawal_status_many([withdrawal.get_withdrawal_id()])
+    assert rate_limit_stats["permits"] == 3
+    rows = session.execute(provider_limits_query()).all()
+    assert [(row.provider, row.in_flight) for row in rows] == [("bank", 0)]
+
+
+def test_rate_limited_service_passes_arguments_by_name(session_factory, clock):
+    # The mock takes deposit_status's arguments in the opposite order
+    service = RateLimitedFundAccountsService(
+        MockFundAccountsService(), _limiter(session_factory, clock)
+    )
+    deposit = service.deposit_funds("4321", Money(100, "USD"))
+
+    state = service.deposit_status(
+        deposit_id=deposit.get_deposit_id(), account_id="4321"
+    )
+
+    assert state == DepositState.CREATED
+
+
+@pytest.fixture
+def file_session_factory(tmp_path, monkeypatch):
+    # A short busy timeout, so a task waiting on its own write lock fails fast
+    monkeypatch.setattr(db, "SQLITE_BUSY_TIMEOUT_MS", 200)
+    engine = db.create_engine_from_url(f"sqlite:///{tmp_path}/workflow.db")
+    db.init_db(engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(db, "Session", factory)
+    monkeypatch.setattr(tasks, "Session", factory)
+    yield factory
+    engine.dispose()
+
+
+def test_workflow_through_the_default_rate_limited_services(
+    file_session_factory, monkeypatch
+):
+    investor_service = MockInvestorAccountsService(accounts={"1234": 1000})
+    fund_service = MockFundAccountsService()
+    # The tasks' own rate limited services, in front of fresh mocks
+    monkeypatch.setattr(tasks.investor_account_service, "service", investor_service)
+    monkeypatch.setattr(tasks.fund_account_service, "service", fund_service)
+    monkeypatch.setattr(tasks.app.conf, "task_always_eager", True)
+    monkeypatch.setattr(tasks.app.conf, "task_eager_propagates", True)
+    with file_session_factory() as session:
+        # No cached balance, so admission calls the provider
+        transaction = FundingTransaction(
+            investor_account=InvestorAccount(external_account_uid="1234"),
+            fund_account=FundAccount(external_account_uid="4321"),
+            amount_minor=100_00,
+            state=TransactionState.INITIATED,
+        )
+        session.add(transaction)
+        session.commit()
+        transaction_id = transaction.id
+
+    tasks.process_withdrawal.apply((transaction_id,))
+    with file_session_factory() as session:
+        withdrawal_id = session.get(
+            FundingTransaction, transaction_id
+        ).withdrawal_transaction.external_transaction_uid
+    investor_service._complete_withdrawal(withdrawal_id)
+    tasks.sweep_pending_transactions.apply()
+    with file_session_factory() as session:
+        deposit_id = session.get(
+            FundingTransaction, transaction_id
+        ).deposit_transaction.external_transaction_uid
+    fund_service._complete_deposit("4321", deposit_id)
+    tasks.sweep_pending_transactions.apply()
+
+    with file_session_factory() as session:
+        transaction = session.get(FundingTransaction, transaction_id)
+        assert transaction.state == TransactionState.DEPOSIT_COMPLETED
+        assert transaction.retries == 0
+        assert set(session.scalars(select(ProviderLimit.provider))) == {
+            "investor_accounts",
+            "fund_accounts",
+        }
+        assert session.scalar(select(func.count()).select_from(ProviderPermit)) == 0
+    assert investor_service.check_balance("1234") == Money(900, "USD")
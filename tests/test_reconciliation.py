@@ -0,0 +1,159 @@
+import io
+import json
+from decimal import Decimal
+from itertools import count, islice
+
+import pytest
+from moneyed import Money
+
+from money_movement.models import (
+    InvestorAccount,
+    SingleTransferState,
+    WithdrawalTransaction,
+)
+from money_movement.reconciliation import (
+    DiscrepancyKind,
+    RecordEntry,
+    reconcile,
+    reconcile_statement,
+)
+from money_movement.services.fund_accounts import MockFundAccountsService
+from money_movement.services.investor_accounts import MockInvestorAccountsService
+from money_movement.services.statements import StatementEntry, read_statement
+
+
+def _entry(transaction_id, amount):
+    return StatementEntry(transaction_id, "1234", Decimal(amount), "USD", "COMPLETED")
+
+
+def test_reconcile_reports_every_kind_of_discrepancy():
+    records = [
+        RecordEntry("A", 1, 100_00),
+        RecordEntry("B", 2, 100_00),
+        RecordEntry("C", 3, 100_00),
+        RecordEntry("C", 4, 100_00),
+        RecordEntry("E", 5, 100_00),
+        RecordEntry("F", 6, 100_00),
+    ]
+    statement = [
+        _entry("A", "100.00"),
+        _entry("B", "90"),
+        _entry("C", "200"),
+        _entry("D", "50"),
+        _entry("E", "100"),
+        _entry("E", "100"),
+    ]
+
+    results = list(reconcile(records, statement))
+
+    assert results.count(None) == 1
+    assert [
+        (d.kind, d.transaction_id, d.record_ids) for d in results if d is not None
+    ] == [
+        (DiscrepancyKind.AMOUNT_MISMATCH, "B", [2]),
+        (DiscrepancyKind.DUPLICATE_IN_RECORDS, "C", [3, 4]),
+        (DiscrepancyKind.MISSING_FROM_RECORDS, "D", []),
+        (DiscrepancyKind.DUPLICATE_IN_STATEMENT, "E", [5]),
+        (DiscrepancyKind.MISSING_FROM_STATEMENT, "F", [6]),
+    ]
+
+
+def test_reconcile_leaves_out_failed_statement_entries():
+    records = [RecordEntry("A", 1, 100_00), RecordEntry("C", 3, 100_00)]
+    statement = [
+        _entry("A", "100"),
+        _entry("A", "100")._replace(status="FAILED"),
+        _entry("B", "100")._replace(status="FAILED"),
+        _entry("C", "100")._replace(status="FAILED"),
+    ]
+
+    results = list(reconcile(records, statement))
+
+    # A matches its one completed entry, and B was failed by the provider
+    # with no record on our side. We still count C, which the provider failed.
+    assert results[0] is None
+    assert [(d.kind, d.transaction_id) for d in results[1:]] == [
+        (DiscrepancyKind.STATUS_MISMATCH, "C")
+    ]
+    assert results[1].statement_amount_minor == 100_00
+
+
+def test_reconcile_requires_sorted_input():
+    with pytest.raises(ValueError, match="Statement is not sorted"):
+        list(reconcile([], [_entry("B", 1), _entry("A", 1)]))
+
+
+def test_reconcile_streams():
+    # Both sides are endless; results still come out as they are found
+    records = (RecordEntry(f"{i:012d}", i, 1_00) for i in count())
+    statement = (_entry(f"{i:012d}", 1 if i % 2 else 2) for i in count())
+
+    first = list(islice(reconcile(records, statement), 4))
+
+    assert [d and d.kind for d in first] == [
+        DiscrepancyKind.AMOUNT_MISMATCH,
+        None,
+        DiscrepancyKind.AMOUNT_MISMATCH,
+        None,
+    ]
+
+
+@pytest.mark.parametrize("format", ["csv", "ndjson"])
+def test_reconcile_withdrawal_statement(session, format):
+    service = MockInvestorAccountsService(accounts={"1234": 1000})
+    investor_account = InvestorAccount(external_account_uid="1234")
+    withdrawals = [service.withdraw_funds("1234", Money(100, "USD")) for _ in range(4)]
+    service._fail_withdrawal(withdrawals[3].get_withdrawal_id())
+    records = [
+        WithdrawalTransaction(
+            investor_account=investor_account,
+            external_transaction_uid=withdrawal.get_withdrawal_id(),
+            amount_minor=amount_minor,
+            state=SingleTransferState.TRANSFER_PENDING,
+        )
+        for withdrawal, amount_minor in zip(withdrawals[:2], [100_00, 150_00])
+    ]
+    # Our record of the failed withdrawal is left out too
+    records.append(
+        WithdrawalTransaction(
+            investor_account=investor_account,
+            external_transaction_uid=withdrawals[3].get_withdrawal_id(),
+            amount_minor=100_00,
+            state=SingleTransferState.FAILED,
+        )
+    )
+    session.add_all(records)
+    session.commit()
+    statement = io.StringIO()
+    service.write_statement(statement, format)
+    statement.seek(0)
+    output = io.StringIO()
+
+    counts = reconcile_statement(
+        session, WithdrawalTransaction, statement, output, format
+    )
+
+    assert counts == {"matched": 1, "amount_mismatch": 1, "missing_from_records": 1}
+    discrepancies = {
+        d["kind"]: d for d in map(json.loads, output.getvalue().splitlines())
+    }
+    assert discrepancies["amount_mismatch"]["record_ids"] == [records[1].id]
+    assert discrepancies["amount_mismatch"]["statement_amount_minor"] == 100_00
+    assert (
+        discrepancies["missing_from_records"]["transaction_id"]
+        == withdrawals[2].get_withdrawal_id()
+    )
+
+
+def test_fund_statement_round_trip():
+    service = MockFundAccountsService()
+    deposits = [service.deposit_funds("4321", Money(n, "USD")) for n in (10, 20)]
+    statement = io.StringIO()
+
+    service.write_statement(statement, "ndjson")
+    statement.seek(0)
+
+    assert list(read_statement(statement, "ndjson")) == sorted(
+        StatementEntry(d.get_deposit_id(), "4321", d.amount.amount, "USD", "CREATED")
+        for d in deposits
+    )
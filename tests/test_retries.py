@@ -0,0 +1,102 @@
+import sqlite3
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    TransactionState,
+)
+from money_movement.retries import (
+    is_transient,
+    retry_countdown,
+    retry_stats,
+    spend_retry,
+)
+from money_movement.services.errors import (
+    ProviderThrottled,
+    TerminalProviderError,
+    TransientProviderError,
+)
+
+
+def test_is_transient():
+    assert is_transient(TransientProviderError())
+    assert is_transient(ProviderThrottled())
+    assert is_transient(ConnectionResetError())
+    assert is_transient(TimeoutError())
+    assert is_transient(
+        OperationalError(
+            "SELECT 1", {}, Exception("gone away"), connection_invalidated=True
+        )
+    )
+    assert is_transient(
+        OperationalError("UPDATE t", {}, Exception("database is locked"))
+    )
+    assert not is_transient(
+        OperationalError("SELEC 1", {}, Exception('near "SELEC": syntax error'))
+    )
+    assert not is_transient(TerminalProviderError())
+    assert not is_transient(ValueError("Insufficient funds"))
+
+
+def test_sqlite_lock_errors_are_transient(tmp_path):
+    path = tmp_path / "locked.db"
+    holder = sqlite3.connect(path)
+    holder.execute("CREATE TABLE t (x)")
+    holder.execute("BEGIN EXCLUSIVE")
+    waiter = sqlite3.connect(path, timeout=0)
+    with pytest.raises(sqlite3.OperationalError) as locked:
+        waiter.execute("SELECT * FROM t")
+    with pytest.raises(sqlite3.OperationalError) as bad_sql:
+        holder.execute("SELECT * FROM missing")
+    holder.close()
+    waiter.close()
+
+    assert is_transient(OperationalError("SELECT", {}, locked.value))
+    assert not is_transient(OperationalError("SELECT", {}, bad_sql.value))
+
+
+@pytest.mark.parametrize("retries", [0, 1, 5, 20])
+def test_retry_countdown_is_jittered_up_to_a_capped_bound(retries):
+    bound = min(300, 2 * 2**retries)
+    assert retry_countdown(retries, rng=lambda: 0.0, base_delay=2, max_delay=300) == 0
+    assert (
+        retry_countdown(retries, rng=lambda: 0.5, base_delay=2, max_delay=300)
+        == bound / 2
+    )
+    assert (
+        retry_countdown(retries, rng=lambda: 1.0, base_delay=2, max_delay=300) == bound
+    )
+
+
+def test_retry_countdown_waits_at_least_retry_after():
+    throttled = ProviderThrottled(retry_after=30)
+    assert retry_countdown(0, throttled, rng=lambda: 1.0, base_delay=2) == 30
+    assert (
+        retry_countdown(10, throttled, rng=lambda: 1.0, base_delay=2, max_delay=300)
+        == 300
+    )
+
+
+def test_spend_retry_counts_against_the_budget(session):
+    transaction = FundingTransaction(
+        investor_account=InvestorAccount(external_account_uid="1234"),
+        fund_account=FundAccount(external_account_uid="4321"),
+        amount_minor=100_00,
+        state=TransactionState.INITIATED,
+    )
+    session.add(transaction)
+    session.commit()
+    retried, exhausted = retry_stats["retried"], retry_stats["exhausted"]
+    criteria = FundingTransaction.id == transaction.id
+
+    assert spend_retry(session, criteria, budget=2) == 1
+    assert spend_retry(session, criteria, budget=2) == 2
+    assert spend_retry(session, criteria, budget=2) is None
+
+    session.refresh(transaction)
+    assert transaction.retries == 3
+    assert retry_stats["retried"] - retried == 2
+    assert retry_stats["exhausted"] - exhausted == 1
@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from money_movement.db import create_engine_from_url, init_db
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    FundSeatShard,
+    InvestorAccount,
+    SeatReservation,
+    TransactionState,
+)
+from money_movement.seats import (
+    release_seat,
+    reserve_seat,
+    seat_usage,
+    shard_capacities,
+)
+
+
+def _fund_with_transactions(session, seats, transactions):
+    fund_account = FundAccount(external_account_uid="4321", seat_availability=seats)
+    investor_account = InvestorAccount(external_account_uid="1234")
+    funding_transactions = [
+        FundingTransaction(
+            investor_account=investor_account,
+            fund_account=fund_account,
+            amount_minor=100_00,
+            state=TransactionState.INITIATED,
+        )
+        for _ in range(transactions)
+    ]
+    session.add_all(funding_transactions)
+    session.commit()
+    return fund_account, [t.id for t in funding_transactions]
+
+
+def test_shard_capacities():
+    assert shard_capacities(10, shards=4) == [3, 3, 2, 2]
+    assert shard_capacities(3, shards=8) == [1, 1, 1]
+    assert shard_capacities(0, shards=8) == [0]
+
+
+def test_reserve_and_release_seat(session):
+    fund_account, [first, second, third] = _fund_with_transactions(session, 2, 3)
+
+    assert reserve_seat(session, fund_account, first)
+    assert reserve_seat(session, fund_account, second)
+    assert not reserve_seat(session, fund_account, third)
+    session.commit()
+    assert seat_usage(session, fund_account.id) == (2, 2)
+
+    assert release_seat(session, first)
+    assert not release_seat(session, first)
+    session.commit()
+    assert seat_usage(session, fund_account.id) == (1, 2)
+    assert reserve_seat(session, fund_account, third)
+
+
+def test_unlimited_fund_never_full(session):
+    fund_account, [transaction_id] = _fund_with_transactions(session, None, 1)
+    assert reserve_seat(session, fund_account, transaction_id)
+    assert session.scalar(select(func.count()).select_from(SeatReservation)) == 0
+
+
+def test_failed_transaction_releases_seat(session):
+    fund_account, [transaction_id] = _fund_with_transactions(session, 1, 1)
+    reserve_seat(session, fund_account, transaction_id)
+    session.commit()
+
+    transaction = session.get(FundingTransaction, transaction_id)
+    transaction.transition_cas(session, TransactionState.FAILED)
+    session.commit()
+
+    assert seat_usage(session, fund_account.id) == (0, 1)
+
+
+@pytest.fixture
+def file_session_factory(tmp_path):
+    engine = create_engine_from_url(f"sqlite:///{tmp_path}/seats.db")
+    init_db(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def test_concurrent_reservations_never_overbook(file_session_factory):
+    seats = 50
+    with file_session_factory() as session:
+        fund_account, transaction_ids = _fund_with_transactions(session, seats, 300)
+        fund_account = session.get(FundAccount, fund_account.id)
+    # fund_account is detached with its columns loaded, workers only read them
+
+    def reserve(transaction_id):
+        with file_session_factory() as session:
+            reserved = reserve_seat(session, fund_account, transaction_id)
+            session.commit()
+            return reserved
+
+    def release(transaction_id):
+        with file_session_factory() as session:
+            released = release_seat(session, transaction_id)
+            session.commit()
+            return released
+
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        reserved = list(pool.map(reserve, transaction_ids[:200]))
+    assert reserved.count(True) == seats
+
+    # Releases race with new reservations, so late ones may find the fund
+    # full, but the counters must always match the reservations held
+    winners = [t for t, won in zip(transaction_ids, reserved) if won]
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        released = pool.map(release, winners[:20])
+        late = pool.map(reserve, transaction_ids[200:])
+        assert all(released)
+        late_reserved = list(late).count(True)
+    assert late_reserved <= 20
+
+    with file_session_factory() as session:
+        expected = seats - 20 + late_reserved
+        assert seat_usage(session, fund_account.id) == (expected, seats)
+        shards = session.scalars(select(FundSeatShard)).all()
+        assert all(0 <= shard.reserved <= shard.capacity for shard in shards)
+        held = session.scalar(
+            select(func.count())
+            .select_from(SeatReservation)
+            .where(SeatReservation.released.is_(False))
+        )
+        assert held == expected
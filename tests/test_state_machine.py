@@ -40,3 +40,94 @@ class TestGenericStateMachine:
         # Try to transition to an invalid state
         with pytest.raises(ValueError):
             state_machine.transition(SampleState.INITIATED)
+
+    def test_compiled_tables(self):
+        assert SampleStateMachine.states == frozenset(SampleState)
+        assert SampleStateMachine.terminal_states == {
+            SampleState.COMPLETED,
+            SampleState.FAILED,
+        }
+        assert SampleStateMachine.reachable_states[SampleState.INITIATED] == {
+            SampleState.COMPLETED,
+            SampleState.FAILED,
+        }
+        assert SampleStateMachine.reachable_states[SampleState.FAILED] == frozenset()
+        assert SampleStateMachine(SampleState.COMPLETED).is_terminal()
+        assert not SampleStateMachine().is_terminal()
+
+    def test_rejects_unknown_state(self):
+        class OtherState(Enum):
+            OTHER = 1
+
+        state_machine = SampleStateMachine()
+        assert not state_machine.can_transition(OtherState.OTHER)
+        with pytest.raises(ValueError, match="Unknown state"):
+            state_machine.transition(OtherState.OTHER)
+
+    def test_rejects_unknown_target_at_class_creation(self):
+        class OtherState(Enum):
+            OTHER = 1
+
+        with pytest.raises(ValueError, match="unknown state"):
+
+            class Broken(GenericStateMachine[SampleState]):
+                transitions = {
+                    SampleState.INITIATED: [OtherState.OTHER],
+                    SampleState.COMPLETED: [],
+                    SampleState.FAILED: [],
+                }
+
+    def test_rejects_undeclared_state_at_class_creation(self):
+        with pytest.raises(ValueError, match="no transitions for"):
+
+            class Broken(GenericStateMachine[SampleState]):
+                transitions = {
+                    SampleState.INITIATED: [SampleState.COMPLETED],
+                    SampleState.COMPLETED: [],
+                }
+
+    def test_rejects_unreachable_state_at_class_creation(self):
+        with pytest.raises(ValueError, match="unreachable"):
+
+            class Broken(GenericStateMachine[SampleState]):
+                transitions = {
+                    SampleState.INITIATED: [SampleState.COMPLETED],
+                    SampleState.COMPLETED: [],
+                    SampleState.FAILED: [],
+                }
+
+    def test_transition_hooks(self):
+        class HookedStateMachine(SampleStateMachine):
+            pass
+
+        class HookedChild(HookedStateMachine):
+            pass
+
+        calls = []
+        HookedStateMachine.add_pre_transition_hook(
+            lambda machine, old, new: calls.append(("pre", machine.state, new))
+        )
+        HookedStateMachine.add_post_transition_hook(
+            lambda machine, old, new: calls.append(("post", old, machine.state))
+        )
+
+        HookedChild().transition(SampleState.COMPLETED)
+        assert calls == [
+            ("pre", SampleState.INITIATED, SampleState.COMPLETED),
+            ("post", SampleState.INITIATED, SampleState.COMPLETED),
+        ]
+        assert SampleStateMachine.pre_transition_hooks == ()
+        assert SampleStateMachine.post_transition_hooks == ()
+
+    def test_pre_transition_hook_can_veto(self):
+        class VetoedStateMachine(SampleStateMachine):
+            pass
+
+        def veto(machine, old, new):
+            raise ValueError("vetoed")
+
+        VetoedStateMachine.add_pre_transition_hook(veto)
+        state_machine = VetoedStateMachine()
+        with pytest.raises(ValueError, match="vetoed"):
+            state_machine.transition(SampleState.COMPLETED)
+        assert state_machine.get_state() == SampleState.INITIATED
@@ -0,0 +1,121 @@
+from sqlalchemy import insert, update
+
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    FundStateSummary,
+    InvestorAccount,
+    TransactionState,
+)
+from money_movement.summary import (
+    SummaryMismatch,
+    check_summary,
+    rebuild_summary,
+    record_new_transfers,
+)
+
+
+def _summary(session, fund_account):
+    session.expire_all()
+    return {
+        row.state: (row.transfer_count, row.amount_minor)
+        for row in session.query(FundStateSummary).filter_by(
+            fund_account_id=fund_account.id
+        )
+        if row.transfer_count
+    }
+
+
+def _transfers(session, *amounts):
+    investor_account = InvestorAccount(external_account_uid="1234")
+    fund_account = FundAccount(external_account_uid="4321")
+    transactions = [
+        FundingTransaction(
+            investor_account=investor_account,
+            fund_account=fund_account,
+            amount_minor=amount_minor,
+        )
+        for amount_minor in amounts
+    ]
+    session.add_all(transactions)
+    session.commit()
+    return fund_account, transactions
+
+
+def test_new_transfers_and_transitions_are_summarized(session):
+    fund_account, (first, second, third) = _transfers(session, 100_00, 200_00, 50_00)
+
+    assert _summary(session, fund_account) == {TransactionState.INITIATED: (3, 350_00)}
+
+    first.transition_cas(session, TransactionState.WITHDRAWAL_PENDING)
+    FundingTransaction.transition_where(
+        session,
+        TransactionState.INITIATED,
+        TransactionState.FAILED,
+        FundingTransaction.id == second.id,
+    )
+    session.commit()
+
+    assert _summary(session, fund_account) == {
+        TransactionState.INITIATED: (1, 50_00),
+        TransactionState.WITHDRAWAL_PENDING: (1, 100_00),
+        TransactionState.FAILED: (1, 200_00),
+    }
+    assert check_summary(session) == []
+
+
+def test_rolled_back_changes_are_not_summarized(session):
+    fund_account, (transaction,) = _transfers(session, 100_00)
+
+    transaction.transition_cas(session, TransactionState.FAILED)
+    session.add(
+        FundingTransaction(
+            investor_account=transaction.investor_account,
+            fund_account=fund_account,
+            amount_minor=1_00,
+        )
+    )
+    session.flush()
+    session.rollback()
+    session.commit()
+
+    assert _summary(session, fund_account) == {TransactionState.INITIATED: (1, 100_00)}
+
+
+def test_bulk_inserted_transfers_are_recorded(session):
+    fund_account, (transaction,) = _transfers(session, 100_00)
+
+    ids = session.scalars(
+        insert(FundingTransaction).returning(FundingTransaction.id),
+        [
+            {
+                "investor_account_id": transaction.investor_account_id,
+                "fund_account_id": fund_account.id,
+                "amount_minor": 25_00,
+                "state": TransactionState.INITIATED,
+            }
+        ]
+        * 2,
+    ).all()
+    record_new_transfers(session, [(id, TransactionState.INITIATED) for id in ids])
+    session.commit()
+
+    assert _summary(session, fund_account) == {TransactionState.INITIATED: (3, 150_00)}
+
+
+def test_check_and_rebuild(session):
+    fund_account, _ = _transfers(session, 100_00, 100_00)
+    session.execute(update(FundStateSummary).values(transfer_count=5))
+    session.commit()
+
+    assert check_summary(session) == [
+        SummaryMismatch(
+            fund_account.id, TransactionState.INITIATED, "USD", (2, 200_00), (5, 200_00)
+        )
+    ]
+
+    rebuild_summary(session)
+    session.commit()
+
+    assert check_summary(session) == []
+    assert _summary(session, fund_account) == {TransactionState.INITIATED: (2, 200_00)}
@@ -0,0 +1,204 @@
+from datetime import datetime, timedelta
+from moneyed import Money
+from money_movement.models import (
+    FundAccount,
+    FundDepositTransaction,
+    FundingTransaction,
+    InvestorAccount,
+    NotificationOutbox,
+    SingleTransferState,
+    TransactionState,
+    WithdrawalTransaction,
+)
+from money_movement.services.fund_accounts import MockFundAccountsService
+from money_movement.services.investor_accounts import MockInvestorAccountsService
+from money_movement.sweeper import (
+    funds_ready_for_deposit,
+    stalled_deposit_batches,
+    stalled_withdrawal_batches,
+    sweep_deposits,
+    sweep_withdrawals,
+)
+
+
+def _pending_withdrawals(session, service, count):
+    investor_account = InvestorAccount(external_account_uid="1234")
+    fund_account = FundAccount(external_account_uid="4321")
+    transactions = []
+    for _ in range(count):
+        withdrawal = service.withdraw_funds("1234", Money(100, "USD"))
+        transactions.append(
+            FundingTransaction(
+                investor_account=investor_account,
+                fund_account=fund_account,
+                amount_minor=100_00,
+                state=TransactionState.WITHDRAWAL_PENDING,
+                withdrawal_transaction=WithdrawalTransaction(
+                    investor_account=investor_account,
+                    external_transaction_uid=withdrawal.get_withdrawal_id(),
+                    amount_minor=100_00,
+                    state=SingleTransferState.TRANSFER_PENDING,
+                ),
+            )
+        )
+    session.add_all(transactions)
+    session.commit()
+    return transactions
+
+
+def test_sweep_withdrawals(session):
+    service = MockInvestorAccountsService(accounts={"1234": 10_000})
+    completed, failed, pending = _pending_withdrawals(session, service, 3)
+    service._complete_withdrawal(
+        completed.withdrawal_transaction.external_transaction_uid
+    )
+    service._fail_withdrawal(failed.withdrawal_transaction.external_transaction_uid)
+
+    result = sweep_withdrawals(session, service, chunk_size=2)
+
+    assert result == [completed.id]
+    session.expire_all()
+    assert completed.state == TransactionState.WITHDRAWAL_COMPLETED
+    assert (
+        completed.withdrawal_transaction.state == SingleTransferState.TRANSFER_COMPLETED
+    )
+    assert failed.state == TransactionState.FAILED
+    assert failed.withdrawal_transaction.state == SingleTransferState.FAILED
+    assert pending.state == TransactionState.WITHDRAWAL_PENDING
+
+
+def test_sweep_withdrawals_pages_through_all_rows(session):
+    service = MockInvestorAccountsService(accounts={"1234": 10_000}, settlement_delay=0)
+    transactions = _pending_withdrawals(session, service, 5)
+
+    result = sweep_withdrawals(session, service, chunk_size=2)
+
+    assert sorted(result) == sorted(t.id for t in transactions)
+
+
+def test_sweep_withdrawals_moves_batches_together(session):
+    service = MockInvestorAccountsService(accounts={"1234": 10_000}, settlement_delay=0)
+    investor_account = InvestorAccount(external_account_uid="1234")
+    withdrawal = WithdrawalTransaction(
+        investor_account=investor_account,
+        external_transaction_uid=service.withdraw_funds(
+            "1234", Money(300, "USD")
+        ).get_withdrawal_id(),
+        amount_minor=300_00,
+        state=SingleTransferState.TRANSFER_PENDING,
+    )
+    transactions = [
+        FundingTransaction(
+            investor_account=investor_account,
+            fund_account=FundAccount(external_account_uid=f"fund-{i}"),
+            amount_minor=100_00,
+            state=TransactionState.WITHDRAWAL_PENDING,
+            withdrawal_transaction=withdrawal,
+        )
+        for i in range(3)
+    ]
+    session.add_all(transactions)
+    session.commit()
+
+    result = sweep_withdrawals(session, service)
+
+    assert sorted(result) == sorted(t.id for t in transactions)
+    session.expire_all()
+    assert withdrawal.state == SingleTransferState.TRANSFER_COMPLETED
+    assert all(t.state == TransactionState.WITHDRAWAL_COMPLETED for t in transactions)
+
+
+def test_sweep_deposits(session):
+    service = MockFundAccountsService(settlement_delay=0)
+    investor_account = InvestorAccount(external_account_uid="1234")
+    fund_account = FundAccount(external_account_uid="4321")
+    deposit = service.deposit_funds("4321", Money(100, "USD"))
+    transaction = FundingTransaction(
+        investor_account=investor_account,
+        fund_account=fund_account,
+        amount_minor=100_00,
+        state=TransactionState.DEPOSIT_PENDING,
+        deposit_transaction=FundDepositTransaction(
+            fund_account=fund_account,
+            external_transaction_uid=deposit.get_deposit_id(),
+            amount_minor=100_00,
+            state=SingleTransferState.TRANSFER_PENDING,
+        ),
+    )
+    session.add(transaction)
+    session.commit()
+
+    result = sweep_deposits(session, service)
+
+    assert result == [transaction.id]
+    [notification] = session.query(NotificationOutbox).all()
+    assert notification.funding_transaction_id == transaction.id
+    session.expire_all()
+    assert transaction.state == TransactionState.DEPOSIT_COMPLETED
+    assert (
+        transaction.deposit_transaction.state == SingleTransferState.TRANSFER_COMPLETED
+    )
+
+
+def test_funds_ready_for_deposit(session):
+    investor_account = InvestorAccount(external_account_uid="1234")
+    ready, waiting = FundAccount(), FundAccount()
+    session.add_all(
+        [
+            FundingTransaction(
+                investor_account=investor_account,
+                fund_account=fund_account,
+                amount_minor=100_00,
+                state=state,
+            )
+            for fund_account, state in [
+                (ready, TransactionState.WITHDRAWAL_COMPLETED),
+                (ready, TransactionState.WITHDRAWAL_COMPLETED),
+                (waiting, TransactionState.WITHDRAWAL_PENDING),
+            ]
+        ]
+    )
+    session.commit()
+
+    assert funds_ready_for_deposit(session) == [ready.id]
+
+
+def test_stalled_batches_are_found_for_resuming(session):
+    investor_account = InvestorAccount(external_account_uid="1234")
+    fund_account = FundAccount(external_account_uid="4321")
+    long_ago = datetime.now() - timedelta(hours=1)
+
+    def withdrawal(**kwargs):
+        return WithdrawalTransaction(
+            investor_account=investor_account, amount_minor=100_00, **kwargs
+        )
+
+    stalled = withdrawal(state=SingleTransferState.INITIATED, modified=long_ago)
+    recent = withdrawal(state=SingleTransferState.INITIATED)
+    sent = withdrawal(
+        state=SingleTransferState.INITIATED,
+        external_transaction_uid="w-1",
+        modified=long_ago,
+    )
+    unbatched = FundingTransaction(
+        investor_account=investor_account,
+        fund_account=fund_account,
+        amount_minor=100_00,
+        state=TransactionState.WITHDRAWAL_PENDING,
+        modified=long_ago,
+    )
+    deposit = FundDepositTransaction(
+        fund_account=fund_account,
+        amount_minor=100_00,
+        state=SingleTransferState.INITIATED,
+        modified=long_ago,
+    )
+    session.add_all([stalled, recent, sent, unbatched, deposit])
+    session.commit()
+
+    before = datetime.now() - timedelta(minutes=15)
+    assert stalled_withdrawal_batches(session, before) == [
+        (investor_account.id, stalled.id),
+        (investor_account.id, None),
+    ]
+    assert stalled_deposit_batches(session, before) == [(fund_account.id, deposit.id)]
@@ -1,11 +1,110 @@
 import pytest
+from moneyed import Money
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from money_movement import tasks
 from money_movement.models import (
+    BalanceHold,
     FundAccount,
+    FundDepositTransaction,
     FundingTransaction,
     InvestorAccount,
+    InvestorBalance,
+    NotificationOutbox,
+    SingleTransferState,
     TransactionState,
+    WithdrawalTransaction,
 )
-from money_movement.tasks import process_deposit, process_withdrawal
+from money_movement.retries import TRANSACTION_RETRY_BUDGET
+from money_movement.seats import seat_usage
+from money_movement.services.errors import TransientProviderError
+from money_movement.services.fund_accounts import MockFundAccountsService
+from money_movement.services.investor_accounts import MockInvestorAccountsService
+from money_movement.summary import check_summary
+from money_movement.tasks import (
+    complete_deposit,
+    complete_withdrawal,
+    deposit_fund_batch,
+    process_deposit,
+    process_withdrawal,
+    sweep_pending_transactions,
+    withdraw_investor_batch,
+)
+
+
+class RecordingCalls:
+    def __init__(self):
+        self.calls = []
+
+    def apply_async(self, args, countdown=None):
+        self.calls.append((args, countdown))
+
+    def delay(self, *args):
+        self.calls.append((args, None))
+
+
+@pytest.fixture
+def patched_tasks(monkeypatch, session_factory):
+    monkeypatch.setattr(tasks, "Session", session_factory)
+    monkeypatch.setattr(
+        tasks,
+        "investor_account_service",
+        MockInvestorAccountsService(accounts={"1234": 1000}),
+    )
+    monkeypatch.setattr(tasks, "fund_account_service", MockFundAccountsService())
+    # Tasks that aren't recorded run inline, retries included
+    monkeypatch.setattr(tasks.app.conf, "task_always_eager", True)
+    scheduled = {}
+    for name in (
+        "withdraw_investor_batch",
+        "complete_withdrawal",
+        "complete_deposit",
+    ):
+        scheduled[name] = RecordingCalls()
+        monkeypatch.setattr(tasks, name, scheduled[name])
+    return scheduled
+
+
+def _funding_transaction(session, state=TransactionState.INITIATED):
+    investor_account = InvestorAccount(external_account_uid="1234")
+    fund_account = FundAccount(external_account_uid="4321")
+    funding_transaction = FundingTransaction(
+        investor_account=investor_account,
+        fund_account=fund_account,
+        amount_minor=100_00,
+        state=state,
+    )
+    session.add(funding_transaction)
+    session.commit()
+    return funding_transaction
+
+
+def _withdraw(funding_transaction):
+    process_withdrawal(funding_transaction.id)
+    withdraw_investor_batch(funding_transaction.investor_account_id)
+
+
+def test_process_withdrawal_records_withdrawal(session, patched_tasks):
+    funding_transaction = _funding_transaction(session)
+
+    process_withdrawal(funding_transaction.id)
+
+    session.refresh(funding_transaction)
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+    assert funding_transaction.withdrawal_transaction is None
+    assert patched_tasks["withdraw_investor_batch"].calls == [
+        ((funding_transaction.investor_account_id,), tasks.WITHDRAWAL_BATCH_WINDOW)
+    ]
+
+    withdraw_investor_batch(funding_transaction.investor_account_id)
+
+    session.refresh(funding_transaction)
+    withdrawal = funding_transaction.withdrawal_transaction
+    assert withdrawal.state == SingleTransferState.TRANSFER_PENDING
+    assert withdrawal.external_transaction_uid is not None
+    assert withdrawal.amount_minor == 100_00
+    # Pending withdrawals are left for the sweeper
+    assert patched_tasks["complete_withdrawal"].calls == []
 
 
 @pytest.mark.skip(reason="Having trouble getting this working")
@@ -20,7 +119,7 @@ def test_process_withdrawal(session):
     funding_transaction = FundingTransaction(
         investor_account=investor_account,
         fund_account=fund_account,
-        amount=100,
+        amount_minor=100_00,
         state=TransactionState.INITIATED,
     )
     session.add(funding_transaction)
@@ -48,7 +147,7 @@ def test_process_deposit(session):
     funding_transaction = FundingTransaction(
         investor_account=investor_account,
         fund_account=fund_account,
-        amount=100,
+        amount_minor=100_00,
         state=TransactionState.WITHDRAWAL_COMPLETED,
     )
     session.add(funding_transaction)
@@ -59,3 +158,610 @@ def test_process_deposit(session):
     retrieved_transaction = session.query(FundingTransaction).first()
     assert retrieved_transaction.state == TransactionState.DEPOSIT_PENDING
     assert retrieved_transaction.deposit_transaction is not None
+
+
+def test_complete_withdrawal_reschedules_while_in_progress(session, patched_tasks):
+    funding_transaction = _funding_transaction(session)
+    _withdraw(funding_transaction)
+    session.refresh(funding_transaction)
+    withdrawal_id = funding_transaction.withdrawal_transaction.external_transaction_uid
+
+    complete_withdrawal(funding_transaction.id)
+
+    session.refresh(funding_transaction)
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+    [(retry_args, countdown)] = patched_tasks["complete_withdrawal"].calls
+    assert retry_args == (funding_transaction.id, withdrawal_id, 1)
+    assert countdown == tasks.poll_countdown(1)
+
+
+def test_complete_withdrawal_leaves_deposit_to_the_sweep(session, patched_tasks):
+    funding_transaction = _funding_transaction(session)
+    _withdraw(funding_transaction)
+    session.refresh(funding_transaction)
+    withdrawal = funding_transaction.withdrawal_transaction
+    tasks.investor_account_service._complete_withdrawal(
+        withdrawal.external_transaction_uid
+    )
+
+    complete_withdrawal(funding_transaction.id)
+
+    session.refresh(funding_transaction)
+    session.refresh(withdrawal)
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_COMPLETED
+    assert withdrawal.state == SingleTransferState.TRANSFER_COMPLETED
+    assert funding_transaction.deposit_transaction is None
+
+
+def test_complete_deposit(session, patched_tasks):
+    funding_transaction = _funding_transaction(
+        session, state=TransactionState.WITHDRAWAL_COMPLETED
+    )
+    process_deposit(funding_transaction.id)
+    session.refresh(funding_transaction)
+    deposit_id = funding_transaction.deposit_transaction.external_transaction_uid
+
+    complete_deposit(funding_transaction.id)
+    session.refresh(funding_transaction)
+    assert funding_transaction.state == TransactionState.DEPOSIT_PENDING
+    [(retry_args, countdown)] = patched_tasks["complete_deposit"].calls
+    assert retry_args == (funding_transaction.id, deposit_id, 1)
+    assert countdown == tasks.poll_countdown(1)
+
+    tasks.fund_account_service._complete_deposit("4321", deposit_id)
+    complete_deposit(funding_transaction.id)
+    session.refresh(funding_transaction)
+    assert funding_transaction.state == TransactionState.DEPOSIT_COMPLETED
+    # The notification is left in the outbox for the dispatcher
+    [notification] = session.query(NotificationOutbox).all()
+    assert notification.funding_transaction_id == funding_transaction.id
+    assert notification.delivered_at is None
+
+
+def test_complete_tasks_return_when_the_batch_is_missing(session, patched_tasks):
+    withdrawing = _funding_transaction(
+        session, state=TransactionState.WITHDRAWAL_PENDING
+    )
+    depositing = _funding_transaction(session, state=TransactionState.DEPOSIT_PENDING)
+
+    complete_withdrawal(withdrawing.id, "provider-withdrawal")
+    complete_deposit(depositing.id, "provider-deposit")
+
+    session.expire_all()
+    assert withdrawing.state == TransactionState.WITHDRAWAL_PENDING
+    assert depositing.state == TransactionState.DEPOSIT_PENDING
+    assert patched_tasks["complete_withdrawal"].calls == []
+    assert patched_tasks["complete_deposit"].calls == []
+
+
+def test_poll_countdown_is_capped():
+    assert tasks.poll_countdown(0) == tasks.STATUS_POLL_COUNTDOWN
+    assert tasks.poll_countdown(1) == 2 * tasks.STATUS_POLL_COUNTDOWN
+    assert tasks.poll_countdown(50) == tasks.STATUS_POLL_MAX_COUNTDOWN
+
+
+def test_process_withdrawal_duplicate_delivery(session, patched_tasks):
+    funding_transaction = _funding_transaction(session)
+
+    process_withdrawal(funding_transaction.id)
+    process_withdrawal(funding_transaction.id)
+    withdraw_investor_batch(funding_transaction.investor_account_id)
+    withdraw_investor_batch(funding_transaction.investor_account_id)
+
+    session.refresh(funding_transaction)
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+    assert funding_transaction.version == 2
+    assert tasks.investor_account_service.check_balance("1234") == Money(900, "USD")
+
+
+def test_stale_duplicate_delivery_leaves_the_winner_alone(session, patched_tasks):
+    funding_transaction = _funding_transaction(session)
+    funding_transaction.fund_account.seat_availability = 1
+    session.commit()
+    delivered = []
+
+    def duplicate_delivered(fund_account, context):
+        # The stale delivery has read the transfer as INITIATED; another
+        # delivery claims it, and then the stale one hits an error
+        if delivered:
+            return
+        delivered.append(True)
+        process_withdrawal(funding_transaction.id)
+        raise ValueError("Provider rejected the account")
+
+    event.listen(FundAccount, "load", duplicate_delivered)
+    try:
+        with pytest.raises(ValueError, match="Provider rejected"):
+            process_withdrawal(funding_transaction.id)
+    finally:
+        event.remove(FundAccount, "load", duplicate_delivered)
+
+    session.expire_all()
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+    assert session.query(BalanceHold).count() == 1
+    assert seat_usage(session, funding_transaction.fund_account_id) == (1, 1)
+
+
+def test_duplicate_that_loses_the_claim_touches_no_holds_or_seats(
+    session, session_factory, patched_tasks, monkeypatch
+):
+    funding_transaction = _funding_transaction(session)
+
+    def claimed_elsewhere(fund_account, context):
+        # Another delivery claims the transfer after this one read it
+        with session_factory() as other:
+            FundingTransaction.compare_and_set_state(
+                other,
+                funding_transaction.id,
+                TransactionState.INITIATED,
+                TransactionState.WITHDRAWAL_PENDING,
+            )
+            other.commit()
+
+    monkeypatch.setattr(
+        tasks, "reserve_seat", lambda *args: pytest.fail("Duplicate took a seat")
+    )
+    event.listen(FundAccount, "load", claimed_elsewhere)
+    try:
+        process_withdrawal(funding_transaction.id)
+    finally:
+        event.remove(FundAccount, "load", claimed_elsewhere)
+
+    session.expire_all()
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+    assert session.query(BalanceHold).count() == 0
+    assert session.query(InvestorBalance).count() == 0
+
+
+def test_process_withdrawal_fails_when_fund_is_full(session, patched_tasks):
+    first = _funding_transaction(session)
+    first.fund_account.seat_availability = 1
+    second = FundingTransaction(
+        investor_account=first.investor_account,
+        fund_account=first.fund_account,
+        amount_minor=100_00,
+        state=TransactionState.INITIATED,
+    )
+    session.add(second)
+    session.commit()
+
+    process_withdrawal(first.id)
+    with pytest.raises(ValueError, match="No seats"):
+        process_withdrawal(second.id)
+    withdraw_investor_batch(first.investor_account_id)
+
+    session.refresh(first)
+    session.refresh(second)
+    assert first.state == TransactionState.WITHDRAWAL_PENDING
+    assert second.state == TransactionState.FAILED
+    assert seat_usage(session, first.fund_account_id) == (1, 1)
+    # Nothing was withdrawn for the rejected transfer
+    assert tasks.investor_account_service.check_balance("1234") == Money(900, "USD")
+
+
+def test_process_withdrawal_enforces_minimum_investment(session, patched_tasks):
+    funding_transaction = _funding_transaction(session)
+    funding_transaction.fund_account.min_investment_minor = 500_00
+    session.commit()
+
+    with pytest.raises(ValueError, match="minimum investment"):
+        process_withdrawal(funding_transaction.id)
+
+    session.refresh(funding_transaction)
+    assert funding_transaction.state == TransactionState.FAILED
+
+
+def test_process_withdrawal_insufficient_funds(session, patched_tasks):
+    funding_transaction = _funding_transaction(session)
+    funding_transaction.amount_minor = 5000_00
+    session.commit()
+
+    with pytest.raises(ValueError, match="Insufficient funds"):
+        process_withdrawal(funding_transaction.id)
+
+    session.refresh(funding_transaction)
+    assert funding_transaction.state == TransactionState.FAILED
+    assert funding_transaction.withdrawal_transaction is None
+
+
+def _sibling_transactions(session, count):
+    first = _funding_transaction(session)
+    siblings = [
+        FundingTransaction(
+            investor_account=first.investor_account,
+            fund_account=FundAccount(external_account_uid=f"fund-{i}"),
+            amount_minor=100_00,
+            state=TransactionState.INITIATED,
+        )
+        for i in range(count - 1)
+    ]
+    session.add_all(siblings)
+    session.commit()
+    return [first, *siblings]
+
+
+def test_withdrawals_are_coalesced_per_investor(session, patched_tasks):
+    transactions = _sibling_transactions(session, 3)
+    for transaction in transactions:
+        process_withdrawal(transaction.id)
+
+    withdraw_investor_batch(transactions[0].investor_account_id)
+
+    session.expire_all()
+    [withdrawal] = session.query(WithdrawalTransaction).all()
+    assert withdrawal.amount_minor == 300_00
+    assert withdrawal.state == SingleTransferState.TRANSFER_PENDING
+    assert sorted(t.id for t in withdrawal.funding_transactions) == sorted(
+        t.id for t in transactions
+    )
+    service = tasks.investor_account_service
+    assert len(service._transactions) == 1
+    assert service.check_balance("1234") == Money(700, "USD")
+
+
+def test_complete_withdrawal_advances_the_whole_batch(session, patched_tasks):
+    transactions = _sibling_transactions(session, 2)
+    for transaction in transactions:
+        process_withdrawal(transaction.id)
+    withdraw_investor_batch(transactions[0].investor_account_id)
+    session.expire_all()
+    withdrawal = transactions[0].withdrawal_transaction
+    tasks.investor_account_service._complete_withdrawal(
+        withdrawal.external_transaction_uid
+    )
+
+    complete_withdrawal(transactions[0].id)
+
+    session.expire_all()
+    assert all(t.state == TransactionState.WITHDRAWAL_COMPLETED for t in transactions)
+
+
+def test_failed_withdrawal_fails_the_whole_batch(session, patched_tasks):
+    transactions = _sibling_transactions(session, 2)
+    for transaction in transactions:
+        process_withdrawal(transaction.id)
+    withdraw_investor_batch(transactions[0].investor_account_id)
+    session.expire_all()
+    withdrawal = transactions[0].withdrawal_transaction
+    tasks.investor_account_service._fail_withdrawal(withdrawal.external_transaction_uid)
+
+    with pytest.raises(ValueError, match="Withdrawal failed"):
+        complete_withdrawal(transactions[0].id)
+
+    session.expire_all()
+    assert withdrawal.state == SingleTransferState.FAILED
+    assert all(t.state == TransactionState.FAILED for t in transactions)
+
+
+def test_provider_rejection_fails_the_whole_batch(session, patched_tasks, monkeypatch):
+    transactions = _sibling_transactions(session, 2)
+    for transaction in transactions:
+        process_withdrawal(transaction.id)
+    monkeypatch.setattr(
+        tasks.investor_account_service, "withdraw_funds", lambda **kwargs: None
+    )
+
+    with pytest.raises(ValueError, match="Withdrawal failed"):
+        withdraw_investor_batch(transactions[0].investor_account_id)
+
+    session.expire_all()
+    assert all(t.state == TransactionState.FAILED for t in transactions)
+    assert (
+        session.query(WithdrawalTransaction).one().state == SingleTransferState.FAILED
+    )
+    assert (
+        session.get(InvestorBalance, transactions[0].investor_account_id).held_minor
+        == 0
+    )
+
+
+def _fund_transactions(session, count):
+    first = _funding_transaction(session, state=TransactionState.WITHDRAWAL_COMPLETED)
+    others = [
+        FundingTransaction(
+            investor_account=InvestorAccount(external_account_uid=f"investor-{i}"),
+            fund_account=first.fund_account,
+            amount_minor=100_00,
+            state=TransactionState.WITHDRAWAL_COMPLETED,
+        )
+        for i in range(count - 1)
+    ]
+    session.add_all(others)
+    session.commit()
+    return [first, *others]
+
+
+def test_deposit_fund_batch_makes_one_deposit_per_fund(session, patched_tasks):
+    transactions = _fund_transactions(session, 3)
+    other_fund = FundingTransaction(
+        investor_account=transactions[0].investor_account,
+        fund_account=FundAccount(external_account_uid="other"),
+        amount_minor=100_00,
+        state=TransactionState.WITHDRAWAL_COMPLETED,
+    )
+    session.add(other_fund)
+    session.commit()
+
+    deposit_fund_batch(transactions[0].fund_account_id)
+    deposit_fund_batch(transactions[0].fund_account_id)
+
+    session.expire_all()
+    [deposit] = session.query(FundDepositTransaction).all()
+    assert deposit.amount_minor == 300_00
+    assert deposit.state == SingleTransferState.TRANSFER_PENDING
+    assert all(t.state == TransactionState.DEPOSIT_PENDING for t in transactions)
+    assert all(t.deposit_transaction_id == deposit.id for t in transactions)
+    assert other_fund.state == TransactionState.WITHDRAWAL_COMPLETED
+    # Batched transitions keep the fund summaries in step
+    assert check_summary(session) == []
+    assert list(tasks.fund_account_service.deposits["4321"]) == [
+        deposit.external_transaction_uid
+    ]
+
+
+def test_complete_deposit_advances_the_whole_batch(session, patched_tasks):
+    transactions = _fund_transactions(session, 2)
+    deposit_fund_batch(transactions[0].fund_account_id)
+    session.expire_all()
+    deposit = transactions[0].deposit_transaction
+    tasks.fund_account_service._complete_deposit(
+        "4321", deposit.external_transaction_uid
+    )
+
+    complete_deposit(transactions[0].id)
+
+    session.expire_all()
+    assert deposit.state == SingleTransferState.TRANSFER_COMPLETED
+    assert all(t.state == TransactionState.DEPOSIT_COMPLETED for t in transactions)
+
+
+def test_failed_deposit_fails_the_whole_batch(session, patched_tasks):
+    transactions = _fund_transactions(session, 2)
+    deposit_fund_batch(transactions[0].fund_account_id)
+    session.expire_all()
+    deposit = transactions[0].deposit_transaction
+    tasks.fund_account_service._fail_deposit("4321", deposit.external_transaction_uid)
+
+    with pytest.raises(ValueError, match="Deposit failed"):
+        complete_deposit(transactions[0].id)
+
+    session.expire_all()
+    assert deposit.state == SingleTransferState.FAILED
+    assert all(t.state == TransactionState.FAILED for t in transactions)
+
+
+def test_provider_rejection_fails_the_deposit_batch(
+    session, patched_tasks, monkeypatch
+):
+    transactions = _fund_transactions(session, 2)
+    monkeypatch.setattr(
+        tasks.fund_account_service, "deposit_funds", lambda **kwargs: None
+    )
+
+    with pytest.raises(ValueError, match="Deposit failed"):
+        deposit_fund_batch(transactions[0].fund_account_id)
+
+    session.expire_all()
+    assert session.query(FundDepositTransaction).one().state == (
+        SingleTransferState.FAILED
+    )
+    assert all(t.state == TransactionState.FAILED for t in transactions)
+
+
+def _lost_response(call):
+    """
+    The provider acts on the first call but the response never arrives.
+    """
+    calls = []
+
+    def flaky(**kwargs):
+        calls.append(kwargs)
+        result = call(**kwargs)
+        if len(calls) == 1:
+            raise TransientProviderError("Read timed out")
+        return result
+
+    return flaky, calls
+
+
+def test_transient_withdrawal_failure_is_retried_once(
+    session, patched_tasks, monkeypatch
+):
+    transactions = _sibling_transactions(session, 2)
+    for transaction in transactions:
+        process_withdrawal(transaction.id)
+    service = tasks.investor_account_service
+    flaky, calls = _lost_response(service.withdraw_funds)
+    monkeypatch.setattr(service, "withdraw_funds", flaky)
+
+    withdraw_investor_batch.apply((transactions[0].investor_account_id,))
+
+    session.expire_all()
+    [withdrawal] = session.query(WithdrawalTransaction).all()
+    assert withdrawal.state == SingleTransferState.TRANSFER_PENDING
+    assert all(t.state == TransactionState.WITHDRAWAL_PENDING for t in transactions)
+    assert all(t.retries == 1 for t in transactions)
+    # The retry carried the same idempotency key, so the money moved once
+    assert len(calls) == 2
+    assert calls[0]["idempotency_key"] == calls[1]["idempotency_key"]
+    assert list(service._transactions) == [withdrawal.external_transaction_uid]
+    assert service.check_balance("1234") == Money(800, "USD")
+
+
+def test_transient_deposit_failure_is_retried(session, patched_tasks, monkeypatch):
+    [transaction] = _fund_transactions(session, 1)
+    service = tasks.fund_account_service
+    flaky, calls = _lost_response(service.deposit_funds)
+    monkeypatch.setattr(service, "deposit_funds", flaky)
+
+    process_deposit(transaction.id)
+
+    session.expire_all()
+    deposit = transaction.deposit_transaction
+    assert deposit.state == SingleTransferState.TRANSFER_PENDING
+    assert transaction.state == TransactionState.DEPOSIT_PENDING
+    assert len(calls) == 2
+    assert list(service.deposits["4321"]) == [deposit.external_transaction_uid]
+
+
+def test_spent_retry_budget_fails_the_transfer(session, patched_tasks, monkeypatch):
+    funding_transaction = _funding_transaction(session)
+    process_withdrawal(funding_transaction.id)
+    funding_transaction.retries = TRANSACTION_RETRY_BUDGET
+    session.commit()
+
+    def unavailable(**kwargs):
+        raise TransientProviderError("Service unavailable")
+
+    monkeypatch.setattr(tasks.investor_account_service, "withdraw_funds", unavailable)
+
+    result = withdraw_investor_batch.apply((funding_transaction.investor_account_id,))
+
+    assert isinstance(result.result, TransientProviderError)
+
+    session.expire_all()
+    assert funding_transaction.state == TransactionState.FAILED
+    assert funding_transaction.withdrawal_transaction.state == (
+        SingleTransferState.FAILED
+    )
+
+
+def test_database_lock_errors_are_retried(session, patched_tasks, monkeypatch):
+    funding_transaction = _funding_transaction(session)
+    place_hold = tasks.place_hold
+    calls = []
+
+    def locked_once(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise OperationalError(
+                "UPDATE investor_balance", {}, Exception("database is locked")
+            )
+        return place_hold(*args, **kwargs)
+
+    monkeypatch.setattr(tasks, "place_hold", locked_once)
+
+    process_withdrawal.apply((funding_transaction.id,))
+
+    session.expire_all()
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+    assert funding_transaction.retries == 1
+    assert len(calls) == 2
+
+
+def test_sql_errors_are_not_retried(session, patched_tasks, monkeypatch):
+    funding_transaction = _funding_transaction(session)
+
+    def bad_sql(*args, **kwargs):
+        raise OperationalError(
+            "UPDATE investor_balanse", {}, Exception("no such table: investor_balanse")
+        )
+
+    monkeypatch.setattr(tasks, "place_hold", bad_sql)
+
+    result = process_withdrawal.apply((funding_transaction.id,))
+
+    assert isinstance(result.result, OperationalError)
+    session.expire_all()
+    assert funding_transaction.state == TransactionState.FAILED
+    assert funding_transaction.retries == 0
+
+
+@pytest.fixture
+def locked_batch_commits(session_factory, patched_tasks, monkeypatch):
+    """
+    The commit after each provider withdrawal hits a database lock, for the
+    next `locked_batch_commits["left"]` withdrawals, or all while it is None.
+    """
+    locks = {"left": None, "armed": False}
+    service = tasks.investor_account_service
+    withdraw_funds = service.withdraw_funds
+
+    def withdraw_then_lock(**kwargs):
+        withdrawal = withdraw_funds(**kwargs)
+        if locks["left"] != 0:
+            locks["armed"] = True
+            if locks["left"] is not None:
+                locks["left"] -= 1
+        return withdrawal
+
+    def locked(session):
+        if locks["armed"]:
+            locks["armed"] = False
+            raise OperationalError("COMMIT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(service, "withdraw_funds", withdraw_then_lock)
+    event.listen(session_factory, "before_commit", locked)
+    yield locks
+    event.remove(session_factory, "before_commit", locked)
+
+
+def test_commit_lock_after_the_withdrawal_is_retried(
+    session, patched_tasks, locked_batch_commits
+):
+    locked_batch_commits["left"] = 1
+    funding_transaction = _funding_transaction(session)
+    process_withdrawal(funding_transaction.id)
+    service = tasks.investor_account_service
+
+    withdraw_investor_batch.apply((funding_transaction.investor_account_id,))
+
+    session.expire_all()
+    withdrawal = funding_transaction.withdrawal_transaction
+    assert withdrawal.state == SingleTransferState.TRANSFER_PENDING
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+    assert funding_transaction.retries == 1
+    # The retry reused the idempotency key, so the money moved once
+    assert list(service._transactions) == [withdrawal.external_transaction_uid]
+    assert service.check_balance("1234") == Money(900, "USD")
+
+
+def test_accepted_withdrawal_is_never_failed(
+    session, patched_tasks, locked_batch_commits
+):
+    funding_transaction = _funding_transaction(session)
+    process_withdrawal(funding_transaction.id)
+    funding_transaction.retries = TRANSACTION_RETRY_BUDGET
+    session.commit()
+    service = tasks.investor_account_service
+
+    result = withdraw_investor_batch.apply((funding_transaction.investor_account_id,))
+
+    assert isinstance(result.result, OperationalError)
+    session.expire_all()
+    withdrawal = funding_transaction.withdrawal_transaction
+    assert withdrawal.state == SingleTransferState.INITIATED
+    assert funding_transaction.state == TransactionState.WITHDRAWAL_PENDING
+
+    # Resumed, as the sweep would once it has stalled
+    locked_batch_commits["left"] = 0
+    withdraw_investor_batch.apply(
+        (funding_transaction.investor_account_id, withdrawal.id)
+    )
+
+    session.expire_all()
+    assert withdrawal.state == SingleTransferState.TRANSFER_PENDING
+    assert list(service._transactions) == [withdrawal.external_transaction_uid]
+    assert service.check_balance("1234") == Money(900, "USD")
+
+
+def test_sweep_resumes_stalled_withdrawal_batches(session, patched_tasks, monkeypatch):
+    monkeypatch.setattr(tasks, "STALLED_BATCH_AFTER", 0)
+    funding_transaction = _funding_transaction(
+        session, TransactionState.WITHDRAWAL_PENDING
+    )
+    withdrawal = WithdrawalTransaction(
+        investor_account=funding_transaction.investor_account,
+        amount_minor=100_00,
+        state=SingleTransferState.INITIATED,
+    )
+    session.add(withdrawal)
+    session.commit()
+
+    sweep_pending_transactions()
+
+    investor_account_id = funding_transaction.investor_account_id
+    assert patched_tasks["withdraw_investor_batch"].calls == [
+        ((investor_account_id, withdrawal.id), None),
+        ((investor_account_id, None), None),
+    ]
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from money_movement.models import (
+    FundAccount,
+    FundingTransaction,
+    InvestorAccount,
+    TransactionState,
+    TransitionEvent,
+    WithdrawalTransaction,
+)
+from money_movement.transition_log import dwell_times, entity_history
+
+
+def _initiated_transactions(session, count):
+    investor_account = InvestorAccount(external_account_uid="1234")
+    fund_account = FundAccount(external_account_uid="4321")
+    transactions = [
+        FundingTransaction(
+            investor_account=investor_account,
+            fund_account=fund_account,
+            amount_minor=100_00,
+            state=TransactionState.INITIATED,
+        )
+        for _ in range(count)
+    ]
+    session.add_all(transactions)
+    session.commit()
+    return transactions
+
+
+@pytest.fixture
+def statements(engine):
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
+
+
+def test_committed_transitions_are_logged_in_one_insert(session, statements):
+    transactions = _initiated_transactions(session, 3)
+    statements.clear()
+
+    FundingTransaction.transition_all_cas(
+        session, transactions, TransactionState.WITHDRAWAL_PENDING
+    )
+    session.commit()
+    # Nothing new to write
+    session.commit()
+
+    inserts = [s for s in statements if s.startswith("INSERT INTO transition_event")]
+    assert len(inserts) == 1
+    events = session.query(TransitionEvent).order_by(TransitionEvent.id).all()
+    assert [(e.entity, e.entity_id) for e in events] == [
+        ("funding_transaction", t.id) for t in transactions
+    ]
+    assert all(e.from_state == "INITIATED" for e in events)
+    assert all(e.to_state == "WITHDRAWAL_PENDING" for e in events)
+    assert all(e.version == 2 for e in events)
+
+
+def test_rolled_back_transitions_are_not_logged(session):
+    [transaction] = _initiated_transactions(session, 1)
+
+    transaction.transition_cas(session, TransactionState.WITHDRAWAL_PENDING)
+    session.rollback()
+    session.commit()
+
+    assert session.query(TransitionEvent).count() == 0
+
+
+def test_entity_history(session):
+    [transaction] = _initiated_transactions(session, 1)
+    transaction.transition_cas(session, TransactionState.WITHDRAWAL_PENDING)
+    session.commit()
+    transaction.transition_cas(session, TransactionState.FAILED)
+    session.commit()
+
+    history = entity_history(session, FundingTransaction, transaction.id)
+
+    assert [(e.from_state, e.to_state) for e in history] == [
+        ("INITIATED", "WITHDRAWAL_PENDING"),
+        ("WITHDRAWAL_PENDING", "FAILED"),
+    ]
+    assert entity_history(session, WithdrawalTransaction, transaction.id) == []
+
+
+def _log(session, entity_id, *stays, entity="funding_transaction"):
+    at = datetime(2024, 1, 1)
+    for from_state, to_state, seconds in stays:
+        session.add(
+            TransitionEvent(
+                entity=entity,
+                entity_id=entity_id,
+                from_state=from_state,
+                to_state=to_state,
+                occurred_at=at,
+            )
+        )
+        at += timedelta(seconds=seconds)
+
+
+def test_dwell_times(session):
+    for entity_id, pending_seconds in enumerate([10, 20, 30, 40], start=1):
+        _log(
+            session,
+            entity_id,
+            ("INITIATED", "WITHDRAWAL_PENDING", pending_seconds),
+            ("WITHDRAWAL_PENDING", "WITHDRAWAL_COMPLETED", 5),
+            ("WITHDRAWAL_COMPLETED", "DEPOSIT_PENDING", 0),
+        )
+    # Still pending, so not counted
+    _log(session, 5, ("INITIATED", "WITHDRAWAL_PENDING", 999))
+    # Other models are left out
+    _log(
+        session, 1, ("INITIATED", "TRANSFER_PENDING", 50), entity="deposit_transaction"
+    )
+    _log(session, 1, ("TRANSFER_PENDING", "TRANSFER_COMPLETED", 0), entity="x")
+    session.commit()
+
+    stats = dwell_times(session, FundingTransaction)
+
+    assert set(stats) == {"WITHDRAWAL_PENDING", "WITHDRAWAL_COMPLETED"}
+    pending = stats["WITHDRAWAL_PENDING"]
+    assert pending.count == 4
+    assert pending.mean == 25
+    assert pending.p50 == 20
+    assert pending.max == 40
+    assert stats["WITHDRAWAL_COMPLETED"].count == 4
+    assert stats["WITHDRAWAL_COMPLETED"].p99 == 5
+
+
+def test_dwell_times_since(session):
+    _log(
+        session,
+        1,
+        ("INITIATED", "WITHDRAWAL_PENDING", 10),
+        ("WITHDRAWAL_PENDING", "FAILED", 0),
+    )
+
+    assert dwell_times(session, FundingTransaction, since=datetime(2023, 1, 1))
+    assert dwell_times(session, FundingTransaction, since=datetime(2025, 1, 1)) == {}